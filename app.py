@@ -1,15 +1,43 @@
 # -*- coding: utf-8 -*-
 from flask import (
-    Flask, render_template, request, redirect, url_for, session, jsonify, flash
+    Flask, render_template, request, redirect, url_for, session, jsonify, flash, g,
+    get_template_attribute, appcontext_pushed
 )
-from flask_mysqldb import MySQL
+from jinja2 import FileSystemBytecodeCache
+import click
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
+from werkzeug.middleware.proxy_fix import ProxyFix
 # FIX: Use timezone-aware datetimes instead of deprecated utcnow
 from datetime import datetime, timedelta, date, timezone
 import traceback
+import hashlib
+import json
+import time
+import threading
 import os
 
+from helpers import (
+    ensure_dir, allowed_file, validate_animal_fields, encode_cursor, decode_cursor,
+    RESCUE_ALLOWED_EXTENSIONS, ALLOWED_EXTENSIONS, IMAGE_EXTENSIONS
+)
+import bulk_import
+import storage
+import rate_limit
+import triage
+import db_routing
+import idempotency
+import rows
+import dashboard_sections
+import recommend
+import audit
+import query_profiler
+import matching
+import inbox
+import circuit_breaker
+import catalogue_snapshot
+import image_sanitiser
+
 
 # Initialize Flask App
 app = Flask(__name__)
@@ -21,38 +49,237 @@ app.config['MYSQL_USER'] = os.environ.get('MYSQL_USER', 'root')
 app.config['MYSQL_PASSWORD'] = os.environ.get('MYSQL_PASSWORD', '')
 app.config['MYSQL_DB'] = os.environ.get('MYSQL_DB', 'animal_rescue_db')
 app.config['MYSQL_CURSORCLASS'] = 'DictCursor'
+app.config['MYSQL_CONNECT_TIMEOUT'] = int(os.environ.get('MYSQL_CONNECT_TIMEOUT', 5)) # Fail fast while MySQL restarts
 app.config['SESSION_PERMANENT'] = True
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=7)
 
-# Initialize MySQL
-mysql = MySQL(app)
+app.config['MYSQL_REPLICAS'] = os.environ.get('MYSQL_REPLICAS', '') # "host[:port],..." for read-only routes
+app.config['READ_STICKY_SECONDS'] = int(os.environ.get('READ_STICKY_SECONDS', 10))
+app.config['REPLICA_MAX_LAG_SECONDS'] = int(os.environ.get('REPLICA_MAX_LAG_SECONDS', 5))
+
+# MySQL (primary) and the read-replica router are bound to the app in init_extensions(),
+# called from create_app(); importing this module opens nothing and touches no disk.
+# Every connection they hand out is instrumented by the query profiler.
+profiler = query_profiler.QueryProfiler()
+mysql = query_profiler.ProfiledMySQL(profiler)
+db_router = db_routing.ReplicaRouter(mysql)
 
 # File Upload Configuration
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 UPLOAD_FOLDER_ADOPTIONS = os.path.join(BASE_DIR, 'static', 'uploads', 'adoptions')
 UPLOAD_FOLDER_ANIMALS = os.path.join(BASE_DIR, 'static', 'uploads', 'animals')
 UPLOAD_FOLDER_RESCUES = os.path.join(BASE_DIR, 'static', 'uploads', 'rescues')
-RESCUE_ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf'}
-IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 app.config['UPLOAD_FOLDER_ADOPTIONS'] = UPLOAD_FOLDER_ADOPTIONS
 app.config['UPLOAD_FOLDER_ANIMALS'] = UPLOAD_FOLDER_ANIMALS
 app.config['UPLOAD_FOLDER_RESCUES'] = UPLOAD_FOLDER_RESCUES
-
-# --- Helper Functions ---
-def ensure_dir(directory):
-    if not os.path.exists(directory):
-        try: os.makedirs(directory); print(f"Created: {directory}")
-        except OSError as e: print(f"ERROR creating {directory}: {e}"); return False
-    return True
-
-if not ensure_dir(UPLOAD_FOLDER_ADOPTIONS): print("WARNING: Adoptions upload folder issue.")
-if not ensure_dir(UPLOAD_FOLDER_ANIMALS): print("WARNING: Animals upload folder issue.")
-if not ensure_dir(UPLOAD_FOLDER_RESCUES): print("WARNING: Rescues upload folder issue.")
-
-def allowed_file(filename, allowed_set=ALLOWED_EXTENSIONS):
-    if not isinstance(filename, str) or not filename: return False
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_set
+# Bulk import: uploaded manifests/archives and their resume state live outside static/
+app.config['IMPORT_FOLDER'] = os.environ.get('IMPORT_FOLDER', os.path.join(app.instance_path, 'imports'))
+app.config['IMPORT_BATCH_SIZE'] = int(os.environ.get('IMPORT_BATCH_SIZE', bulk_import.DEFAULT_BATCH_SIZE))
+app.config['IMPORT_WORKERS'] = int(os.environ.get('IMPORT_WORKERS', bulk_import.DEFAULT_WORKERS))
+app.config['IMPORT_SANITISER_WAIT_SECONDS'] = float(os.environ.get('IMPORT_SANITISER_WAIT_SECONDS', bulk_import.DEFAULT_SANITISER_WAIT_SECONDS))
+# Upload storage lifecycle: per-user quota (0 disables) and the orphan sweeper's resume state
+app.config['UPLOAD_QUOTA_BYTES'] = int(os.environ.get('UPLOAD_QUOTA_BYTES', storage.DEFAULT_QUOTA_BYTES))
+# Uploaded images are checked and re-encoded (metadata stripped, longest side capped) by IMAGE_WORKERS
+# processes per web worker. At most IMAGE_QUEUE_SIZE uploads wait for them; beyond that requests get a 503.
+app.config['IMAGE_WORKERS'] = int(os.environ.get('IMAGE_WORKERS', image_sanitiser.DEFAULT_WORKERS))
+app.config['IMAGE_QUEUE_SIZE'] = int(os.environ.get('IMAGE_QUEUE_SIZE', image_sanitiser.DEFAULT_QUEUE_SIZE))
+app.config['IMAGE_QUEUE_WAIT_SECONDS'] = float(os.environ.get('IMAGE_QUEUE_WAIT_SECONDS', image_sanitiser.DEFAULT_QUEUE_WAIT_SECONDS))
+app.config['IMAGE_MAX_SIDE'] = int(os.environ.get('IMAGE_MAX_SIDE', image_sanitiser.DEFAULT_MAX_SIDE))
+app.config['IMAGE_MAX_PIXELS'] = int(os.environ.get('IMAGE_MAX_PIXELS', image_sanitiser.DEFAULT_MAX_PIXELS))
+app.config['IMAGE_TIMEOUT_SECONDS'] = float(os.environ.get('IMAGE_TIMEOUT_SECONDS', image_sanitiser.DEFAULT_TIMEOUT_SECONDS))
+app.config['IMAGE_JPEG_QUALITY'] = int(os.environ.get('IMAGE_JPEG_QUALITY', image_sanitiser.DEFAULT_JPEG_QUALITY))
+# Adoption grid: cards rendered server-side; the rest stream in from /api/animals as the user scrolls
+app.config['ADOPTION_PAGE_SIZE'] = int(os.environ.get('ADOPTION_PAGE_SIZE', 12))
+# Dashboard sections (posted animals, adoption requests, donations) are paged the same way
+app.config['DASHBOARD_PAGE_SIZE'] = int(os.environ.get('DASHBOARD_PAGE_SIZE', dashboard_sections.DEFAULT_PAGE_SIZE))
+# Recommendations: how often each worker pulls listings/requests added elsewhere, and list length
+app.config['RECOMMEND_REFRESH_SECONDS'] = int(os.environ.get('RECOMMEND_REFRESH_SECONDS', 300))
+app.config['RECOMMEND_LIMIT'] = int(os.environ.get('RECOMMEND_LIMIT', 8))
+app.config['RECOMMEND_SNAPSHOT'] = os.environ.get('RECOMMEND_SNAPSHOT', os.path.join(app.instance_path, 'recommend.npz'))
+# Audit log: events are appended to local segment files and bulk-inserted every AUDIT_FLUSH_SECONDS
+app.config['AUDIT_SEGMENT_DIR'] = os.environ.get('AUDIT_SEGMENT_DIR', os.path.join(app.instance_path, 'audit'))
+app.config['AUDIT_FLUSH_SECONDS'] = int(os.environ.get('AUDIT_FLUSH_SECONDS', audit.DEFAULT_FLUSH_SECONDS))
+# Rate limits for anonymous write routes, as "<requests>/<seconds>" per client IP and per logged-in user.
+# Override one with e.g. RATE_LIMIT_RESCUE_PAGE="10/60", or disable it with "off".
+DEFAULT_RATE_LIMITS = {
+    'register': '5/300', 'rescue_page': '5/300', 'donate_page': '10/300',
+    'contact_page': '5/300', 'volunteer_page': '3/300', 'foster_page': '3/300',
+}
+app.config['RATE_LIMITS'] = {
+    endpoint: rate_limit.parse_limit(os.environ.get(f'RATE_LIMIT_{endpoint.upper()}', default))
+    for endpoint, default in DEFAULT_RATE_LIMITS.items()
+}
+app.config['RATE_LIMIT_STORE'] = os.environ.get('RATE_LIMIT_STORE', os.path.join(app.instance_path, 'ratelimit.bin'))
+# Number of reverse proxies (nginx, a load balancer) in front of the app. X-Forwarded-For/-Proto are
+# trusted from that many hops only, so request.remote_addr is the real client and can't be spoofed.
+# Leave at 0 when clients connect directly; behind a proxy, 0 puts every visitor in the proxy's bucket.
+app.config['TRUSTED_PROXIES'] = int(os.environ.get('TRUSTED_PROXIES', 0))
+app.config['TRIAGE_REFRESH_SECONDS'] = int(os.environ.get('TRIAGE_REFRESH_SECONDS', 30))
+# Contact inbox: page size, and how many near-identical messages make a cluster spam (0 disables)
+app.config['INBOX_PAGE_SIZE'] = int(os.environ.get('INBOX_PAGE_SIZE', inbox.DEFAULT_PAGE_SIZE))
+app.config['CONTACT_SPAM_CLUSTER_SIZE'] = int(os.environ.get('CONTACT_SPAM_CLUSTER_SIZE', inbox.DEFAULT_SPAM_CLUSTER_SIZE))
+# Volunteer/foster matching indexes are rebuilt from their tables this often (per worker)
+app.config['MATCH_REFRESH_SECONDS'] = int(os.environ.get('MATCH_REFRESH_SECONDS', 60))
+# Offline reads: the public catalogue is snapshotted to a local file every CATALOGUE_SNAPSHOT_SECONDS and
+# served from it while MySQL is unreachable. After CATALOGUE_BREAKER_FAILURES consecutive failed (or slower
+# than CATALOGUE_SLOW_SECONDS) reads, a worker stops trying MySQL and probes it every CATALOGUE_PROBE_SECONDS.
+app.config['CATALOGUE_SNAPSHOT'] = os.environ.get('CATALOGUE_SNAPSHOT', os.path.join(app.instance_path, 'catalogue.snap'))
+app.config['CATALOGUE_SNAPSHOT_SECONDS'] = int(os.environ.get('CATALOGUE_SNAPSHOT_SECONDS', catalogue_snapshot.DEFAULT_REFRESH_SECONDS))
+app.config['CATALOGUE_BREAKER_FAILURES'] = int(os.environ.get('CATALOGUE_BREAKER_FAILURES', 3))
+app.config['CATALOGUE_PROBE_SECONDS'] = int(os.environ.get('CATALOGUE_PROBE_SECONDS', 5))
+app.config['CATALOGUE_SLOW_SECONDS'] = float(os.environ.get('CATALOGUE_SLOW_SECONDS', 2.0))
+app.config['STORAGE_STATE_PATH'] = os.environ.get('STORAGE_STATE_PATH', os.path.join(app.instance_path, 'storage_sweep.json'))
+# Duplicate-submission protection: POSTs to these endpoints that carry an idempotency key are
+# answered once; repeats of the key within the TTL get the stored response (see idempotency.py).
+app.config['IDEMPOTENT_ENDPOINTS'] = {
+    'register', 'post_animal', 'import_animals', 'submit_adoption', 'process_adoption_request',
+    'vaccination_page', 'donate_page', 'rescue_page', 'volunteer_page', 'foster_page', 'contact_page',
+}
+app.config['IDEMPOTENCY_STORE'] = os.environ.get('IDEMPOTENCY_STORE', os.path.join(app.instance_path, 'idempotency.sqlite3'))
+app.config['IDEMPOTENCY_TTL_SECONDS'] = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', idempotency.DEFAULT_TTL_SECONDS))
+app.config['IDEMPOTENCY_MAX_ENTRIES'] = int(os.environ.get('IDEMPOTENCY_MAX_ENTRIES', idempotency.DEFAULT_MAX_ENTRIES))
+# How long a request that is still running holds its key; after that (its worker was killed) a retry takes over
+app.config['IDEMPOTENCY_PENDING_LEASE_SECONDS'] = int(os.environ.get('IDEMPOTENCY_PENDING_LEASE_SECONDS', idempotency.DEFAULT_PENDING_LEASE_SECONDS))
+# Query profiling (see query_profiler.py): slow-query threshold and how many repeats of one query
+# shape in a request count as an N+1. Reports are served at /admin/queries to local requests only,
+# and additionally only to the usernames in ADMIN_USERS ("alice,bob") when that is set.
+# ADMIN_USERS are also the coordinators allowed to search volunteer/foster applications and
+# read the contact inbox.
+app.config['QUERY_PROFILING'] = os.environ.get('QUERY_PROFILING', '1') != '0'
+app.config['QUERY_SLOW_MS'] = float(os.environ.get('QUERY_SLOW_MS', query_profiler.DEFAULT_SLOW_MS))
+app.config['QUERY_N_PLUS_ONE'] = int(os.environ.get('QUERY_N_PLUS_ONE', query_profiler.DEFAULT_N_PLUS_ONE))
+app.config['ADMIN_USERS'] = {name.strip() for name in os.environ.get('ADMIN_USERS', '').split(',') if name.strip()}
+# create_app() compiles every template into each worker at startup unless WARM_TEMPLATES=0
+app.config['WARM_TEMPLATES'] = os.environ.get('WARM_TEMPLATES', '1') != '0'
+# Compiled template bytecode shared by all workers. Entries are keyed by template name and checked
+# against a hash of the template source, so an edited template is recompiled automatically.
+app.config['JINJA_BYTECODE_CACHE'] = os.environ.get('JINJA_BYTECODE_CACHE', os.path.join(app.instance_path, 'jinja_cache'))
+
+# --- Helper Functions (ensure_dir, allowed_file etc. live in helpers.py) ---
+# Upload folders are created on demand by each upload path (see storage.sharded_upload_paths).
+
+def upload_quota_error(user_id, incoming_bytes):
+    # Returns a user-facing message if this upload would take the user over their storage quota, else None.
+    # Fails open: a DB problem here should not block uploads, the sweeper/index catch up later.
+    cur = None
+    try:
+        cur = mysql.connection.cursor()
+        allowed, used = storage.check_quota(cur, user_id, incoming_bytes, app.config['UPLOAD_QUOTA_BYTES'])
+    except Exception as e:
+        print(f"DB Error checking upload quota: {e}"); return None
+    finally:
+        if cur: cur.close()
+    if allowed: return None
+    quota_mb = app.config['UPLOAD_QUOTA_BYTES'] / (1024 * 1024)
+    return f"Upload storage limit reached ({used / (1024 * 1024):.1f} of {quota_mb:.0f} MB used). Please contact us to raise your limit."
+
+def stored_quota_error(user_id, *full_paths):
+    # Quota check on the files as saved (after sanitising), i.e. the sizes record_upload() charges.
+    # Removes the files when they don't fit.
+    quota_error = upload_quota_error(user_id, sum(storage.stored_size(path) for path in full_paths))
+    if quota_error:
+        for path in full_paths:
+            try: os.remove(path)
+            except OSError as e: print(f"Error removing upload over quota {path}: {e}")
+    return quota_error
+
+# --- Upload Sanitiser ---
+sanitiser = image_sanitiser.ImageSanitiser()
+
+def upload_busy_response(e):
+    # The sanitiser queue is full: ask the client to resend shortly instead of queueing more work
+    response = jsonify({'success': False, 'message': 'We are processing a lot of uploads right now. Please try again in a moment.'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+# --- Audit Log ---
+audit_log = audit.AuditLog(app.config['AUDIT_SEGMENT_DIR'], app.config['AUDIT_FLUSH_SECONDS'])
+
+# --- Rate Limiting ---
+limiter = rate_limit.RateLimiter(app.config['RATE_LIMITS'], app.config['RATE_LIMIT_STORE'])
+
+# --- Idempotency Keys ---
+idempotency_store = idempotency.IdempotencyStore(app.config['IDEMPOTENCY_STORE'])
+
+def replay_response(stored):
+    status, headers, body = stored
+    response = app.response_class(body, status=status)
+    for name, value in headers.items(): response.headers[name] = value
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+@app.before_request
+def check_idempotency_key():
+    # Registered before the rate limiter so a replayed double-click doesn't use up the client's budget
+    if request.method != 'POST' or request.endpoint not in app.config['IDEMPOTENT_ENDPOINTS']: return None
+    key = request.headers.get('Idempotency-Key') or request.form.get('idempotency_key')
+    if not key or len(key) > 128: return None # No key (old clients, curl): handled as before
+    # Anonymous keys are scoped to the client address as resolved by ProxyFix (TRUSTED_PROXIES): behind a
+    # proxy, the raw peer address would let visitors who pick the same key replay each other's responses
+    owner = f"user:{session['user_id']}" if session.get('user_id') else f"ip:{request.remote_addr}"
+    scoped_key = f"{request.path}|{owner}|{key}" # Path includes ids, e.g. /submit_adoption/7
+    try:
+        stored = idempotency_store.begin(scoped_key)
+        if stored == 'pending': # The first click is still being processed; its response goes to that click
+            response = jsonify({'success': False, 'message': 'This submission is already being processed.'})
+            response.status_code = 409; response.headers['Retry-After'] = '1'
+            return response
+    except Exception as e:
+        print(f"WARNING: Idempotency store unavailable ({e}); processing {request.endpoint} without duplicate protection.")
+        return None
+    if stored is None:
+        g.idempotency_key = scoped_key # We own the key; after_request stores our response
+        return None
+    print(f"Replaying response for duplicate {request.endpoint} submission from {owner}")
+    return replay_response(stored)
+
+@app.after_request
+def store_idempotent_response(response):
+    scoped_key = g.pop('idempotency_key', None)
+    if scoped_key is None: return response
+    try:
+        # Only successful submissions are remembered; after a validation error (4xx), a 429 or a
+        # server error the key is freed so the corrected/retried form can reuse it
+        if response.status_code >= 400 or response.direct_passthrough:
+            idempotency_store.release(scoped_key)
+        else:
+            body = response.get_data()
+            if len(body) > idempotency.MAX_BODY_BYTES:
+                idempotency_store.release(scoped_key)
+            else:
+                headers = {name: response.headers[name] for name in idempotency.REPLAYED_HEADERS if name in response.headers}
+                idempotency_store.complete(scoped_key, response.status_code, headers, body)
+    except Exception as e:
+        print(f"WARNING: Could not store idempotent response for {request.endpoint}: {e}")
+    return response
+
+@app.teardown_request
+def release_idempotency_key(exception):
+    # after_request is skipped when the view raised; free the key so a retry isn't stuck waiting on it
+    scoped_key = g.pop('idempotency_key', None)
+    if scoped_key is not None:
+        try: idempotency_store.release(scoped_key)
+        except Exception as e: print(f"WARNING: Could not release idempotency key: {e}")
+
+@app.before_request
+def enforce_rate_limits():
+    # Runs before the view, so a throttled client costs a bucket lookup and no DB work at all.
+    # remote_addr is the client as resolved by ProxyFix (TRUSTED_PROXIES), not the proxy in front of us.
+    if request.method != 'POST' or request.endpoint not in app.config['RATE_LIMITS']: return None
+    user_id = session.get('user_id')
+    retry_after = limiter.check(request.endpoint, (f"ip:{request.remote_addr}", f"user:{user_id}" if user_id else None))
+    if not retry_after: return None
+    retry_after = max(1, int(retry_after + 0.999))
+    print(f"Rate limit hit: {request.endpoint} from {request.remote_addr} (retry in {retry_after}s)")
+    message = f"Too many submissions. Please wait {retry_after} seconds and try again."
+    if request.accept_mimetypes.best == 'application/json':
+        response = jsonify({'success': False, 'message': message})
+    else:
+        response = app.response_class(message, mimetype='text/plain')
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
 
 # --- Context Processor ---
 @app.context_processor
@@ -80,7 +307,7 @@ def login():
              flash('Username/Password required.', 'danger'); return render_template('login.html', error='Required.')
         cur = None
         try:
-            cur = mysql.connection.cursor()
+            cur = db_router.read_connection().cursor()
             cur.execute("SELECT * FROM users WHERE username = %s", (username,))
             user = cur.fetchone()
         except Exception as e: print(f"DB Error: {e}"); flash('Login error.', 'danger'); return render_template('login.html')
@@ -133,6 +360,7 @@ def register():
             hashed_password = generate_password_hash(password)
             cur.execute("INSERT INTO users (username, email, password) VALUES (%s, %s, %s)", (username, email, hashed_password))
             mysql.connection.commit()
+            db_router.mark_write() # The login right after this must see the new user
             flash('Registration successful! Please log in.', 'success')
             return redirect(url_for('login'))
         except Exception as e:
@@ -153,66 +381,95 @@ def dashboard():
         flash('Please log in to view the dashboard.', 'warning'); # More specific message
         return redirect(url_for('login', next=request.url))
     user_id = session['user_id']
-    animals_posted_with_requests = []
-    user_adoption_requests = []
-    donation_history = []
+    sections = {'animals': ([], None), 'adoptions': ([], None), 'donations': ([], None)}
     # Initialize error to None
     dashboard_error = None
+    # Only the first page of each section; the page fetches the rest from /api/dashboard/<section>
+    for section in sections:
+        try:
+            read_db = db_router.read_connection() # Replica unless this user wrote something moments ago
+            sections[section] = dashboard_sections.fetch_section(read_db, section, user_id, limit=app.config['DASHBOARD_PAGE_SIZE'])
+        except Exception as e:
+            print(f"!!! DB ERROR loading dashboard section {section}: {e}"); traceback.print_exc()
+            # Set error message to display on template; the other sections still render
+            dashboard_error = "Failed to load complete dashboard data due to a database error."
+    if dashboard_error:
+        flash("Error loading dashboard data. Some information may be missing.", "danger")
+
+    # Pass the error variable to the template
+    return render_template('dashboard.html',
+                           username=session.get('username'),
+                           animals_posted=sections['animals'][0], animals_next_cursor=sections['animals'][1],
+                           adoption_requests=sections['adoptions'][0], adoptions_next_cursor=sections['adoptions'][1],
+                           donation_history=sections['donations'][0], donations_next_cursor=sections['donations'][1],
+                           error=dashboard_error) # Pass the error message
+
+
+DASHBOARD_ITEM_MACROS = {'animals': 'animal_item', 'adoptions': 'adoption_item', 'donations': 'donation_item'}
+
+@app.route('/api/dashboard/<section>')
+def api_dashboard_section(section):
+    # One page of a dashboard section: rows as JSON plus the rendered list items for the HTML dashboard
+    if 'user_id' not in session: return jsonify({'success': False, 'message': 'Authentication required.'}), 401
+    if section not in dashboard_sections.SECTIONS: return jsonify({'success': False, 'message': 'Unknown dashboard section.'}), 404
+    try:
+        page, next_cursor = dashboard_sections.fetch_section(db_router.read_connection(), section, session['user_id'],
+                                                    request.args.get('cursor'), app.config['DASHBOARD_PAGE_SIZE'])
+    except Exception as e:
+        print(f"DB Error fetching dashboard {section} page: {e}")
+        return jsonify({'success': False, 'message': 'Could not load more items.'}), 500
+    render_item = get_template_attribute('_dashboard_items.html', DASHBOARD_ITEM_MACROS[section])
+    return jsonify({'success': True, 'items': [row.as_json() for row in page], 'next_cursor': next_cursor,
+                    'html': ''.join(render_item(row) for row in page)})
+
+
+@app.route('/storage/usage')
+def storage_usage():
+    if 'user_id' not in session: return jsonify({'success': False, 'message': 'Authentication required.'}), 401
     cur = None
     try:
         cur = mysql.connection.cursor()
-        # Fetch animals posted by user
-        sql_animals = "SELECT animal_id, name, type, status, date_posted, image_filename FROM animals WHERE user_id = %s ORDER BY date_posted DESC"
-        cur.execute(sql_animals, (user_id,))
-        animals_posted = cur.fetchall()
-
-        # Fetch pending requests for each 'Available' animal
-        for animal in animals_posted:
-            animal['pending_requests'] = []
-            if animal['status'] == 'Available':
-                cur_req = None # Use separate cursor or ensure proper closing
-                try:
-                    cur_req = mysql.connection.cursor() # Open new cursor for nested query
-                    sql_requests = "SELECT adoption_id, adopter_name, adopter_email, adoption_date, status FROM adoptions WHERE animal_id = %s AND status = %s ORDER BY adoption_date ASC"
-                    cur_req.execute(sql_requests, (animal['animal_id'], 'Pending'))
-                    animal['pending_requests'] = cur_req.fetchall()
-                except Exception as req_e:
-                    print(f"DB Error fetching requests for animal {animal['animal_id']}: {req_e}")
-                    # Don't stop the whole dashboard, just log the error
-                finally:
-                    if cur_req: cur_req.close()
-            animals_posted_with_requests.append(animal)
-
-        # Fetch user's own adoption requests
-        sql_user_adoptions = "SELECT adoption_id, animal_name, status, adoption_date FROM adoptions WHERE user_id = %s ORDER BY adoption_date DESC"
-        cur.execute(sql_user_adoptions, (user_id,))
-        user_adoption_requests = cur.fetchall()
-
-        # Fetch user's donation history
-        sql_donations = "SELECT donation_id, donation_type, amount, product_details, donation_date, status FROM donations WHERE user_id = %s ORDER BY donation_date DESC"
-        cur.execute(sql_donations, (user_id,))
-        donation_history = cur.fetchall()
+        used, files = storage.user_usage(cur, session['user_id'])
+    except Exception as e:
+        print(f"DB Error fetching storage usage: {e}")
+        return jsonify({'success': False, 'message': 'Could not load storage usage.'}), 500
+    finally:
+        if cur: cur.close()
+    return jsonify({'success': True, 'used_bytes': used, 'files': files, 'quota_bytes': app.config['UPLOAD_QUOTA_BYTES']})
+
 
+@app.route('/api/audit')
+def api_audit():
+    # The logged-in user's own audit trail (listings, requests, decisions, donations), newest first.
+    # Optional filters: entity_type (+ entity_id), since / until (ISO dates), cursor. Events reach the
+    # table within AUDIT_FLUSH_SECONDS of happening.
+    if 'user_id' not in session: return jsonify({'success': False, 'message': 'Authentication required.'}), 401
+    cur = None
+    try:
+        cur = db_router.read_connection().cursor()
+        events, next_cursor = audit.query_events(
+            cur, entity_type=request.args.get('entity_type'), entity_id=request.args.get('entity_id', type=int),
+            actor_user_id=session['user_id'], since=request.args.get('since'), until=request.args.get('until'),
+            cursor=request.args.get('cursor'), limit=min(request.args.get('limit', 50, type=int), 200))
     except Exception as e:
-        print(f"!!! DB ERROR in /dashboard route: {e}"); traceback.print_exc()
-        flash("Error loading dashboard data. Some information may be missing.", "danger")
-        # Set error message to display on template
-        dashboard_error = "Failed to load complete dashboard data due to a database error."
-        # Return potentially incomplete data so the page partially renders
-        # Ensure lists are initialized even if queries fail partially
-        animals_posted_with_requests = animals_posted_with_requests if 'animals_posted_with_requests' in locals() else []
-        user_adoption_requests = user_adoption_requests if 'user_adoption_requests' in locals() else []
-        donation_history = donation_history if 'donation_history' in locals() else []
+        print(f"DB Error querying audit log: {e}")
+        return jsonify({'success': False, 'message': 'Could not load activity.'}), 500
     finally:
         if cur: cur.close()
+    for event in events: event['occurred_at'] = event['occurred_at'].isoformat() if event['occurred_at'] else None
+    return jsonify({'success': True, 'events': events, 'next_cursor': next_cursor})
 
-    # Pass the error variable to the template
-    return render_template('dashboard.html',
-                           username=session.get('username'),
-                           animals_posted=animals_posted_with_requests,
-                           adoption_requests=user_adoption_requests,
-                           donation_history=donation_history,
-                           error=dashboard_error) # Pass the error message
+
+LOCAL_ADDRESSES = {'127.0.0.1', '::1'}
+
+@app.route('/admin/queries')
+def admin_queries():
+    # This worker's query profile: slow queries, requests flagged for N+1/duplicate queries and the
+    # most expensive query shapes. Hidden (404) from anything but local admins.
+    if request.remote_addr not in LOCAL_ADDRESSES: return page_not_found(None)
+    if app.config['ADMIN_USERS'] and session.get('username') not in app.config['ADMIN_USERS']: return page_not_found(None)
+    if request.args.get('reset') == '1': profiler.reset()
+    return jsonify(profiler.report(top=request.args.get('top', 20, type=int)))
 
 
 @app.route('/logout')
@@ -223,26 +480,183 @@ def logout():
 
 
 # --- Other Routes (Adoption, Post Animal, Submit Adoption, Process Adoption, Donate, Rescue, Educational, Errors - Keep Existing) ---
+# Keyset pagination over Available animals, newest first. Each page is one indexed range scan
+# (ideally on animals(status, date_posted, animal_id)), so its cost does not grow with the catalogue.
+ADOPTION_LISTING_SQL = (
+    "SELECT animal_id, name, type, age, description, image_filename, status, date_posted FROM animals "
+    "WHERE status = %s{after} ORDER BY date_posted DESC, animal_id DESC LIMIT %s"
+)
+ADOPTION_LISTING_AFTER = " AND (date_posted < %s OR (date_posted = %s AND animal_id < %s))"
+
+catalogue = catalogue_snapshot.CatalogueSnapshot(app.config['CATALOGUE_SNAPSHOT'], app.config['CATALOGUE_SNAPSHOT_SECONDS'])
+catalogue_breaker = circuit_breaker.CircuitBreaker('catalogue')
+
+def probe_database():
+    conn = db_router.open_primary_connection()
+    try:
+        conn.cursor().execute("SELECT 1")
+    finally:
+        conn.close()
+
+def read_catalogue(live, offline):
+    # Returns live(), or offline(snapshot) when the breaker is open or MySQL is unreachable; in that case
+    # g.catalogue_snapshot_at says how old the data is. Raises if there is no snapshot to fall back on.
+    if catalogue_breaker.allow():
+        started = time.perf_counter()
+        try:
+            result = live()
+        except db_routing.UNAVAILABLE_ERRORS as e:
+            catalogue_breaker.record_failure()
+            print(f"DB unavailable, serving the catalogue snapshot: {e}")
+        else:
+            catalogue_breaker.record_success(time.perf_counter() - started)
+            if catalogue.needs_refresh(): catalogue.refresh_in_background(db_router.open_primary_connection)
+            return result
+    snapshot = catalogue.current()
+    if snapshot is None: raise RuntimeError("Database unavailable and no catalogue snapshot to serve.")
+    g.catalogue_snapshot_at = datetime.fromtimestamp(snapshot.created_at, timezone.utc)
+    return offline(snapshot)
+
+def fetch_available_animals(cursor=None, limit=None):
+    # Returns (animals, next_cursor). next_cursor is None on the last page. Served from the catalogue
+    # snapshot while the DB is down; raises on other DB errors.
+    limit = limit or app.config['ADOPTION_PAGE_SIZE']
+    return read_catalogue(lambda: query_available_animals(cursor, limit),
+                          lambda snapshot: catalogue.page(snapshot, cursor, limit))
+
+def query_available_animals(cursor, limit):
+    after = decode_cursor(cursor)
+    params = ['Available']
+    if after and len(after) == 2:
+        params += [after[0], after[0], after[1]]
+    params.append(limit + 1) # One extra row tells us whether another page exists
+    cur = None
+    try:
+        cur = rows.tuple_cursor(db_router.read_connection())
+        cur.execute(ADOPTION_LISTING_SQL.format(after=ADOPTION_LISTING_AFTER if len(params) > 2 else ''), tuple(params))
+        animals = rows.AnimalRow.fetch_all(cur) # image_url is computed lazily by AnimalRow
+    finally:
+        if cur: cur.close()
+    next_cursor = None
+    if len(animals) > limit:
+        animals = animals[:limit]
+        next_cursor = encode_cursor(animals[-1].date_posted, animals[-1].animal_id)
+    return animals, next_cursor
+
+
 @app.route('/adoption')
 def adoption_page():
-    animals = []; cur = None
+    animals = []; next_cursor = None
     # FIX: Use timezone.utc instead of utcnow()
     now_utc = datetime.now(timezone.utc)
     try:
-        cur = mysql.connection.cursor()
-        sql = "SELECT animal_id, name, type, age, description, image_filename, status, date_posted FROM animals WHERE status = %s ORDER BY date_posted DESC"
-        cur.execute(sql, ('Available',))
-        animals = cur.fetchall()
-        for animal in animals:
-             animal['image_url'] = None
-             if animal.get('image_filename'):
-                 img_path_rel_to_static = os.path.join('uploads', 'animals', os.path.basename(animal['image_filename'])).replace("\\","/")
-                 animal['image_url'] = url_for('static', filename=img_path_rel_to_static)
+        # Only the first screen is rendered here; the template fetches later pages from /api/animals
+        animals, next_cursor = fetch_available_animals()
     except Exception as e: print(f"DB Error fetching animals: {e}"); flash("Could not load animals.", "danger")
-    finally:
-        if cur: cur.close()
     # FIX: Pass timezone-aware object
-    return render_template('adoption.html', animals=animals, now=now_utc)
+    return render_template('adoption.html', animals=animals, next_cursor=next_cursor, now=now_utc,
+                           snapshot_at=g.get('catalogue_snapshot_at'))
+
+
+def animal_card_json(a):
+    # Compact card data for the adoption grid's JS (same fields the <template> card fills in)
+    description_limit = 100 # Cards only show the first 100 characters, don't ship the rest
+    return {
+        'id': a.animal_id, 'name': a.name, 'type': a.type,
+        'age': float(a.age) if a.age is not None else None,
+        'description': (a.description or '')[:description_limit + 1],
+        'image_url': a.image_url,
+    }
+
+
+@app.route('/api/animals')
+def api_animals():
+    # Compact JSON page of Available animals for the adoption grid's infinite scroll.
+    try:
+        animals, next_cursor = fetch_available_animals(request.args.get('cursor'))
+    except Exception as e:
+        print(f"DB Error fetching animals page: {e}")
+        return jsonify({'success': False, 'message': 'Could not load animals.'}), 500
+    payload = [animal_card_json(a) for a in animals]
+    data = {'success': True, 'animals': payload, 'next_cursor': next_cursor}
+    snapshot_at = g.get('catalogue_snapshot_at')
+    if snapshot_at: data['snapshot_at'] = snapshot_at.isoformat()
+    response = jsonify(data)
+    # Pages behind a cursor are immutable enough to let the browser reuse a prefetched copy briefly
+    # (but not snapshot pages, which would outlive the outage)
+    response.headers['Cache-Control'] = 'no-cache' if snapshot_at else 'public, max-age=30'
+    return response
+
+
+# --- Recommendations ---
+recommender = recommend.Recommender(app.config['RECOMMEND_REFRESH_SECONDS'])
+
+def current_recommender():
+    # Loads this worker's index from the shared snapshot (or builds it in the background when there is
+    # no fresh snapshot); afterwards every RECOMMEND_REFRESH_SECONDS it appends listings and adoption
+    # requests added through other workers and refreshes the Available set.
+    if recommender.needs_refresh() and not recommender.building:
+        cur = None
+        try:
+            cur = db_router.read_connection().cursor()
+            snapshot = app.config['RECOMMEND_SNAPSHOT']
+            if recommender.needs_rebuild() and os.path.exists(snapshot) and os.path.getmtime(snapshot) > recommender.built_at:
+                recommender.load(snapshot, recommend.load_requests(cur))
+            if recommender.needs_rebuild():
+                recommender.rebuild_in_background(recommend.load_animals(cur), recommend.load_requests(cur), save_path=snapshot)
+            else:
+                recommender.add_animals(recommend.load_animals(cur, recommender.max_animal_id))
+                recommender.add_requests(recommend.load_requests(cur, recommender.max_adoption_id))
+                recommender.set_available(recommend.load_available_ids(cur))
+        except Exception as e:
+            print(f"Error refreshing recommendations: {e}") # Serve from the last known index
+        finally:
+            if cur: cur.close()
+    return recommender
+
+def fetch_animals_by_ids(animal_ids):
+    # Card rows for the given ids, in the given order (missing ids are skipped). While the DB is down
+    # only animals in the catalogue snapshot (i.e. Available ones) are returned.
+    if not animal_ids: return []
+    return read_catalogue(lambda: query_animals_by_ids(animal_ids),
+                          lambda snapshot: catalogue.get_many(snapshot, animal_ids))
+
+def query_animals_by_ids(animal_ids):
+    cur = rows.tuple_cursor(db_router.read_connection())
+    try:
+        cur.execute("SELECT animal_id, name, type, age, description, image_filename, status, date_posted FROM animals "
+                    f"WHERE animal_id IN ({', '.join(['%s'] * len(animal_ids))})", tuple(animal_ids))
+        by_id = {a.animal_id: a for a in rows.AnimalRow.fetch_all(cur)}
+    finally:
+        cur.close()
+    return [by_id[i] for i in animal_ids if i in by_id]
+
+@app.route('/api/animals/<int:animal_id>/similar')
+def api_similar_animals(animal_id):
+    try:
+        matches = current_recommender().similar(animal_id, app.config['RECOMMEND_LIMIT'])
+        animals = fetch_animals_by_ids([match_id for match_id, _ in matches])
+    except Exception as e:
+        print(f"Error fetching similar animals for {animal_id}: {e}")
+        return jsonify({'success': False, 'message': 'Could not load similar animals.'}), 500
+    return jsonify({'success': True, 'animals': [animal_card_json(a) for a in animals]})
+
+@app.route('/api/recommendations')
+def api_recommendations():
+    # "Recommended for you": matched against the animals this user has asked to adopt. Users without
+    # any requests yet (and anonymous visitors) get the newest listings instead.
+    try:
+        matches = current_recommender().for_user(session['user_id'], app.config['RECOMMEND_LIMIT']) if 'user_id' in session else None
+        if matches is None:
+            animals, _ = fetch_available_animals(limit=app.config['RECOMMEND_LIMIT'])
+            source = 'newest'
+        else:
+            animals = fetch_animals_by_ids([match_id for match_id, _ in matches])
+            source = 'history'
+    except Exception as e:
+        print(f"Error fetching recommendations: {e}")
+        return jsonify({'success': False, 'message': 'Could not load recommendations.'}), 500
+    return jsonify({'success': True, 'source': source, 'animals': [animal_card_json(a) for a in animals]})
 
 
 @app.route('/post_animal', methods=['POST'])
@@ -268,24 +682,9 @@ def post_animal():
 
     image_filename_rel = None
     image_path_full = None
-    errors=[]
-    age = None # Initialize age outside try block
-
-    # Validation... (keep existing validation)
-    # Note: Checks for None or empty string handle required fields from HTML forms well.
-    if not name: errors.append('Name is required.')
-    if not animal_type: errors.append('Type is required.')
-    if not age_str: # Check for empty string/None first
-        errors.append('Age is required.')
-    else: # Only try conversion if age_str is provided
-        try:
-             age = float(age_str)
-             if age < 0: # Ensure age is non-negative
-                 errors.append('Age cannot be negative.')
-        except ValueError:
-             errors.append('Invalid age format. Must be a number (e.g., 2, 1.5).')
 
-    if not description: errors.append('Description is required.')
+    # Validation... (shared with the bulk importer, see helpers.validate_animal_fields)
+    errors, age = validate_animal_fields(name, animal_type, age_str, description)
 
     # Image Handling...
     if image_file and image_file.filename!='':
@@ -300,14 +699,20 @@ def post_animal():
                     upload_folder=app.config['UPLOAD_FOLDER_ANIMALS']
                     base_filename=secure_filename(image_file.filename)
                     image_filename=f"animal_{user_id}_{timestamp}_{base_filename}"
-                    image_path_full=os.path.join(upload_folder, image_filename)
+                    image_dir, image_path_full, image_filename_rel = storage.sharded_upload_paths(upload_folder, 'animals', image_filename)
 
-                    if not ensure_dir(upload_folder):
+                    if not ensure_dir(image_dir):
                          raise OSError("Could not create upload directory.") # Raise error for specific handling
 
-                    image_file.save(image_path_full)
-                    image_filename_rel=os.path.join('uploads','animals',image_filename).replace("\\","/")
+                    sanitiser.save_upload(image_file, image_path_full) # Checked, stripped and re-encoded
                     print(f"DEBUG: Image saved to {image_path_full}") # Log success
+                    quota_error = stored_quota_error(user_id, image_path_full)
+                    if quota_error:
+                        return jsonify({'success': False, 'message': quota_error}), 413
+                except image_sanitiser.SanitiserBusy as e:
+                    return upload_busy_response(e)
+                except image_sanitiser.RejectedUpload as e:
+                    errors.append(f'Image rejected: {e}')
                 except Exception as e:
                     print(f"ERROR image save: {e}"); traceback.print_exc()
                     errors.append(f'Image upload failed: {e}') # Include specific error if possible
@@ -333,8 +738,14 @@ def post_animal():
         print("DEBUG: Attempting DB INSERT with values:", values)
         cur.execute(sql, values)
         new_animal_id = cur.lastrowid
+        if image_filename_rel: # Index the file in the same transaction as its owning row
+            storage.record_upload(cur, image_filename_rel, image_path_full, 'animals', user_id, new_animal_id)
         mysql.connection.commit()
+        db_router.mark_write()
         print(f"DEBUG: DB INSERT successful, animal_id={new_animal_id}")
+        recommender.add_animals([{'animal_id': new_animal_id, 'type': animal_type, 'age': age, 'description': description, 'status': 'Available'}])
+        audit_log.record('animal', new_animal_id, 'posted', to_state='Available', actor_user_id=user_id,
+                         details={'name': name, 'type': animal_type})
 
         # Assuming image_filename_rel exists, otherwise url_for will handle None
         final_image_url = url_for('static', filename=image_filename_rel) if image_filename_rel else None
@@ -353,6 +764,96 @@ def post_animal():
     finally:
         if cur: cur.close()
 
+def sanitise_import_image(src_path, dest_path):
+    # Imported images get the same checks as uploads. A full sanitiser queue delays the row, for up to
+    # IMPORT_SANITISER_WAIT_SECONDS in total; after that the row fails with a row error instead of stalling the import.
+    deadline = time.monotonic() + app.config['IMPORT_SANITISER_WAIT_SECONDS']
+    while True:
+        try: return sanitiser.save_file(src_path, dest_path)
+        except image_sanitiser.SanitiserBusy as e:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise RuntimeError(f"the image queue stayed busy for {app.config['IMPORT_SANITISER_WAIT_SECONDS']:g} s; import this row again later") from e
+            time.sleep(min(e.retry_after, remaining))
+
+def run_animal_import(connection, manifest_path, user_id, images_path=None, batch_size=None, workers=None, progress_path=None):
+    return bulk_import.run_import(
+        connection, manifest_path, user_id, app.config['UPLOAD_FOLDER_ANIMALS'], images_path=images_path,
+        batch_size=batch_size or app.config['IMPORT_BATCH_SIZE'], workers=workers or app.config['IMPORT_WORKERS'],
+        progress_path=progress_path, sanitise=sanitise_import_image, quota_bytes=app.config['UPLOAD_QUOTA_BYTES'])
+
+def import_job_dir(user_id, import_id):
+    # The folder of one of this user's imports, or None for an id that isn't theirs (or isn't an id)
+    owner, _, digest = import_id.partition('_')
+    if owner != str(user_id) or len(digest) != 16 or digest.strip('0123456789abcdef'): return None
+    return os.path.join(app.config['IMPORT_FOLDER'], import_id)
+
+@app.route('/import_animals', methods=['POST'])
+def import_animals():
+    # Bulk version of post_animal() for shelters: a CSV/NDJSON manifest plus an optional zip of images.
+    # The import runs in the background; the response (202) carries a status_url to poll for progress.
+    # Uploading the same manifest again resumes an interrupted import instead of duplicating rows.
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Please log in to import animals.'}), 401
+    user_id = session['user_id']
+    manifest_file = request.files.get('manifest'); images_file = request.files.get('images')
+    if not manifest_file or manifest_file.filename == '':
+        return jsonify({'success': False, 'message': 'A manifest file (CSV or NDJSON) is required.'}), 400
+    if not allowed_file(manifest_file.filename, {'csv', 'ndjson', 'jsonl'}):
+        return jsonify({'success': False, 'message': 'Manifest must be a .csv, .ndjson or .jsonl file.'}), 400
+    if images_file and images_file.filename != '' and not allowed_file(images_file.filename, {'zip'}):
+        return jsonify({'success': False, 'message': 'Images must be uploaded as a .zip archive.'}), 400
+
+    lock_file = None
+    try:
+        manifest_bytes = manifest_file.read()
+        import_id = f"{user_id}_{hashlib.sha256(manifest_bytes).hexdigest()[:16]}"
+        import_dir = import_job_dir(user_id, import_id)
+        if not ensure_dir(import_dir):
+            raise OSError("Import directory creation error.")
+        lock_file = bulk_import.lock_job(import_dir) # Before touching the files a running import reads
+        if lock_file is False:
+            status = bulk_import.job_status(import_dir) or {}
+            return jsonify(dict(status, success=True, import_id=import_id, status_url=url_for('import_status', import_id=import_id),
+                                message='This import is already running.')), 202
+        manifest_path = os.path.join(import_dir, 'manifest.' + manifest_file.filename.rsplit('.', 1)[1].lower())
+        with open(manifest_path, 'wb') as f: f.write(manifest_bytes)
+        images_path = None
+        if images_file and images_file.filename != '':
+            images_path = os.path.join(import_dir, 'images.zip')
+            images_file.save(images_path)
+        elif os.path.exists(os.path.join(import_dir, 'images.zip')): # Resuming without re-uploading the archive
+            images_path = os.path.join(import_dir, 'images.zip')
+
+        progress_path = os.path.join(import_dir, 'progress.json')
+
+        def run():
+            # Request connections can't leave the request, so the job opens its own
+            connection = db_router.open_primary_connection()
+            try: return run_animal_import(connection, manifest_path, user_id, images_path, progress_path=progress_path)
+            finally: connection.close()
+        bulk_import.start_job(import_dir, lock_file, run)
+    except Exception as e:
+        if lock_file: lock_file.close()
+        print(f"!!! Error (Bulk Import): {e}"); traceback.print_exc()
+        return jsonify({'success': False, 'message': 'Import failed due to a server error. Upload the same manifest again to resume.'}), 500
+
+    return jsonify({'success': True, 'import_id': import_id, 'status_url': url_for('import_status', import_id=import_id),
+                    'message': 'Import started.'}), 202
+
+@app.route('/import_animals/<import_id>')
+def import_status(import_id):
+    # Progress of a background import: {'state': 'running'|'completed'|'stopped'|'failed'|'interrupted', 'imported', 'failed', 'errors', ...}
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Please log in to see your imports.'}), 401
+    import_dir = import_job_dir(session['user_id'], import_id)
+    status = bulk_import.job_status(import_dir) if import_dir else None
+    if status is None:
+        return jsonify({'success': False, 'message': 'Import not found.'}), 404
+    if status['imported']: db_router.mark_write() # Read the new listings from the primary
+    return jsonify(dict(status, success=status['state'] not in ('failed', 'interrupted'), import_id=import_id))
+
+
 @app.route('/submit_adoption/<int:animal_id>', methods=['POST'])
 def submit_adoption(animal_id):
     # Added logging to see what the server receives
@@ -418,18 +919,23 @@ def submit_adoption(animal_id):
 
         # Save photo (checked if file exists earlier in validation)
         photo_filename=secure_filename(f"photo_{user_id}_{timestamp}_{photo_file.filename}")
-        photo_path_full=os.path.join(upload_folder, photo_filename)
-        photo_file.save(photo_path_full)
-        photo_path_rel=os.path.join('uploads','adoptions',photo_filename).replace("\\","/")
+        photo_dir, photo_path_full, photo_path_rel = storage.sharded_upload_paths(upload_folder, 'adoptions', photo_filename)
+        if not ensure_dir(photo_dir):
+             raise OSError("Adoption upload dir error.")
+        sanitiser.save_upload(photo_file, photo_path_full)
         print(f"DEBUG: Photo saved to {photo_path_full}") # Log success
 
 
         # Save Aadhaar/ID (checked if file exists earlier in validation)
         aadhaar_filename=secure_filename(f"id_{user_id}_{timestamp}_{aadhaar_file.filename}") # Changed prefix for clarity
-        aadhaar_path_full=os.path.join(upload_folder, aadhaar_filename)
-        aadhaar_file.save(aadhaar_path_full)
-        aadhaar_path_rel=os.path.join('uploads','adoptions',aadhaar_filename).replace("\\","/")
+        aadhaar_dir, aadhaar_path_full, aadhaar_path_rel = storage.sharded_upload_paths(upload_folder, 'adoptions', aadhaar_filename)
+        if not ensure_dir(aadhaar_dir):
+             raise OSError("Adoption upload dir error.")
+        sanitiser.save_upload(aadhaar_file, aadhaar_path_full) # Images are re-encoded, PDFs only signature-checked
         print(f"DEBUG: ID proof saved to {aadhaar_path_full}") # Log success
+        quota_error = stored_quota_error(user_id, photo_path_full, aadhaar_path_full)
+        if quota_error:
+            return jsonify({'success': False, 'message': quota_error}), 413
 
 
         cur=None
@@ -439,8 +945,15 @@ def submit_adoption(animal_id):
             values = (animal_id, animal_name, adopter_name, adopter_email, 'Pending', photo_path_rel, aadhaar_path_rel, user_id);
             print("DEBUG: Attempting DB INSERT with values:", values)
             cur.execute(sql, values)
+            new_adoption_id = cur.lastrowid
+            storage.record_upload(cur, photo_path_rel, photo_path_full, 'adoptions', user_id, new_adoption_id)
+            storage.record_upload(cur, aadhaar_path_rel, aadhaar_path_full, 'adoptions', user_id, new_adoption_id)
             mysql.connection.commit()
+            db_router.mark_write()
             print(f"DEBUG: DB INSERT successful for adoption on animal_id={animal_id}")
+            recommender.add_requests([{'adoption_id': new_adoption_id, 'user_id': user_id, 'animal_id': animal_id}])
+            audit_log.record('adoption', new_adoption_id, 'submitted', to_state='Pending', actor_user_id=user_id,
+                             details={'animal_id': animal_id})
 
             # Flash success message (this flash message won't directly appear in the AJAX response, but you keep it for potential non-AJAX scenarios or logging)
             # flash('Adoption request submitted successfully!', 'success') # Redundant if relying only on AJAX response message
@@ -475,7 +988,11 @@ def submit_adoption(animal_id):
 
 
         # Handle the specific type of error (e.g., if it's an OSError from dir creation)
-        if isinstance(e, OSError) and "Adoption upload dir error" in str(e):
+        if isinstance(e, image_sanitiser.RejectedUpload):
+            return jsonify({'success': False, 'message': f'Upload rejected: {e}'}), 400
+        elif isinstance(e, image_sanitiser.SanitiserBusy):
+            return upload_busy_response(e)
+        elif isinstance(e, OSError) and "Adoption upload dir error" in str(e):
              return jsonify({'success': False, 'message': 'Could not process file uploads due to a server directory issue.'}), 500
         elif isinstance(e, mysql.connection.Error): # If it's a database error rethrown
             return jsonify({'success': False, 'message': 'A database error occurred while saving your request. Please try again.'}), 500
@@ -501,7 +1018,7 @@ def process_adoption_request():
     cur=None; animal_id=None
     try:
         cur=mysql.connection.cursor()
-        sql_get_info = "SELECT a.animal_id, an.user_id AS animal_owner_id FROM adoptions a JOIN animals an ON a.animal_id = an.animal_id WHERE a.adoption_id = %s"
+        sql_get_info = "SELECT a.animal_id, a.status AS adoption_status, an.user_id AS animal_owner_id FROM adoptions a JOIN animals an ON a.animal_id = an.animal_id WHERE a.adoption_id = %s"
         cur.execute(sql_get_info, (adoption_id,))
         info=cur.fetchone()
         if not info: return jsonify({'success': False, 'message': 'Adoption request not found.'}), 404
@@ -535,14 +1052,22 @@ def process_adoption_request():
             # IMPORTANT: Filter should be status='Pending'. We *don't* want to overwrite the status
             # of any request that might have become 'Accepted' just microseconds ago in a different thread.
             # Also no need to check adoption_id != %s, because updating 'Accepted' to 'Accepted' is harmless.
+            cur.execute("SELECT adoption_id FROM adoptions WHERE animal_id = %s AND status = 'Pending'", (animal_id,))
+            superseded_ids = [row['adoption_id'] for row in cur.fetchall()] # For the audit log
             cur.execute("UPDATE adoptions SET status = 'Unavailable' WHERE animal_id = %s AND status = 'Pending'", (animal_id,))
-            mysql.connection.commit();
+            mysql.connection.commit(); db_router.mark_write()
+            recommender.mark_unavailable(animal_id)
+            audit_log.record('adoption', adoption_id, 'accepted', info['adoption_status'], 'Accepted', poster_user_id, {'animal_id': animal_id})
+            audit_log.record('animal', animal_id, 'adopted', animal_status['status'], 'Adopted', poster_user_id, {'adoption_id': adoption_id})
+            for other_id in superseded_ids:
+                audit_log.record('adoption', other_id, 'superseded', 'Pending', 'Unavailable', poster_user_id, {'accepted_adoption_id': adoption_id})
             return jsonify({'success': True, 'message': 'Adoption accepted! Other pending requests marked as unavailable.'})
         elif action=='reject':
             # Note: Rejecting a request does NOT change the animal's status from 'Available' or 'Adopted'.
             # Rejecting just changes *this specific adoption request's* status.
             cur.execute("UPDATE adoptions SET status = 'Rejected' WHERE adoption_id = %s", (adoption_id,))
-            mysql.connection.commit();
+            mysql.connection.commit(); db_router.mark_write()
+            audit_log.record('adoption', adoption_id, 'rejected', info['adoption_status'], 'Rejected', poster_user_id, {'animal_id': animal_id})
             return jsonify({'success': True, 'message': 'Adoption rejected.'})
     except Exception as e:
         mysql.connection.rollback()
@@ -684,7 +1209,11 @@ def donate_page():
                 # Note: A real money donation would need integration with a payment gateway here, updating status after successful payment confirmation.
             )
             cur.execute(sql, values)
+            new_donation_id = cur.lastrowid
             mysql.connection.commit()
+            if user_id: db_router.mark_write() # Shows up in their dashboard donation history
+            audit_log.record('donation', new_donation_id, 'received', to_state=values[-1], actor_user_id=user_id,
+                             details={'donation_type': donation_type, 'amount': amount_float if donation_type == 'Money' else None})
             flash('Thank you for your generous donation! Your contribution is greatly appreciated.', 'success')
             # Redirect to the GET version of the page to clear the form and show success message clearly
             return redirect(url_for('donate_page'))
@@ -757,21 +1286,32 @@ def rescue_page():
             base_filename=secure_filename(image_file.filename)
             user_prefix=f"{reporter_user_id}_" if reporter_user_id else "anon_" # Use anon_ prefix if user is not logged in
             image_filename=f"rescue_{user_prefix}{timestamp}_{base_filename}";
-            image_path_full=os.path.join(upload_folder, image_filename)
+            image_dir, image_path_full, image_filename_rel = storage.sharded_upload_paths(upload_folder, 'rescues', image_filename)
 
-            if not ensure_dir(upload_folder):
+            if not ensure_dir(image_dir):
                  raise OSError("Rescue upload directory creation error.") # Raise an exception for better handling
 
-            image_file.save(image_path_full)
-            image_filename_rel=os.path.join('uploads','rescues',image_filename).replace("\\","/")
+            sanitiser.save_upload(image_file, image_path_full) # Checked, stripped (incl. GPS) and re-encoded
             print(f"DEBUG: Rescue image saved to {image_path_full}") # Log success
 
+        except image_sanitiser.RejectedUpload as e:
+            flash(f'Image rejected: {e}', 'danger')
+            return render_template('rescue.html', form_data=form_data, page_title="Report Animal Sighting")
+        except image_sanitiser.SanitiserBusy as e:
+            flash('We are processing a lot of uploads right now. Please try again in a moment.', 'warning')
+            return (render_template('rescue.html', form_data=form_data, page_title="Report Animal Sighting"),
+                    503, {'Retry-After': str(e.retry_after)})
         except Exception as e:
              print(f"!!! ERROR saving rescue image: {e}"); traceback.print_exc()
              flash('Image upload failed due to a server error.', 'danger') # More generic error message for user
              # If saving fails here, return the page again with form data and error
              return render_template('rescue.html', form_data=form_data, page_title="Report Animal Sighting")
 
+        if reporter_user_id: # Anonymous reports have no quota
+            quota_error = stored_quota_error(reporter_user_id, image_path_full)
+            if quota_error:
+                flash(quota_error, 'danger')
+                return render_template('rescue.html', form_data=form_data, page_title="Report Animal Sighting")
         # --- End Image Saving ---
 
 
@@ -791,8 +1331,14 @@ def rescue_page():
             )
             print("DEBUG: Attempting DB INSERT for rescue report with values:", values)
             cur.execute(sql, values)
+            new_rescue_id = cur.lastrowid
+            storage.record_upload(cur, image_filename_rel, image_path_full, 'rescues', reporter_user_id, new_rescue_id)
             mysql.connection.commit()
             print(f"DEBUG: DB INSERT successful for rescue report")
+            triage_queue.add({'rescue_id': new_rescue_id, 'animal_type': values[0], 'location': values[1],
+                              'condition_details': values[2], 'image_filename': image_filename_rel,
+                              'reported_at': datetime.now()})
+            audit_log.record('rescue', new_rescue_id, 'reported', to_state=triage.STATUS_OPEN, actor_user_id=reporter_user_id)
 
             flash('Rescue report submitted successfully! Thank you for your help.', 'success')
             return redirect(url_for('rescue_page')) # Redirect after success to clear form
@@ -817,6 +1363,102 @@ def rescue_page():
     return render_template('rescue.html', form_data=form_data, page_title="Report Animal Sighting")
 
 
+# --- Rescue Triage (responders pull reports, most urgent and oldest first) ---
+triage_queue = triage.TriageQueue(app.config['TRIAGE_REFRESH_SECONDS'])
+
+def current_triage_queue():
+    # Rebuilds this worker's queue from the open rows when it is older than TRIAGE_REFRESH_SECONDS,
+    # which also picks up reports and claims made through other workers.
+    if triage_queue.needs_refresh():
+        cur = None
+        try:
+            cur = mysql.connection.cursor()
+            triage_queue.rebuild(triage.load_open_rescues(cur))
+        except Exception as e:
+            print(f"DB Error rebuilding triage queue: {e}") # Serve the last known queue
+        finally:
+            if cur: cur.close()
+    return triage_queue
+
+def triage_json(report):
+    image_path = storage.static_path(report.get('image_filename'), 'rescues')
+    reported_at = report.get('reported_at')
+    return {
+        'rescue_id': report['rescue_id'], 'animal_type': report.get('animal_type'), 'location': report.get('location'),
+        'condition_details': report.get('condition_details'), 'urgency': triage.urgency_of(report.get('condition_details')),
+        'reported_at': reported_at.isoformat() if hasattr(reported_at, 'isoformat') else reported_at,
+        'image_url': url_for('static', filename=image_path) if image_path else None,
+    }
+
+
+@app.route('/triage')
+def triage_list():
+    if 'user_id' not in session: return jsonify({'success': False, 'message': 'Authentication required.'}), 401
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    queue = current_triage_queue()
+    return jsonify({'success': True, 'open': len(queue), 'reports': [triage_json(r) for r in queue.top(limit)]})
+
+
+@app.route('/triage/mine')
+def triage_mine():
+    if 'user_id' not in session: return jsonify({'success': False, 'message': 'Authentication required.'}), 401
+    cur = None
+    try:
+        cur = mysql.connection.cursor()
+        reports = triage.load_claimed_rescues(cur, session['user_id'])
+    except Exception as e:
+        print(f"DB Error fetching claimed rescues: {e}")
+        return jsonify({'success': False, 'message': 'Could not load your claimed reports.'}), 500
+    finally:
+        if cur: cur.close()
+    return jsonify({'success': True, 'reports': [triage_json(r) for r in reports]})
+
+
+@app.route('/triage/<int:rescue_id>/<action>', methods=['POST'])
+def triage_action(rescue_id, action):
+    if 'user_id' not in session: return jsonify({'success': False, 'message': 'Authentication required.'}), 401
+    transitions = {'claim': triage.claim, 'release': triage.release, 'resolve': triage.resolve}
+    if action not in transitions: return jsonify({'success': False, 'message': 'Invalid action.'}), 400
+    user_id = session['user_id']
+    cur = None
+    try:
+        cur = mysql.connection.cursor()
+        won = transitions[action](cur, rescue_id, user_id)
+        if won:
+            mysql.connection.commit()
+            report = None
+            audit_log.record('rescue', rescue_id, action, *triage.TRANSITIONS[action], actor_user_id=user_id)
+        else:
+            mysql.connection.rollback()
+            report = triage.fetch_rescue(cur, rescue_id) # Explain why the compare-and-set lost
+    except Exception as e:
+        mysql.connection.rollback()
+        print(f"!!! DB Error (Triage {action} rescue {rescue_id}): {e}"); traceback.print_exc()
+        return jsonify({'success': False, 'message': 'Database error occurred processing request.'}), 500
+    finally:
+        if cur: cur.close()
+
+    if won:
+        if action == 'release':
+            cur = None
+            try: # Back into this worker's queue straight away; other workers pick it up on refresh
+                cur = mysql.connection.cursor(); triage_queue.add(triage.fetch_rescue(cur, rescue_id))
+            except Exception as e: print(f"DB Error re-queueing rescue {rescue_id}: {e}")
+            finally:
+                if cur: cur.close()
+        else:
+            triage_queue.remove(rescue_id)
+        return jsonify({'success': True, 'message': f"Report {rescue_id} {'claimed' if action == 'claim' else action + 'd'}."})
+
+    if not report: return jsonify({'success': False, 'message': 'Rescue report not found.'}), 404
+    if report['status'] != triage.STATUS_OPEN: triage_queue.remove(rescue_id) # Our queue was stale
+    if action == 'claim':
+        message = 'Already claimed by you.' if report['claimed_by'] == user_id else f"This report is already {report['status'].lower()}."
+    else:
+        message = 'You can only release or resolve reports you have claimed.'
+    return jsonify({'success': False, 'message': message}), 409
+
+
 # --- Volunteer Route (Handles GET and POST) ---
 @app.route('/volunteer', methods=['GET', 'POST'])
 def volunteer_page():
@@ -900,7 +1542,11 @@ def volunteer_page():
                 'Pending' # Default status
             )
             cur.execute(sql, values)
+            new_volunteer_id = cur.lastrowid
             mysql.connection.commit()
+            match_indexes['volunteer'].add(dict(zip(('name', 'email', 'phone', 'address', 'date_of_birth', 'availability',
+                                                     'areas_of_interest', 'experience', 'why_volunteer', 'status'), values),
+                                                application_id=new_volunteer_id))
             flash('Thank you for applying to volunteer! We will review your application and be in touch.', 'success')
             return redirect(url_for('volunteer_page')) # Redirect after success to clear form
 
@@ -944,6 +1590,7 @@ def foster_page():
         preferred_animal = ", ".join(preferred_animal_list) if preferred_animal_list else None # Store as comma-separated string or None
 
         foster_experience = form_data.get('foster_experience')
+        availability = form_data.get('foster_availability') # Free text, optional ("Weekends, weekday evenings")
         why_foster = form_data.get('foster_why')
 
         # --- Basic Validation ---
@@ -986,12 +1633,8 @@ def foster_page():
         cur = None
         try:
             cur = mysql.connection.cursor()
-            sql = """
-                INSERT INTO fosters (name, email, phone, address, household_info, home_type,
-                                   has_yard, yard_fenced, can_transport, preferred_animal,
-                                   foster_experience, why_foster, status)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """
+            columns = ('name', 'email', 'phone', 'address', 'household_info', 'home_type', 'has_yard', 'yard_fenced',
+                       'can_transport', 'preferred_animal', 'foster_experience', 'availability', 'why_foster', 'status')
             # Use None for optional fields if they are empty or just whitespace
             values = (
                 name.strip(),
@@ -1006,11 +1649,20 @@ def foster_page():
                 can_transport,
                 preferred_animal, # Comma-separated string or None
                 foster_experience.strip() if foster_experience and foster_experience.strip() else None,
+                availability.strip()[:255] if availability and availability.strip() else None,
                 why_foster.strip(),
                 'Pending' # Default status
             )
+            row = dict(zip(columns, values))
+            # availability only exists once `flask init-matching` has run; older databases get the rest
+            missing = set(matching.OPTIONAL_COLUMNS['foster']) - matching.present_columns(cur, 'foster')
+            stored = [c for c in columns if c not in missing]
+            sql = f"INSERT INTO fosters ({', '.join(stored)}) VALUES ({', '.join(['%s'] * len(stored))})"
+            values = tuple(row[c] for c in stored)
             cur.execute(sql, values)
+            new_foster_id = cur.lastrowid
             mysql.connection.commit()
+            match_indexes['foster'].add(dict(row, application_id=new_foster_id))
             flash('Thank you for your interest in fostering! We will review your application and contact you soon.', 'success')
             return redirect(url_for('foster_page')) # Redirect after success
 
@@ -1032,6 +1684,90 @@ def foster_page():
     return render_template('foster.html', form_data=form_data, page_title="Foster a Pet")
 
 
+# --- Volunteer / Foster Matching (coordinators) ---
+match_indexes = {kind: matching.MatchIndex(kind, app.config['MATCH_REFRESH_SECONDS']) for kind in matching.TABLES}
+MATCH_KINDS = {'volunteers': 'volunteer', 'fosters': 'foster'}
+MATCH_FIELDS = {
+    'volunteer': ('interest', 'status', 'area', 'experienced'),
+    'foster': ('home', 'yard', 'fenced', 'transport', 'prefers', 'status', 'area', 'experienced'),
+}
+
+def current_match_index(kind):
+    # Rebuilt from the table when older than MATCH_REFRESH_SECONDS, which picks up applications
+    # made through other workers and status changes; on a DB error the last index is served.
+    index = match_indexes[kind]
+    if index.needs_refresh():
+        cur = None
+        try:
+            cur = mysql.connection.cursor()
+            index.rebuild(matching.load_applications(cur, kind))
+        except Exception as e:
+            print(f"DB Error rebuilding {kind} match index: {e}")
+        finally:
+            if cur: cur.close()
+    return index
+
+def match_filters(kind, args):
+    # ?fenced=yes&transport=yes&prefers=puppies,any -> {'fenced': ['yes'], ...}
+    filters = {}
+    for field in MATCH_FIELDS[kind]:
+        values = [v.strip() for item in args.getlist(field) for v in item.split(',') if v.strip()]
+        if values: filters[field] = values
+    return filters
+
+def match_json(entry, score=None):
+    out = {key: entry[key] for key in ('id', 'name', 'email', 'phone', 'status', 'availability')}
+    out['slots'] = matching.describe_slots(entry['slots'])
+    if score is not None: out['score'] = score
+    return out
+
+def coordinator_error(message='Only coordinators can search applications.'):
+    # Applications and messages hold personal details, so only the ADMIN_USERS coordinators may read them
+    if 'user_id' not in session: return jsonify({'success': False, 'message': 'Authentication required.'}), 401
+    if session.get('username') not in app.config['ADMIN_USERS']:
+        return jsonify({'success': False, 'message': message}), 403
+    return None
+
+
+@app.route('/api/matching/<kind>')
+def api_match_search(kind):
+    # e.g. /api/matching/fosters?fenced=yes&transport=yes&available=weekends
+    error = coordinator_error()
+    if error: return error
+    if kind not in MATCH_KINDS: return jsonify({'success': False, 'message': 'Unknown application type.'}), 404
+    kind = MATCH_KINDS[kind]
+    available = matching.parse_availability(request.args.get('available'))
+    if request.args.get('available') and not available:
+        return jsonify({'success': False, 'message': "Could not read 'available' (try e.g. 'weekends' or 'weekday evenings')."}), 400
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+    entries, total = current_match_index(kind).find(match_filters(kind, request.args), available, limit,
+                                                    include_inactive=request.args.get('include_inactive') == '1')
+    return jsonify({'success': True, 'total': total, 'matches': [match_json(e) for e in entries]})
+
+
+@app.route('/api/matching/fosters/rescue/<int:rescue_id>')
+def api_match_fosters_for_rescue(rescue_id):
+    # Best fosters for a rescue report, scored on preferred animals, transport, yard, experience and
+    # area; the search filters above can narrow the candidates (e.g. ?available=weekends)
+    error = coordinator_error()
+    if error: return error
+    cur = None
+    try:
+        cur = db_router.read_connection().cursor()
+        rescue = triage.fetch_rescue(cur, rescue_id)
+    except Exception as e:
+        print(f"DB Error loading rescue {rescue_id} for matching: {e}")
+        return jsonify({'success': False, 'message': 'Could not load the rescue report.'}), 500
+    finally:
+        if cur: cur.close()
+    if not rescue: return jsonify({'success': False, 'message': 'Rescue report not found.'}), 404
+    weights = matching.rescue_weights(rescue, triage.urgency_of(rescue.get('condition_details')))
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+    ranked = current_match_index('foster').rank(weights, match_filters('foster', request.args),
+                                                matching.parse_availability(request.args.get('available')), limit)
+    return jsonify({'success': True, 'rescue': triage_json(rescue), 'matches': [match_json(e, score) for e, score in ranked]})
+
+
 @app.route('/educational')
 def educational_page():
     return render_template('placeholder.html', page_title="Pet Care & Adoption Resources")
@@ -1071,7 +1807,14 @@ def contact_page():
                 message.strip()
             )
             cur.execute(sql, values)
+            new_message_id = cur.lastrowid
             mysql.connection.commit()
+            try: # Search index and duplicate clustering; the message itself is already safely stored
+                inbox.index_message(cur, new_message_id, values[2], values[3], app.config['CONTACT_SPAM_CLUSTER_SIZE'])
+                mysql.connection.commit()
+            except Exception as e:
+                mysql.connection.rollback()
+                print(f"WARNING: Could not index contact message {new_message_id} ('flask index-inbox' will pick it up): {e}")
             flash("Thank you for your message! We have received it and will get back to you soon.", 'success')
             return redirect(url_for('contact_page')) # Redirect to clear form
         except Exception as e:
@@ -1088,6 +1831,120 @@ def contact_page():
     return render_template('contact.html', page_title="Contact Us", form_data=form_data)
 
 
+# --- Contact Inbox (staff) ---
+def inbox_message_json(message):
+    out = dict(message)
+    received_at = out.get('received_at')
+    if hasattr(received_at, 'isoformat'): out['received_at'] = received_at.isoformat()
+    return out
+
+
+@app.route('/api/inbox')
+def api_inbox():
+    # Newest first. ?q=words (all must match), ?status=new|read|replied|archived|spam, ?cluster=<id>, ?cursor=
+    error = coordinator_error("Only staff can read the inbox.")
+    if error: return error
+    status = request.args.get('status') or None
+    if status and status not in inbox.STATUSES: return jsonify({'success': False, 'message': 'Unknown status.'}), 400
+    limit = min(max(request.args.get('limit', app.config['INBOX_PAGE_SIZE'], type=int), 1), 200)
+    cursor = request.args.get('cursor')
+    cur = None
+    try:
+        cur = db_router.read_connection().cursor()
+        if request.args.get('q'):
+            messages, next_cursor = inbox.search_messages(cur, request.args['q'], status, cursor, limit)
+        else:
+            messages, next_cursor = inbox.list_messages(cur, status, request.args.get('cluster', type=int), cursor, limit)
+    except Exception as e:
+        print(f"DB Error reading inbox: {e}"); traceback.print_exc()
+        return jsonify({'success': False, 'message': 'Could not load messages.'}), 500
+    finally:
+        if cur: cur.close()
+    return jsonify({'success': True, 'messages': [inbox_message_json(m) for m in messages], 'next_cursor': next_cursor})
+
+
+@app.route('/api/inbox/<int:message_id>')
+def api_inbox_message(message_id):
+    # The full message; opening a 'new' message marks it read
+    error = coordinator_error("Only staff can read the inbox.")
+    if error: return error
+    cur = None
+    try:
+        cur = mysql.connection.cursor()
+        message = inbox.get_message(cur, message_id)
+        if message and message['status'] == 'new' and inbox.mark_read(cur, message_id):
+            mysql.connection.commit()
+            message['status'] = 'read'
+            audit_log.record('contact_message', message_id, 'read', 'new', 'read', session['user_id'])
+    except Exception as e:
+        mysql.connection.rollback()
+        print(f"DB Error reading contact message {message_id}: {e}")
+        return jsonify({'success': False, 'message': 'Could not load the message.'}), 500
+    finally:
+        if cur: cur.close()
+    if not message: return jsonify({'success': False, 'message': 'Message not found.'}), 404
+    return jsonify({'success': True, 'message': inbox_message_json(message)})
+
+
+@app.route('/api/inbox/clusters')
+def api_inbox_clusters():
+    # Groups of near-identical messages, largest first (repeated submissions, spam runs)
+    error = coordinator_error("Only staff can read the inbox.")
+    if error: return error
+    cur = None
+    try:
+        cur = db_router.read_connection().cursor()
+        clusters = inbox.list_clusters(cur, max(request.args.get('min_size', 2, type=int), 1),
+                                       min(max(request.args.get('limit', 50, type=int), 1), 200))
+    except Exception as e:
+        print(f"DB Error listing inbox clusters: {e}")
+        return jsonify({'success': False, 'message': 'Could not load clusters.'}), 500
+    finally:
+        if cur: cur.close()
+    return jsonify({'success': True, 'clusters': [dict(c, spam=c['spam'] > 0) for c in clusters]})
+
+
+@app.route('/api/inbox/status', methods=['POST'])
+def api_inbox_status():
+    # Bulk triage in one statement: {"status": "archived", "ids": [1, 2, 3]} or {"status": "spam", "cluster_id": 7}.
+    # With a cluster_id, "spam": false marks the cluster not spam (its future members stay in the inbox).
+    error = coordinator_error("Only staff can update the inbox.")
+    if error: return error
+    data = request.get_json(silent=True) or request.form
+    status = data.get('status')
+    if status not in inbox.STATUSES: return jsonify({'success': False, 'message': 'Unknown status.'}), 400
+    cluster_id = data.get('cluster_id')
+    ids = data.get('ids') if request.is_json else request.form.getlist('ids')
+    try:
+        ids = [int(i) for i in (ids or [])]
+        cluster_id = int(cluster_id) if cluster_id not in (None, '') else None
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'ids and cluster_id must be numbers.'}), 400
+    if (cluster_id is None) == (not ids): return jsonify({'success': False, 'message': 'Send either ids or cluster_id.'}), 400
+    if len(ids) > inbox.MAX_BULK_IDS: return jsonify({'success': False, 'message': f'At most {inbox.MAX_BULK_IDS} ids per request.'}), 400
+    spam = data.get('spam')
+    if spam is not None and not isinstance(spam, bool): spam = str(spam).lower() in ('1', 'true', 'yes')
+    if spam is not None and cluster_id is None: return jsonify({'success': False, 'message': 'spam applies to a cluster_id.'}), 400
+    if spam is False and status == 'spam': return jsonify({'success': False, 'message': 'A spam status contradicts "spam": false.'}), 400
+    cur = None
+    try:
+        cur = mysql.connection.cursor()
+        updated = inbox.set_cluster_status(cur, status, cluster_id, spam) if cluster_id is not None else inbox.set_status(cur, status, ids)
+        mysql.connection.commit()
+    except Exception as e:
+        mysql.connection.rollback()
+        print(f"DB Error updating inbox status: {e}"); traceback.print_exc()
+        return jsonify({'success': False, 'message': 'Could not update messages.'}), 500
+    finally:
+        if cur: cur.close()
+    db_router.mark_write()
+    if cluster_id is not None:
+        audit_log.record('contact_cluster', cluster_id, 'status_set', None, status, session['user_id'], details={'messages': updated, 'spam': spam})
+    else:
+        for message_id in ids: audit_log.record('contact_message', message_id, 'status_set', None, status, session['user_id'])
+    return jsonify({'success': True, 'updated': updated})
+
+
 @app.errorhandler(404)
 def page_not_found(e):
     print(f"404 Error: Path '{request.path}' not found.") # Add logging
@@ -1104,8 +1961,302 @@ def internal_server_error(e):
     current_year = datetime.now(timezone.utc).year
     return render_template('500.html', current_year=current_year), 500
 
+# --- CLI Commands (run with `flask --app app <command>`) ---
+@app.cli.command('import-animals')
+@click.argument('manifest', type=click.Path(exists=True, dir_okay=False))
+@click.option('--user-id', type=int, required=True, help='Shelter account the animals are posted under.')
+@click.option('--images', 'images_path', type=click.Path(exists=True), default=None, help='Directory or .zip with the images named in the manifest.')
+@click.option('--batch-size', type=int, default=bulk_import.DEFAULT_BATCH_SIZE, show_default=True)
+@click.option('--workers', type=int, default=bulk_import.DEFAULT_WORKERS, show_default=True, help='Parallel image copy threads.')
+@click.option('--progress', 'progress_path', type=click.Path(dir_okay=False), default=None, help='Resume file (default: <manifest>.progress.json).')
+def import_animals_command(manifest, user_id, images_path, batch_size, workers, progress_path):
+    """Bulk import animals from a CSV/NDJSON manifest. Re-run the same command to resume."""
+    progress_path = progress_path or manifest + '.progress.json'
+    summary = run_animal_import(mysql.connection, manifest, user_id, images_path, batch_size, workers, progress_path)
+    for err in summary['errors']:
+        click.echo(f"Row {err['row']}: {err['message']}", err=True)
+    click.echo(summary['message'])
+    if not summary['completed']: raise SystemExit(1)
+
+
+@app.cli.command('rebuild-upload-index')
+def rebuild_upload_index_command():
+    """Create/backfill the upload_index table from the animals, adoptions and rescues path columns."""
+    indexed = storage.rebuild_index(mysql.connection, app.static_folder)
+    ensure_dir(app.instance_path)
+    storage.mark_index_built(app.config['STORAGE_STATE_PATH'])
+    click.echo(f"Indexed {indexed} uploaded files.")
+    cur = mysql.connection.cursor()
+    try:
+        for kind, usage in storage.usage_by_kind(cur).items():
+            click.echo(f"  {kind}: {usage['files']} files, {usage['bytes'] / (1024 * 1024):.1f} MB")
+    finally:
+        cur.close()
+
+
+@app.cli.command('sweep-uploads')
+@click.option('--batch-size', type=int, default=storage.DEFAULT_SWEEP_BATCH, show_default=True, help='Files examined per upload folder per batch.')
+@click.option('--batches', type=int, default=1, show_default=True, help='Batches to run before exiting (schedule this command from cron).')
+@click.option('--grace', 'grace_seconds', type=int, default=storage.DEFAULT_SWEEP_GRACE_SECONDS, show_default=True, help='Ignore files younger than this many seconds.')
+@click.option('--dry-run', is_flag=True, help='Only list orphans, do not delete anything.')
+def sweep_uploads_command(batch_size, batches, grace_seconds, dry_run):
+    """Remove uploaded files that no committed row references."""
+    uploads_root = os.path.join(app.static_folder, 'uploads')
+    ensure_dir(app.instance_path)
+    for _ in range(batches):
+        result = storage.sweep_orphans(mysql.connection, uploads_root, app.config['STORAGE_STATE_PATH'],
+                                       batch_size=batch_size, grace_seconds=grace_seconds, dry_run=dry_run)
+        for rel_path in result['orphans']:
+            click.echo(("Would remove " if dry_run else "Removed ") + rel_path)
+        click.echo(f"Scanned {result['scanned']} files, removed {result['removed']} ({result['bytes_freed'] / (1024 * 1024):.1f} MB freed).")
+        if not result['scanned']: break
+
+
+@app.cli.command('shard-uploads')
+@click.option('--batch-size', type=int, default=500, show_default=True, help='Rows rewritten per transaction.')
+@click.option('--dry-run', is_flag=True, help='Only count what would move.')
+def shard_uploads_command(batch_size, dry_run):
+    """Move flat static/uploads/<kind>/ files into the hashed ab/cd/ layout and rewrite their paths."""
+    result = storage.migrate_to_shards(mysql.connection, app.static_folder, batch_size=batch_size, dry_run=dry_run)
+    click.echo(f"{'Would move' if dry_run else 'Moved'} {result['moved']} files "
+               f"({result['already_sharded']} already sharded, {result['missing']} missing on disk, "
+               f"{result['changed']} changed while moving and left in place).")
+
+
+@app.cli.command('init-triage')
+def init_triage_command():
+    """Add the claimed_by/claimed_at columns and status index that rescue triage needs."""
+    triage.ensure_triage_columns(mysql.connection)
+    click.echo("Rescue triage columns are in place.")
+
+
+@app.cli.command('init-matching')
+def init_matching_command():
+    """Add the fosters.availability column used by volunteer/foster matching."""
+    matching.ensure_matching_columns(mysql.connection)
+    cur = mysql.connection.cursor()
+    try:
+        for kind in matching.TABLES: matching.id_column(cur, kind) # Fails here rather than on the first search
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    finally:
+        cur.close()
+    click.echo("Matching columns are in place.")
+
+
+@app.cli.command('match')
+@click.argument('kind', type=click.Choice(sorted(MATCH_KINDS)))
+@click.option('--where', 'conditions', multiple=True, help="field=value[,value], e.g. fenced=yes (repeatable).")
+@click.option('--available', default=None, help="Free-text availability, e.g. 'weekends'.")
+@click.option('--rescue', 'rescue_id', type=int, default=None, help="Rank fosters for this rescue report.")
+@click.option('--limit', default=20, show_default=True)
+def match_command(kind, conditions, available, rescue_id, limit):
+    """Search volunteer/foster applications, or rank fosters for a rescue."""
+    kind = MATCH_KINDS[kind]
+    filters = {}
+    for condition in conditions:
+        field, _, values = condition.partition('=')
+        if field not in MATCH_FIELDS[kind]: raise click.BadParameter(f"{field} (one of {', '.join(MATCH_FIELDS[kind])})", param_hint='--where')
+        filters.setdefault(field, []).extend(v.strip() for v in values.split(',') if v.strip())
+    slots = matching.parse_availability(available)
+    index = current_match_index(kind)
+    if rescue_id is not None:
+        if kind != 'foster': raise click.UsageError("--rescue ranks fosters only.")
+        cur = mysql.connection.cursor()
+        try: rescue = triage.fetch_rescue(cur, rescue_id)
+        finally: cur.close()
+        if not rescue: raise click.ClickException(f"Rescue {rescue_id} not found.")
+        results = index.rank(matching.rescue_weights(rescue, triage.urgency_of(rescue.get('condition_details'))), filters, slots, limit)
+    else:
+        results = [(entry, None) for entry in index.find(filters, slots, limit)[0]]
+    for entry, score in results:
+        prefix = f"[{score:>2}] " if score is not None else ""
+        click.echo(f"{prefix}#{entry['id']} {entry['name']} <{entry['email']}> {entry['phone'] or ''} ({entry['status']}) - {entry['availability'] or 'availability not given'}")
+    click.echo(f"{len(results)} match(es) out of {len(index)} {kind} applications.")
+
+
+@app.cli.command('init-inbox')
+def init_inbox_command():
+    """Add the contact inbox columns, search index and duplicate-cluster tables."""
+    inbox.ensure_inbox_tables(mysql.connection)
+    click.echo("Inbox tables are in place. Run 'flask index-inbox' to index existing messages.")
+
+
+@app.cli.command('index-inbox')
+@click.option('--batch-size', default=500, show_default=True)
+def index_inbox_command(batch_size):
+    """Index and cluster contact messages that are not indexed yet (resumable)."""
+    total = 0
+    while True:
+        count = inbox.index_pending(mysql.connection, batch_size, app.config['CONTACT_SPAM_CLUSTER_SIZE'])
+        if not count: break
+        total += count
+        click.echo(f"Indexed {total} messages...")
+    click.echo(f"Done: {total} messages indexed.")
+
+
+@app.cli.command('init-dashboard-indexes')
+def init_dashboard_indexes_command():
+    """Add the (user, date, id) indexes the paginated dashboard sections read through."""
+    dashboard_sections.ensure_dashboard_indexes(mysql.connection)
+    click.echo("Dashboard indexes are in place.")
+
+
+@app.cli.command('init-audit')
+def init_audit_command():
+    """Create the append-only audit_events table."""
+    audit.ensure_audit_table(mysql.connection)
+    click.echo("Audit table is in place.")
+
+
+@app.cli.command('flush-audit')
+def flush_audit_command():
+    """Insert pending audit segments now, including ones left behind by dead workers."""
+    inserted = audit_log.flush(mysql.connection, include_orphans=True)
+    click.echo(f"Inserted {inserted} audit events.")
+
+
+@app.cli.command('audit-log')
+@click.option('--entity', help='entity_type or entity_type:id, e.g. adoption:42')
+@click.option('--actor', type=int, help='Only events by this user id.')
+@click.option('--since', help='ISO date/time, inclusive.')
+@click.option('--until', help='ISO date/time, exclusive.')
+@click.option('--limit', type=int, default=50, show_default=True)
+def audit_log_command(entity, actor, since, until, limit):
+    """Print audit events, newest first."""
+    entity_type, _, entity_id = (entity or '').partition(':')
+    cur = mysql.connection.cursor()
+    try:
+        events, _ = audit.query_events(cur, entity_type or None, int(entity_id) if entity_id else None,
+                                       actor, since, until, limit=limit)
+    finally:
+        cur.close()
+    for e in events:
+        click.echo(f"{e['occurred_at']}  {e['entity_type']}:{e['entity_id']}  {e['action']}  "
+                   f"{e['from_state'] or '-'} -> {e['to_state'] or '-'}  user={e['actor_user_id']}  {json.dumps(e['details']) if e['details'] else ''}")
+
+
+@app.cli.command('build-recommendations')
+def build_recommendations_command():
+    """Build the similar-animals index and save the snapshot that the workers load."""
+    started = time.time()
+    cur = mysql.connection.cursor()
+    try:
+        recommender.rebuild(recommend.load_animals(cur), recommend.load_requests(cur))
+    finally:
+        cur.close()
+    recommender.save(app.config['RECOMMEND_SNAPSHOT'])
+    click.echo(f"Indexed {len(recommender)} animals in {time.time() - started:.1f}s -> {app.config['RECOMMEND_SNAPSHOT']}")
+
+
+@app.cli.command('snapshot-catalogue')
+def snapshot_catalogue_command():
+    """Write the offline catalogue snapshot now (workers also refresh it when it goes stale)."""
+    started = time.time()
+    count = catalogue.refresh(db_router.open_primary_connection)
+    if count is None:
+        click.echo("Another process is writing the snapshot; skipped."); return
+    click.echo(f"Saved {count} animals in {time.time() - started:.1f}s -> {catalogue.path}")
+
+
+@app.cli.command('precompile-templates')
+@click.option('--clear', is_flag=True, help='Drop all cached bytecode first (e.g. after a Jinja upgrade).')
+def precompile_templates_command(clear):
+    """Compile every template into the shared bytecode cache (run at deploy time)."""
+    bytecode_cache = app.jinja_env.bytecode_cache
+    if bytecode_cache is None:
+        click.echo("JINJA_BYTECODE_CACHE is disabled, nothing to precompile."); return
+    if clear: bytecode_cache.clear()
+    count, seconds = warm_templates(app)
+    click.echo(f"Compiled {count} templates into {app.config['JINJA_BYTECODE_CACHE']} in {seconds * 1000:.0f} ms.")
+
+
+# --- Application Factory ---
+# The request/teardown hooks of the DB extension, replica router and profiler are registered at import
+# (this opens nothing); init_extensions() re-reads their config and does the rest.
+profiler.init_app(app)
+mysql.init_app(app)
+db_router.init_app(app)
+# Wraps the WSGI app at import so the very first request is already resolved; the hop count is re-read from
+# the config in init_extensions()
+proxy_fix = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'], x_proto=app.config['TRUSTED_PROXIES'])
+app.wsgi_app = proxy_fix
+_init_lock = threading.Lock()
+
+def init_extensions(app):
+    # Copies the config into the DB extension/router and per-worker helpers and creates the instance
+    # folders. Idempotent. Runs from create_app(), or on first use when app:app is served directly.
+    if app.extensions.get('animalcarehub'): return app
+    with _init_lock:
+        if app.extensions.get('animalcarehub'): return app
+        configure_extensions(app)
+        app.extensions['animalcarehub'] = True
+    return app
+
+@appcontext_pushed.connect_via(app)
+def init_on_first_use(sender, **extra):
+    # `gunicorn app:app` and `flask --app app` skip create_app(): initialise when the first request
+    # or CLI command pushes an app context (before any template has been loaded)
+    if not app.extensions.get('animalcarehub'): init_extensions(app)
+
+def configure_extensions(app):
+    profiler.init_app(app)
+    mysql.init_app(app)
+    db_router.init_app(app)
+    db_router.on_connect = profiler.instrument
+    proxy_fix.x_for = proxy_fix.x_proto = app.config['TRUSTED_PROXIES']
+    limiter.limits = app.config['RATE_LIMITS']; limiter.path = app.config['RATE_LIMIT_STORE']
+    triage_queue.refresh_seconds = app.config['TRIAGE_REFRESH_SECONDS']
+    for index in match_indexes.values(): index.refresh_seconds = app.config['MATCH_REFRESH_SECONDS']
+    recommender.refresh_seconds = app.config['RECOMMEND_REFRESH_SECONDS']
+    catalogue.path = app.config['CATALOGUE_SNAPSHOT']; catalogue.refresh_seconds = app.config['CATALOGUE_SNAPSHOT_SECONDS']
+    catalogue_breaker.failure_threshold = app.config['CATALOGUE_BREAKER_FAILURES']
+    catalogue_breaker.probe_seconds = app.config['CATALOGUE_PROBE_SECONDS']
+    catalogue_breaker.slow_seconds = app.config['CATALOGUE_SLOW_SECONDS']
+    catalogue_breaker.probe = probe_database
+    audit_log.segment_dir = app.config['AUDIT_SEGMENT_DIR']; audit_log.flush_seconds = app.config['AUDIT_FLUSH_SECONDS']
+    audit_log.connect = db_router.open_primary_connection
+    idempotency_store.path = app.config['IDEMPOTENCY_STORE']
+    idempotency_store.ttl_seconds = app.config['IDEMPOTENCY_TTL_SECONDS']
+    idempotency_store.max_entries = app.config['IDEMPOTENCY_MAX_ENTRIES']
+    idempotency_store.pending_lease_seconds = app.config['IDEMPOTENCY_PENDING_LEASE_SECONDS']
+    sanitiser.workers = app.config['IMAGE_WORKERS']; sanitiser.queue_size = app.config['IMAGE_QUEUE_SIZE']
+    sanitiser.queue_wait_seconds = app.config['IMAGE_QUEUE_WAIT_SECONDS']
+    sanitiser.max_side = app.config['IMAGE_MAX_SIDE']; sanitiser.max_pixels = app.config['IMAGE_MAX_PIXELS']
+    sanitiser.timeout_seconds = app.config['IMAGE_TIMEOUT_SECONDS']; sanitiser.jpeg_quality = app.config['IMAGE_JPEG_QUALITY']
+    if not ensure_dir(app.instance_path): print("WARNING: Instance folder issue (rate limits, imports, sweeper state).")
+    cache_dir = app.config['JINJA_BYTECODE_CACHE']
+    if cache_dir and ensure_dir(cache_dir): # Must be attached before the first template is loaded
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+
+def warm_templates(app):
+    # Loads (parses + compiles) every template into Jinja's in-memory cache so the first request to
+    # each page in a fresh worker doesn't pay for it. Returns (count, seconds).
+    started = time.perf_counter(); count = 0
+    for name in app.jinja_env.list_templates(filter_func=lambda n: n.endswith('.html')):
+        try:
+            app.jinja_env.get_template(name); count += 1
+        except Exception as e:
+            print(f"WARNING: Template {name} failed to compile: {e}")
+    return count, time.perf_counter() - started
+
+def create_app(config_overrides=None):
+    # Entry point for servers and the CLI: gunicorn 'app:create_app()' / FLASK_APP=app:create_app()
+    # (.flaskenv). Each gunicorn worker calls this after fork, so template warm-up happens per worker.
+    if config_overrides:
+        app.config.update(config_overrides)
+        if app.extensions.get('animalcarehub'):
+            # Already initialised by an earlier app context: re-apply the config so the overrides take effect
+            with _init_lock: configure_extensions(app)
+    init_extensions(app)
+    if app.config['WARM_TEMPLATES']:
+        count, seconds = warm_templates(app)
+        app.logger.debug(f"Warmed {count} templates in {seconds * 1000:.1f} ms")
+    return app
+
+
 # --- Main Execution ---
 if __name__ == '__main__':
     # In production, prefer serving via a production-ready WSGI server like Gunicorn or uWSGI.
     # debug=True should ONLY be used during development.
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    create_app().run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
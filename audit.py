@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+# Append-only audit log of state transitions (listings posted, adoption requests submitted /
+# accepted / rejected, donations, rescue triage claims).
+#
+# Recording an event must not slow the request down, so record() only appends one JSON line to a
+# local segment file (an O_APPEND write, no fsync, no DB round trip). A background thread in each
+# worker rotates the segment every AUDIT_FLUSH_SECONDS (or once it holds AUDIT_SEGMENT_EVENTS
+# events) and bulk-inserts sealed segments into the audit_events table, deleting each segment only
+# after its batch has committed. Every event carries a random event_uuid with a UNIQUE key, so a
+# segment that was half inserted when a worker died is simply inserted again (INSERT IGNORE) by
+# the next flush, from any worker or `flask flush-audit`.
+#
+# The table is never updated or deleted from by the app. Queries go through the
+# (entity_type, entity_id, occurred_at) and (actor_user_id, occurred_at) indexes, newest first,
+# with keyset cursors.
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from helpers import decode_cursor, encode_cursor
+
+
+AUDIT_DDL = """
+CREATE TABLE IF NOT EXISTS audit_events (
+    event_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    event_uuid CHAR(32) NOT NULL,
+    occurred_at DATETIME(6) NOT NULL,
+    entity_type VARCHAR(32) NOT NULL,
+    entity_id BIGINT NOT NULL,
+    action VARCHAR(32) NOT NULL,
+    from_state VARCHAR(32) NULL,
+    to_state VARCHAR(32) NULL,
+    actor_user_id INT NULL,
+    details TEXT NULL,
+    UNIQUE KEY uq_audit_uuid (event_uuid),
+    KEY idx_audit_entity (entity_type, entity_id, occurred_at),
+    KEY idx_audit_actor (actor_user_id, occurred_at),
+    KEY idx_audit_time (occurred_at)
+)
+"""
+INSERT_SQL = ("INSERT IGNORE INTO audit_events (event_uuid, occurred_at, entity_type, entity_id, action, from_state, to_state, actor_user_id, details) "
+              "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)")
+
+DEFAULT_FLUSH_SECONDS = 5
+DEFAULT_SEGMENT_EVENTS = 5000
+INSERT_BATCH = 500
+OPEN_SUFFIX = '.open'     # Being appended to by its worker
+SEALED_SUFFIX = '.ndjson' # Complete, waiting to be inserted
+CLAIMED_SUFFIX = '.claimed' # Being inserted by one flusher
+
+
+class AuditLog:
+    def __init__(self, segment_dir, flush_seconds=DEFAULT_FLUSH_SECONDS, segment_events=DEFAULT_SEGMENT_EVENTS):
+        self.segment_dir = segment_dir
+        self.flush_seconds = flush_seconds
+        self.segment_events = segment_events
+        self.connect = None # Callable returning a new DB connection, set by the app (init_extensions)
+        self._fd = None
+        self._path = None
+        self._events_in_segment = 0
+        self._pid = None
+        self._lock = threading.Lock()
+
+    # --- Recording (request path) ---
+    def record(self, entity_type, entity_id, action, from_state=None, to_state=None, actor_user_id=None, details=None):
+        event = {
+            'event_uuid': uuid.uuid4().hex, 'occurred_at': datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f'),
+            'entity_type': entity_type, 'entity_id': entity_id, 'action': action,
+            'from_state': from_state, 'to_state': to_state, 'actor_user_id': actor_user_id, 'details': details,
+        }
+        line = (json.dumps(event, separators=(',', ':'), default=str) + '\n').encode('utf-8')
+        try:
+            with self._lock:
+                self._ensure_segment()
+                os.write(self._fd, line)
+                self._events_in_segment += 1
+                if self._events_in_segment >= self.segment_events: self._seal()
+        except OSError as e:
+            # Never fail the user's request over auditing; the event is printed so it is not silently lost
+            print(f"ERROR writing audit event ({e}): {line.decode('utf-8').strip()}")
+
+    def _ensure_segment(self):
+        if self._pid != os.getpid(): # Forked (gunicorn worker): never share the parent's segment or flusher
+            self._fd = None; self._pid = os.getpid()
+            atexit.register(self.seal) # A cleanly exiting worker leaves a sealed segment for the others
+            self._start_flusher()
+        if self._fd is None:
+            os.makedirs(self.segment_dir, exist_ok=True)
+            self._path = os.path.join(self.segment_dir, f"audit-{os.getpid()}-{time.time_ns()}{OPEN_SUFFIX}")
+            self._fd = os.open(self._path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            self._events_in_segment = 0
+
+    def _seal(self):
+        # Closes the current segment and hands it to the flusher (called with the lock held)
+        if self._fd is None: return
+        os.close(self._fd)
+        os.replace(self._path, self._path[:-len(OPEN_SUFFIX)] + SEALED_SUFFIX)
+        self._fd = None; self._path = None
+
+    def seal(self):
+        with self._lock:
+            if self._pid == os.getpid() and self._events_in_segment: self._seal()
+
+    # --- Flushing (background thread / CLI) ---
+    def _start_flusher(self):
+        if not self.connect or not self.flush_seconds: return
+        threading.Thread(target=self._flush_loop, name='audit-flusher', daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            try:
+                self.seal()
+                if self.pending_segments(): self.flush()
+            except Exception as e:
+                print(f"ERROR flushing audit log (will retry): {e}")
+
+    def pending_segments(self):
+        return sorted(glob.glob(os.path.join(self.segment_dir, '*' + SEALED_SUFFIX)))
+
+    def flush(self, connection=None, include_orphans=False):
+        # Bulk-inserts every sealed segment. Each segment is claimed by renaming it, so concurrent
+        # flushers never insert the same file twice. include_orphans also recovers segments left
+        # '.claimed' or '.open' by dead workers (CLI only: a live worker may still own them).
+        # Returns the number of events inserted.
+        paths = self.pending_segments()
+        if include_orphans:
+            paths += sorted(glob.glob(os.path.join(self.segment_dir, '*' + CLAIMED_SUFFIX)))
+            paths += [p for p in glob.glob(os.path.join(self.segment_dir, '*' + OPEN_SUFFIX)) if not _owner_alive(p)]
+        if not paths: return 0
+        own_connection = connection is None
+        connection = connection or self.connect()
+        inserted = 0
+        try:
+            for path in paths:
+                claimed = path if path.endswith(CLAIMED_SUFFIX) else path.rsplit('.', 1)[0] + CLAIMED_SUFFIX
+                try:
+                    if claimed != path: os.replace(path, claimed)
+                except FileNotFoundError:
+                    continue # Another worker claimed it first
+                try:
+                    inserted += self._insert_segment(connection, claimed)
+                except Exception:
+                    os.replace(claimed, claimed[:-len(CLAIMED_SUFFIX)] + SEALED_SUFFIX) # Back in the queue for the next flush
+                    raise
+                try: os.remove(claimed)
+                except FileNotFoundError: pass # Recovered concurrently by `flask flush-audit`; the UNIQUE key kept it single
+        finally:
+            if own_connection: connection.close()
+        return inserted
+
+    def _insert_segment(self, connection, path):
+        rows = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    e = json.loads(line)
+                except ValueError:
+                    continue # Torn last line from a crash
+                details = e.get('details')
+                rows.append((e['event_uuid'], e['occurred_at'], e['entity_type'], e['entity_id'], e['action'],
+                             e.get('from_state'), e.get('to_state'), e.get('actor_user_id'),
+                             json.dumps(details, separators=(',', ':')) if details is not None else None))
+        cur = connection.cursor()
+        try:
+            for start in range(0, len(rows), INSERT_BATCH):
+                cur.executemany(INSERT_SQL, rows[start:start + INSERT_BATCH])
+            connection.commit()
+        except Exception:
+            connection.rollback(); raise
+        finally:
+            cur.close()
+        return len(rows)
+
+
+def _owner_alive(path):
+    # Segment names are audit-<pid>-<ns>; checks whether that pid still exists on this host
+    try:
+        pid = int(os.path.basename(path).split('-')[1])
+        os.kill(pid, 0)
+        return True
+    except (IndexError, ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        return True
+
+
+def ensure_audit_table(connection):
+    cur = connection.cursor()
+    try:
+        cur.execute(AUDIT_DDL)
+        connection.commit()
+    finally:
+        cur.close()
+
+
+def query_events(cur, entity_type=None, entity_id=None, actor_user_id=None, since=None, until=None, cursor=None, limit=50):
+    # Newest first. Returns (events, next_cursor). Filter by entity and/or actor so one of the
+    # indexes applies; since/until are datetimes or ISO strings.
+    where, params = [], []
+    if entity_type:
+        where.append("entity_type = %s"); params.append(entity_type)
+        if entity_id is not None: where.append("entity_id = %s"); params.append(entity_id)
+    if actor_user_id is not None: where.append("actor_user_id = %s"); params.append(actor_user_id)
+    if since: where.append("occurred_at >= %s"); params.append(since)
+    if until: where.append("occurred_at < %s"); params.append(until)
+    after = decode_cursor(cursor)
+    if after and len(after) == 2:
+        where.append("(occurred_at < %s OR (occurred_at = %s AND event_id < %s))"); params += [after[0], after[0], after[1]]
+    sql = ("SELECT event_id, occurred_at, entity_type, entity_id, action, from_state, to_state, actor_user_id, details FROM audit_events"
+           + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY occurred_at DESC, event_id DESC LIMIT %s")
+    params.append(limit + 1)
+    cur.execute(sql, tuple(params))
+    events = list(cur.fetchall())
+    next_cursor = None
+    if len(events) > limit:
+        events = events[:limit]
+        next_cursor = encode_cursor(events[-1]['occurred_at'], events[-1]['event_id'])
+    for event in events:
+        if event.get('details'):
+            try: event['details'] = json.loads(event['details'])
+            except ValueError: pass
+    return events, next_cursor
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# Upload sanitiser (image_sanitiser.py) throughput for different process pool sizes.
+#
+#   python benchmarks/image_sanitiser.py --images 64 --workers 1,2,4,8 --clients 16
+#
+# Generates phone-sized JPEGs with EXIF/GPS metadata, then has --clients threads (standing in for
+# concurrent upload requests in one web worker) push them through ImageSanitiser.sanitise() for
+# each pool size. Reports images/s, p50/p99 latency per upload and how many uploads were turned
+# away with SanitiserBusy because the queue stayed full. No database needed.
+import argparse
+import io
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import image_sanitiser # noqa: E402
+
+
+def synthetic_photo(path, width, height, seed):
+    # Smooth gradient plus noise, so the JPEG costs about as much to decode/encode as a real photo
+    rng = random.Random(seed)
+    small = Image.new('RGB', (width // 64, height // 64))
+    small.putdata([(rng.randrange(256), rng.randrange(256), rng.randrange(256)) for _ in range(small.width * small.height)])
+    image = small.resize((width, height), Image.BICUBIC)
+    image = Image.blend(image, Image.effect_noise((width, height), 40).convert('RGB'), 0.2)
+    exif = Image.Exif()
+    exif[0x0112] = 6 # Orientation: rotated, as most phone photos are
+    exif[0x010f] = 'PhoneCo'
+    gps = exif.get_ifd(0x8825)
+    gps[1] = 'N'; gps[2] = (12.0, 58.0, 17.5); gps[3] = 'E'; gps[4] = (77.0, 35.0, 40.2)
+    buf = io.BytesIO()
+    image.save(buf, 'JPEG', quality=92, exif=exif.tobytes())
+    with open(path, 'wb') as f: f.write(buf.getvalue())
+    return len(buf.getvalue())
+
+
+def run(sources, out_dir, workers, clients, queue_size, queue_wait):
+    sanitiser = image_sanitiser.ImageSanitiser(workers=workers, queue_size=queue_size, queue_wait_seconds=queue_wait)
+    sanitiser.sanitise(sources[0], os.path.join(out_dir, 'warmup.jpg'), 'JPEG') # Starts the pool outside the timing
+    latencies, busy = [], 0
+
+    def one(i):
+        started = time.perf_counter()
+        try:
+            sanitiser.sanitise(sources[i % len(sources)], os.path.join(out_dir, f'{workers}_{i}.jpg'), 'JPEG')
+        except image_sanitiser.SanitiserBusy:
+            return None
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        for seconds in pool.map(one, range(len(sources))):
+            if seconds is None: busy += 1
+            else: latencies.append(seconds)
+    elapsed = time.perf_counter() - started
+    sanitiser.shutdown()
+    latencies.sort()
+    p99 = latencies[max(0, int(len(latencies) * 0.99) - 1)] if latencies else 0
+    return len(latencies) / elapsed, statistics.median(latencies) if latencies else 0, p99, busy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--images', type=int, default=64)
+    parser.add_argument('--width', type=int, default=4032)
+    parser.add_argument('--height', type=int, default=3024)
+    parser.add_argument('--workers', default='1,2,4,8', help='Comma separated pool sizes to compare')
+    parser.add_argument('--clients', type=int, default=16, help='Concurrent uploading request threads')
+    parser.add_argument('--queue-size', type=int, default=image_sanitiser.DEFAULT_QUEUE_SIZE)
+    parser.add_argument('--queue-wait', type=float, default=30.0, help='Seconds a request waits for a queue slot')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='sanitiser-bench-')
+    try:
+        sources = []; total_bytes = 0
+        for i in range(args.images):
+            path = os.path.join(work_dir, f'src_{i}.jpg')
+            total_bytes += synthetic_photo(path, args.width, args.height, i)
+            sources.append(path)
+        out_dir = os.path.join(work_dir, 'out'); os.makedirs(out_dir)
+        print(f"{args.images} JPEGs, {args.width}x{args.height}, {total_bytes / args.images / 1e6:.1f} MB avg; "
+              f"{args.clients} clients, queue {args.queue_size}, {os.cpu_count()} CPUs")
+        print(f"{'workers':>7} {'images/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'busy':>5}")
+        for workers in [int(w) for w in args.workers.split(',') if w.strip()]:
+            rate, p50, p99, busy = run(sources, out_dir, workers, args.clients, args.queue_size, args.queue_wait)
+            print(f"{workers:>7} {rate:>9.1f} {p50 * 1000:>8.0f} {p99 * 1000:>8.0f} {busy:>5}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
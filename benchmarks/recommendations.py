@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# Build time and lookup latency of the recommendation index (recommend.py) on a synthetic catalogue.
+#
+#   python benchmarks/recommendations.py --animals 100000 --lookups 500
+#
+# Reports the full rebuild time, incremental insert time (one post_animal) and p50/p99 latency of
+# similar() and for_user(). No database needed.
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import recommend # noqa: E402
+
+TYPES = ('Dog', 'Cat', 'Rabbit', 'Bird', 'Cow', 'Goat')
+WORDS = ('friendly playful calm shy energetic vaccinated neutered spayed house trained gentle kids cats dogs '
+         'loyal curious quiet active senior puppy kitten rescued street injured recovered healthy indoor outdoor '
+         'cuddly independent smart obedient leash fetch garden apartment blind deaf tripod fluffy shorthair').split()
+
+
+def synthetic_catalogue(count, seed=7):
+    rng = random.Random(seed)
+    animals = [{
+        'animal_id': i + 1, 'type': rng.choice(TYPES), 'age': round(rng.uniform(0.1, 15), 1),
+        'description': ' '.join(rng.choices(WORDS, k=rng.randint(8, 40))),
+        'status': 'Available' if rng.random() < 0.8 else 'Adopted',
+    } for i in range(count)]
+    requests = [{'adoption_id': i + 1, 'user_id': rng.randint(1, count // 10 or 1), 'animal_id': rng.randint(1, count)}
+                for i in range(count // 2)]
+    return animals, requests
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return statistics.median(samples) * 1000, samples[int(len(samples) * 0.99) - 1] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--animals', type=int, default=100000)
+    parser.add_argument('--lookups', type=int, default=500)
+    args = parser.parse_args()
+
+    animals, requests = synthetic_catalogue(args.animals)
+    index = recommend.Recommender()
+    started = time.perf_counter()
+    index.rebuild(animals, requests)
+    build_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    index.add_animals([{'animal_id': args.animals + 1, 'type': 'Dog', 'age': 2, 'description': 'friendly playful puppy', 'status': 'Available'}])
+    insert_seconds = time.perf_counter() - started
+
+    rng = random.Random(11)
+    users = list({r['user_id'] for r in requests})
+    similar, for_user = [], []
+    for _ in range(args.lookups):
+        started = time.perf_counter(); index.similar(rng.randint(1, args.animals)); similar.append(time.perf_counter() - started)
+        started = time.perf_counter(); index.for_user(rng.choice(users)); for_user.append(time.perf_counter() - started)
+
+    print(f"{args.animals} animals, {len(requests)} adoption requests")
+    print(f"  full rebuild       {build_seconds:8.2f} s")
+    print(f"  incremental insert {insert_seconds * 1000:8.2f} ms")
+    for name, samples in (('similar()', similar), ('for_user()', for_user)):
+        p50, p99 = percentiles(samples)
+        print(f"  {name:<18} p50 {p50:6.2f} ms   p99 {p99:6.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
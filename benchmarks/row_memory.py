@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# Memory cost of rendering a large adoption listing with DictCursor-style dict rows (plus the
+# eagerly added image_url key, as the listing used to do) versus the slot rows in rows.py.
+#
+#   python benchmarks/row_memory.py --animals 10000
+#
+# Each mode runs in a fresh process under tracemalloc. Reported per mode:
+#   rows    - memory held by the row objects once built, and the number of live allocated blocks
+#   render  - peak traced memory while building the rows and rendering every card
+# No database is needed: rows are built from synthetic tuples shaped like the listing query.
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r"""
+import datetime, json, sys, time, tracemalloc
+sys.path.insert(0, {root!r})
+import app as app_module
+import rows
+import storage
+from flask import url_for
+
+COLUMNS = ['animal_id', 'name', 'type', 'age', 'description', 'image_filename', 'status', 'date_posted']
+posted = datetime.datetime(2024, 1, 1)
+tuples = [(i, f'Animal {{i}}', ('Dog', 'Cat', 'Rabbit')[i % 3], i % 15, 'Friendly and healthy. ' * 8,
+           f'uploads/animals/{{i % 256:02x}}/{{i % 251:02x}}/{{i}}_photo.jpg' if i % 4 else None, 'Available',
+           posted - datetime.timedelta(minutes=i)) for i in range({count})]
+
+application = app_module.create_app({{'WARM_TEMPLATES': False}})
+page = application.jinja_env.from_string(
+    "{{% for animal in animals %}}{{% set lazy_image = loop.index > 4 %}}{{% include '_animal_card.html' %}}{{% endfor %}}")
+
+def build_dicts():
+    animals = [dict(zip(COLUMNS, t)) for t in tuples]
+    for animal in animals:
+        animal['image_url'] = None
+        if animal.get('image_filename'):
+            animal['image_url'] = url_for('static', filename=storage.static_path(animal['image_filename'], 'animals'))
+    return animals
+
+def build_slots():
+    return [rows.AnimalRow.from_values(COLUMNS, t) for t in tuples]
+
+build = build_dicts if {mode!r} == 'dict' else build_slots
+with application.test_request_context('/adoption'):
+    page.render(animals=build()[:10]) # Compile the template outside the measurement
+    tracemalloc.start()
+    base_size, _ = tracemalloc.get_traced_memory()
+    base_blocks = sum(s.count for s in tracemalloc.take_snapshot().statistics('filename'))
+    animals = build()
+    rows_size, _ = tracemalloc.get_traced_memory()
+    rows_blocks = sum(s.count for s in tracemalloc.take_snapshot().statistics('filename'))
+    tracemalloc.reset_peak()
+    started = time.perf_counter()
+    html = page.render(animals=animals)
+    render_seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+print(json.dumps({{'rows_bytes': rows_size - base_size, 'rows_blocks': rows_blocks - base_blocks,
+                  'peak_bytes': peak - base_size, 'render_seconds': render_seconds, 'html_bytes': len(html)}}))
+"""
+
+
+def run(mode, count):
+    code = PROBE.format(root=ROOT, mode=mode, count=count)
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True, cwd=ROOT)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--animals', type=int, default=10000)
+    args = parser.parse_args()
+
+    results = {mode: run(mode, args.animals) for mode in ('dict', 'slots')}
+    print(f"Rendering {args.animals} adoption cards")
+    print(f"  {'':<8}{'rows MB':>10}{'blocks':>10}{'peak MB':>10}{'render ms':>11}")
+    for mode, r in results.items():
+        print(f"  {mode:<8}{r['rows_bytes'] / 1e6:>10.2f}{r['rows_blocks']:>10}{r['peak_bytes'] / 1e6:>10.2f}{r['render_seconds'] * 1000:>11.0f}")
+    if results['dict']['html_bytes'] != results['slots']['html_bytes']:
+        print("WARNING: rendered output differs between modes")
+
+
+if __name__ == '__main__':
+    main()
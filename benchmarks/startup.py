@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# Cold-start benchmark: import time, create_app() time and first/second request latency, each
+# measured in a fresh interpreter (what a new gunicorn worker pays).
+#
+#   python benchmarks/startup.py --runs 10
+#   python benchmarks/startup.py --runs 10 --no-warm --path /adoption
+#
+# Pages that query MySQL need a reachable database; the default path ('/') does not.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r"""
+import json, sys, time
+sys.path.insert(0, {root!r})
+t0 = time.perf_counter()
+import app as app_module
+t1 = time.perf_counter()
+application = app_module.create_app({{'WARM_TEMPLATES': {warm!r}}})
+t2 = time.perf_counter()
+client = application.test_client()
+status = client.get({path!r}).status_code
+t3 = time.perf_counter()
+client.get({path!r})
+t4 = time.perf_counter()
+print(json.dumps({{'import': t1 - t0, 'create_app': t2 - t1, 'first_request': t3 - t2, 'second_request': t4 - t3, 'status': status}}))
+"""
+
+
+def run_once(path, warm):
+    code = PROBE.format(root=ROOT, path=path, warm=warm)
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True, cwd=ROOT)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--path', default='/')
+    parser.add_argument('--no-warm', action='store_true', help='Skip template warm-up in create_app()')
+    args = parser.parse_args()
+
+    samples = [run_once(args.path, not args.no_warm) for _ in range(args.runs)]
+    print(f"{args.runs} fresh processes, GET {args.path} (HTTP {samples[0]['status']}), template warm-up {'off' if args.no_warm else 'on'}")
+    for key in ('import', 'create_app', 'first_request', 'second_request'):
+        values = [s[key] * 1000 for s in samples]
+        print(f"  {key:<15} median {statistics.median(values):8.2f} ms   min {min(values):8.2f} ms   max {max(values):8.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
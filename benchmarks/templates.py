@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# First-render latency of the heaviest templates in a fresh process, with and without the shared
+# Jinja bytecode cache (JINJA_BYTECODE_CACHE).
+#
+#   python benchmarks/templates.py --runs 5
+#
+# "cold" = no bytecode cache (parse + compile on first render, what every new worker paid before),
+# "cached" = bytecode cache already populated (e.g. by `flask precompile-templates`).
+# Template warm-up in create_app() is switched off so the first render is what gets measured.
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATES = ('adoption.html', 'foster.html', 'dashboard.html', 'volunteer.html', 'donate.html')
+
+PROBE = r"""
+import json, sys, time
+sys.path.insert(0, {root!r})
+import app as app_module
+from flask import render_template
+application = app_module.create_app({{'WARM_TEMPLATES': False, 'JINJA_BYTECODE_CACHE': {cache_dir!r}}})
+timings = {{}}
+with application.test_request_context('/'):
+    for name in {templates!r}:
+        started = time.perf_counter()
+        render_template(name, animals=[], form_data={{}}, animals_posted=[], adoption_requests=[], donation_history=[])
+        timings[name] = time.perf_counter() - started
+print(json.dumps(timings))
+"""
+
+
+def run_once(cache_dir):
+    code = PROBE.format(root=ROOT, cache_dir=cache_dir, templates=TEMPLATES)
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True, cwd=ROOT)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    cache_dir = tempfile.mkdtemp(prefix='jinja_bench_')
+    try:
+        cold = [run_once('') for _ in range(args.runs)]
+        run_once(cache_dir) # Populate the cache once, like the deploy-time precompile step
+        cached = [run_once(cache_dir) for _ in range(args.runs)]
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    print(f"First render in a fresh process, median of {args.runs} runs (ms)")
+    print(f"  {'template':<18}{'cold':>10}{'cached':>10}")
+    for name in TEMPLATES:
+        c = statistics.median(r[name] for r in cold) * 1000
+        w = statistics.median(r[name] for r in cached) * 1000
+        print(f"  {name:<18}{c:>10.2f}{w:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
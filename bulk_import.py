@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+# Bulk animal import for shelters onboarding a large catalogue in one go.
+#
+# Input is a manifest (CSV with a header row, or NDJSON with one object per line) using the
+# columns name, type, age, description and (optional) image. 'image' is a path relative to the
+# images source, which can be a directory or a .zip archive.
+#
+# Rows are validated with the same rules as post_animal() (helpers.validate_animal_fields),
+# images are copied (and sanitised, and charged to the user's upload quota) in parallel, and rows
+# are inserted with executemany() in batched transactions. After every committed batch a small
+# JSON progress file is rewritten, so an interrupted import picks up from the first row of the
+# batch that did not commit.
+#
+# Imports over HTTP run as a background job (start_job) in the worker that received the upload;
+# the client polls job_status() for progress. A flock on the job's folder keeps a second upload of
+# the same manifest from starting a parallel run.
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import csv
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import traceback
+import zipfile
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+from werkzeug.utils import secure_filename
+
+from helpers import ensure_dir, allowed_file, validate_animal_fields, IMAGE_EXTENSIONS
+import storage
+
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_WORKERS = 8
+DEFAULT_SANITISER_WAIT_SECONDS = 120 # Per row: how long a busy image sanitiser may hold up an import
+MAX_STATUS_ERRORS = 100 # Row errors returned by job_status(); the full list stays in the errors file
+INSERT_SQL = "INSERT INTO animals (user_id, name, type, age, description, image_filename, status) VALUES (%s, %s, %s, %s, %s, %s, %s)"
+
+
+def manifest_fingerprint(manifest_path):
+    # Identifies "the same import" across restarts so progress is only reused for the same file
+    digest = hashlib.sha256()
+    with open(manifest_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def iter_manifest(manifest_path):
+    # Yields (row_number, row_dict_or_None, parse_error_or_None). Row numbers are 1-based data rows.
+    if manifest_path.lower().endswith(('.ndjson', '.jsonl', '.json')):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            row_no = 0
+            for line in f:
+                if not line.strip(): continue
+                row_no += 1
+                try:
+                    row = json.loads(line)
+                    if not isinstance(row, dict): raise ValueError("line is not a JSON object")
+                    yield row_no, row, None
+                except ValueError as e:
+                    yield row_no, None, f"Invalid JSON: {e}"
+    else:
+        with open(manifest_path, 'r', encoding='utf-8-sig', newline='') as f:
+            for row_no, row in enumerate(csv.DictReader(f), start=1):
+                # Normalise header case/whitespace so 'Name ' and 'name' both work
+                yield row_no, {(k or '').strip().lower(): (v.strip() if isinstance(v, str) else v) for k, v in row.items()}, None
+
+
+class ImageSource:
+    # Read-only access to the images that come with a manifest (directory or zip archive).
+    # ZipFile objects are not safe to share between threads, so each worker thread opens its own.
+    def __init__(self, path):
+        self.path = path
+        self.is_zip = bool(path) and os.path.isfile(path) and zipfile.is_zipfile(path)
+        self._local = threading.local()
+        if path and not self.is_zip and not os.path.isdir(path):
+            raise ValueError(f"Images source '{path}' is neither a directory nor a zip archive.")
+
+    def _zip(self):
+        zf = getattr(self._local, 'zf', None)
+        if zf is None:
+            zf = self._local.zf = zipfile.ZipFile(self.path)
+        return zf
+
+    def copy_to(self, name, dest_path):
+        name = name.replace("\\", "/").lstrip('/')
+        if self.is_zip:
+            try:
+                with self._zip().open(name) as src, open(dest_path, 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+            except KeyError:
+                raise FileNotFoundError(f"'{name}' not found in archive")
+            return
+        root = os.path.realpath(self.path)
+        src_path = os.path.realpath(os.path.join(root, name))
+        if os.path.commonpath([root, src_path]) != root: # Refuse ../ escapes out of the images dir
+            raise FileNotFoundError(f"'{name}' is outside the images directory")
+        shutil.copyfile(src_path, dest_path)
+
+
+def load_progress(progress_path, fingerprint):
+    if not progress_path or not os.path.exists(progress_path): return None
+    try:
+        with open(progress_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"WARNING: Ignoring unreadable import progress file {progress_path}: {e}")
+        return None
+    if state.get('fingerprint') != fingerprint:
+        print(f"WARNING: Progress file {progress_path} belongs to a different manifest, starting over.")
+        return None
+    return state
+
+def save_progress(progress_path, state):
+    if not progress_path: return
+    tmp_path = progress_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, progress_path) # Atomic, so a crash never leaves a half-written file
+
+def append_errors(progress_path, errors):
+    if not progress_path or not errors: return
+    with open(progress_path + '.errors.ndjson', 'a', encoding='utf-8') as f:
+        for err in errors: f.write(json.dumps(err) + "\n")
+
+
+def _prepare_row(row_no, row, parse_error):
+    # Returns (values_dict, error_message). Accepts both manifest column names and the post form names.
+    if parse_error: return None, parse_error
+    name = row.get('name') or row.get('animalName')
+    animal_type = row.get('type') or row.get('animalType')
+    age_str = row.get('age', row.get('animalAge'))
+    description = row.get('description') or row.get('animalDescription')
+    image = row.get('image') or row.get('image_filename') or None
+    errors, age = validate_animal_fields(name, animal_type, None if age_str is None else str(age_str), description)
+    if image and not allowed_file(os.path.basename(str(image)), IMAGE_EXTENSIONS):
+        errors.append('Invalid image file type (PNG, JPG, GIF allowed).')
+    if errors: return None, " ".join(errors)
+    return {'row': row_no, 'name': name, 'type': animal_type, 'age': age, 'description': description, 'image': image}, None
+
+
+def _save_image(images, item, user_id, upload_folder, timestamp, sanitise=None):
+    # Runs on a worker thread. Returns (item, rel_path, full_path, error). sanitise(src_path, dest_path)
+    # writes the checked, re-encoded copy (ImageSanitiser.save_file); it raises ValueError for a bad image.
+    base_filename = secure_filename(os.path.basename(str(item['image']).replace("\\", "/")))
+    # Row number keeps names unique even when two rows share an image name within one batch
+    image_filename = f"animal_{user_id}_{timestamp}_{item['row']}_{base_filename}"
+    image_dir, image_path_full, image_filename_rel = storage.sharded_upload_paths(upload_folder, 'animals', image_filename)
+    raw_path = f"{image_path_full}.upload" if sanitise else image_path_full
+    error = None
+    try:
+        if not ensure_dir(image_dir): raise OSError("Could not create upload directory.")
+        images.copy_to(item['image'], raw_path)
+        if sanitise: sanitise(raw_path, image_path_full)
+    except FileNotFoundError:
+        error = f"Image '{item['image']}' not found."
+    except ValueError as e: # Rejected by the sanitiser
+        error = f"Image '{item['image']}' rejected: {e}"
+    except Exception as e:
+        error = f"Image upload failed: {e}"
+    finally:
+        leftovers = [raw_path] if raw_path != image_path_full else [] # The unsanitised copy
+        if error: leftovers.append(image_path_full)
+        for path in leftovers:
+            if os.path.exists(path):
+                try: os.remove(path)
+                except OSError: pass
+    if error: return item, None, None, error
+    return item, image_filename_rel, image_path_full, None
+
+
+def _within_quota(connection, ready, user_id, quota_bytes):
+    # Splits a batch into rows whose images fit in the user's upload quota and errors for the rest,
+    # charging the stored (sanitised) sizes just like record_upload() will. Rejected images are removed.
+    if not quota_bytes or not any(full for _, _, full in ready): return ready, []
+    cur = connection.cursor()
+    try: used, _ = storage.user_usage(cur, user_id)
+    finally: cur.close()
+    kept, errors = [], []
+    for item, rel, full in ready:
+        size = storage.stored_size(full) if full else 0
+        if used + size > quota_bytes:
+            errors.append({'row': item['row'], 'message': 'Upload storage limit reached; image not stored.'})
+            try: os.remove(full)
+            except OSError: pass
+            continue
+        used += size
+        kept.append((item, rel, full))
+    return kept, errors
+
+
+def _index_batch_images(cur, ready, user_id):
+    # executemany() may split into several statements, so lastrowid can't be trusted for every row.
+    # Image names are unique, so look the new ids up by name inside the same transaction instead.
+    with_images = {rel: full for _, rel, full in ready if rel}
+    if not with_images: return
+    placeholders = ", ".join(["%s"] * len(with_images))
+    cur.execute(f"SELECT animal_id, image_filename FROM animals WHERE image_filename IN ({placeholders})", tuple(with_images))
+    for row in cur.fetchall():
+        storage.record_upload(cur, row['image_filename'], with_images[row['image_filename']], 'animals', user_id, row['animal_id'])
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch; batch = []
+    if batch: yield batch
+
+
+def run_import(connection, manifest_path, user_id, upload_folder, images_path=None,
+               batch_size=DEFAULT_BATCH_SIZE, workers=DEFAULT_WORKERS, progress_path=None,
+               sanitise=None, quota_bytes=0):
+    # Imports the manifest and returns a summary dict:
+    #   {'imported', 'failed', 'skipped', 'errors': [{'row', 'message'}], 'next_row', 'completed', 'message'}
+    # 'errors' only lists rows that failed in this run; earlier runs are in <progress_path>.errors.ndjson
+    fingerprint = manifest_fingerprint(manifest_path)
+    state = load_progress(progress_path, fingerprint) or {
+        'fingerprint': fingerprint, 'next_row': 1, 'imported': 0, 'failed': 0, 'completed': False
+    }
+    summary = {'imported': 0, 'failed': 0, 'skipped': state['next_row'] - 1, 'errors': [],
+               'next_row': state['next_row'], 'completed': state.get('completed', False), 'message': ''}
+    if state.get('completed'):
+        summary['message'] = 'This manifest has already been imported.'
+        return summary
+
+    if not ensure_dir(upload_folder):
+        raise OSError("Could not create upload directory.")
+    images = ImageSource(images_path) if images_path else None
+    start_row = state['next_row']
+    pending = (r for r in iter_manifest(manifest_path) if r[0] >= start_row)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for batch in _batches(pending, max(1, batch_size)):
+            batch_errors = []
+            ready = [] # (item, image_rel, image_full)
+            to_copy = []
+            for row_no, row, parse_error in batch:
+                item, error = _prepare_row(row_no, row, parse_error)
+                if error: batch_errors.append({'row': row_no, 'message': error})
+                elif item['image'] and images is None: batch_errors.append({'row': row_no, 'message': 'Row names an image but no images source was given.'})
+                elif item['image']: to_copy.append(item)
+                else: ready.append((item, None, None))
+
+            timestamp = datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S%f')
+            for item, rel, full, error in pool.map(lambda it: _save_image(images, it, user_id, upload_folder, timestamp, sanitise), to_copy):
+                if error: batch_errors.append({'row': item['row'], 'message': error})
+                else: ready.append((item, rel, full))
+            ready.sort(key=lambda r: r[0]['row']) # Keep insert order == manifest order
+            ready, quota_errors = _within_quota(connection, ready, user_id, quota_bytes)
+            batch_errors.extend(quota_errors)
+
+            cur = None
+            try:
+                if ready:
+                    cur = connection.cursor()
+                    values = [(user_id, it['name'], it['type'], it['age'], it['description'], rel, 'Available') for it, rel, _ in ready]
+                    cur.executemany(INSERT_SQL, values)
+                    _index_batch_images(cur, ready, user_id)
+                connection.commit()
+            except Exception as e:
+                connection.rollback()
+                print(f"!!! DB Error (Bulk Import batch starting row {batch[0][0]}): {e}"); traceback.print_exc()
+                # Nothing from this batch committed: remove its images and stop, so a resume retries the whole batch
+                for _, _, full in ready:
+                    if full and os.path.exists(full):
+                        try: os.remove(full)
+                        except OSError as re: print(f"Error cleaning bulk import image {full}: {re}")
+                summary['message'] = f"Database error at rows {batch[0][0]}-{batch[-1][0]}; import stopped and can be resumed."
+                summary['next_row'] = state['next_row']
+                return summary
+            finally:
+                if cur: cur.close()
+
+            batch_errors.sort(key=lambda e: e['row'])
+            state['next_row'] = batch[-1][0] + 1
+            state['imported'] += len(ready); state['failed'] += len(batch_errors)
+            summary['imported'] += len(ready); summary['failed'] += len(batch_errors)
+            summary['errors'].extend(batch_errors)
+            append_errors(progress_path, batch_errors)
+            save_progress(progress_path, state)
+            print(f"DEBUG: Bulk import committed rows up to {batch[-1][0]} ({state['imported']} imported, {state['failed']} failed so far)")
+
+    state['completed'] = True
+    save_progress(progress_path, state)
+    summary['next_row'] = state['next_row']; summary['completed'] = True
+    summary['message'] = f"Imported {summary['imported']} animals ({summary['failed']} rows failed)."
+    return summary
+
+
+# --- Background jobs (imports started over HTTP) ---
+def _read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f: return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_status(job_dir, status):
+    save_progress(os.path.join(job_dir, 'job.json'), status)
+
+def lock_job(job_dir):
+    # Takes the job's lock before its files are (re)written. Returns the open lock file, False if
+    # another run holds it, or None where flock is unavailable. Pass the result to start_job().
+    if fcntl is None: return None
+    lock_file = open(os.path.join(job_dir, 'job.lock'), 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close(); return False
+    return lock_file
+
+
+def start_job(job_dir, lock_file, run):
+    # Runs run() -> run_import() summary on a background thread, which releases lock_file when done.
+    # The lock is a flock, so a worker that dies mid-import releases it too and the next upload of
+    # the manifest resumes the job.
+    _write_status(job_dir, {'state': 'running', 'started_at': time.time()})
+
+    def work():
+        status = {'state': 'failed', 'message': 'Import failed due to a server error. Upload the same manifest again to resume.'}
+        try:
+            summary = run()
+            status = {'state': 'completed' if summary['completed'] else 'stopped', 'message': summary['message']}
+        except Exception as e:
+            print(f"!!! Error (Bulk Import job {job_dir}): {e}"); traceback.print_exc()
+        finally:
+            status['finished_at'] = time.time()
+            try: _write_status(job_dir, status)
+            except OSError as e: print(f"WARNING: Could not save import status for {job_dir}: {e}")
+            if lock_file: lock_file.close() # Releases the flock
+    threading.Thread(target=work, name='bulk-import', daemon=True).start()
+
+
+def job_status(job_dir):
+    # Progress of a background import: state ('running', 'completed', 'stopped', 'failed', or
+    # 'interrupted' when the worker running it died), counts so far and the first row errors.
+    status = _read_json(os.path.join(job_dir, 'job.json'))
+    if status is None: return None
+    if status['state'] == 'running' and fcntl is not None:
+        lock_file = lock_job(job_dir)
+        if lock_file: # Nobody holds the lock any more
+            lock_file.close()
+            status = dict(status, state='interrupted', message='The import was interrupted. Upload the same manifest again to resume.')
+    progress = _read_json(os.path.join(job_dir, 'progress.json')) or {}
+    status.update(imported=progress.get('imported', 0), failed=progress.get('failed', 0), next_row=progress.get('next_row', 1))
+    errors = []
+    try:
+        with open(os.path.join(job_dir, 'progress.json.errors.ndjson'), 'r', encoding='utf-8') as f:
+            for line in f:
+                if len(errors) == MAX_STATUS_ERRORS: break
+                errors.append(json.loads(line))
+    except (OSError, ValueError):
+        pass
+    status['errors'] = errors
+    return status
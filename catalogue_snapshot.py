@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+# A local, read-only snapshot of the public adoption catalogue, served while MySQL is unreachable.
+#
+# The snapshot is one compact file in the instance folder, rewritten every CATALOGUE_SNAPSHOT_SECONDS
+# by whichever worker notices it is stale (a flock makes the others skip) or by
+# `flask snapshot-catalogue`:
+#
+#   header | index: one fixed 36-byte record per animal, in listing order | data: per-animal JSON
+#
+# Readers memory-map the file and view the index as a numpy array, so opening it costs nothing
+# and a page decodes only the records it shows. Keyset cursors are the same as the live listing's
+# (date_posted, animal_id), so infinite scroll continues across a switch to or from the snapshot.
+# A new snapshot is written to a temporary file and renamed over the old one; readers pick it up
+# on their next access and finish any page in progress from the old mapping.
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import rows
+from helpers import decode_cursor, encode_cursor
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+
+MAGIC = b'ACHCAT01'
+HEADER = struct.Struct('<8sQd') # magic, animal count, created at (epoch seconds)
+INDEX_DTYPE = np.dtype([('animal_id', '<i8'), ('posted_us', '<i8'), ('age', '<f8'), ('offset', '<u8'), ('length', '<u4')])
+EPOCH = datetime(1970, 1, 1) # date_posted is a naive DATETIME; stored as exact microseconds from this
+COLUMNS = ('animal_id', 'name', 'type', 'age', 'description', 'image_filename', 'status', 'date_posted')
+SNAPSHOT_SQL = ("SELECT animal_id, name, type, age, description, image_filename, date_posted FROM animals "
+                "WHERE status = 'Available' ORDER BY date_posted DESC, animal_id DESC")
+DEFAULT_REFRESH_SECONDS = 300
+
+
+def _posted_us(value):
+    if isinstance(value, str): value = datetime.fromisoformat(value)
+    return (value.replace(tzinfo=None) - EPOCH) // timedelta(microseconds=1)
+
+
+def write_snapshot(path, animals, now=None):
+    # animals: (animal_id, name, type, age, description, image_filename, date_posted) tuples in listing
+    # order. Returns the number written.
+    index = []; blobs = []; offset = 0
+    for animal_id, name, type_, age, description, image_filename, date_posted in animals:
+        blob = json.dumps([name, type_, description, image_filename], separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        index.append((animal_id, _posted_us(date_posted), float(age) if age is not None else np.nan, offset, len(blob)))
+        blobs.append(blob); offset += len(blob)
+    directory = os.path.dirname(path)
+    if directory: os.makedirs(directory, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(index), now or time.time()))
+        f.write(np.array(index, dtype=INDEX_DTYPE).tobytes())
+        for blob in blobs: f.write(blob)
+    os.replace(tmp, path)
+    return len(index)
+
+
+class _Mapping:
+    # One opened snapshot file
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, self.created_at = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC: raise ValueError(f"{path} is not a catalogue snapshot")
+        self.identity = (stat.st_ino, stat.st_mtime_ns)
+        self.index = np.frombuffer(self.mm, dtype=INDEX_DTYPE, count=count, offset=HEADER.size)
+        self.data_start = HEADER.size + count * INDEX_DTYPE.itemsize
+        self.neg_posted = -self.index['posted_us'] # Ascending, for searchsorted
+        self._positions = None
+
+    def row(self, pos):
+        record = self.index[pos]
+        start = self.data_start + int(record['offset'])
+        name, type_, description, image_filename = json.loads(self.mm[start:start + int(record['length'])])
+        age = float(record['age'])
+        return rows.AnimalRow.from_values(COLUMNS, (
+            int(record['animal_id']), name, type_, None if age != age else age, description, image_filename,
+            'Available', EPOCH + timedelta(microseconds=int(record['posted_us']))))
+
+    def position_of(self, animal_id):
+        if self._positions is None: # Built on first lookup by id only
+            self._positions = {int(a): pos for pos, a in enumerate(self.index['animal_id'])}
+        return self._positions.get(animal_id)
+
+
+class CatalogueSnapshot:
+    def __init__(self, path, refresh_seconds=DEFAULT_REFRESH_SECONDS):
+        self.path = path
+        self.refresh_seconds = refresh_seconds
+        self._mapping = None
+        self._building = False
+        self._attempted_at = 0.0
+        self._lock = threading.Lock()
+
+    # --- Reading ---
+    def current(self):
+        # The latest snapshot on disk, remapped if it was replaced since the last call. None if missing/unreadable.
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        mapping = self._mapping
+        if mapping is None or mapping.identity != (stat.st_ino, stat.st_mtime_ns):
+            try:
+                mapping = _Mapping(self.path)
+            except (OSError, ValueError, struct.error) as e:
+                print(f"WARNING: Catalogue snapshot unreadable: {e}")
+                return None
+            self._mapping = mapping # The previous mapping is unmapped once no page is using it
+        return mapping
+
+    def page(self, mapping, cursor=None, limit=12):
+        # Same contract as the live listing: (animals, next_cursor)
+        start = 0
+        after = decode_cursor(cursor)
+        if after and len(after) == 2:
+            posted, animal_id = _posted_us(after[0]), int(after[1])
+            start = int(np.searchsorted(mapping.neg_posted, -posted, side='left'))
+            while start < len(mapping.index) and mapping.index[start]['posted_us'] == posted and mapping.index[start]['animal_id'] >= animal_id:
+                start += 1
+        animals = [mapping.row(pos) for pos in range(start, min(start + limit, len(mapping.index)))]
+        next_cursor = None
+        if animals and start + limit < len(mapping.index):
+            next_cursor = encode_cursor(animals[-1].date_posted, animals[-1].animal_id)
+        return animals, next_cursor
+
+    def get_many(self, mapping, animal_ids):
+        # Rows for the ids still in the snapshot, in the given order
+        found = (mapping.position_of(animal_id) for animal_id in animal_ids)
+        return [mapping.row(pos) for pos in found if pos is not None]
+
+    # --- Writing ---
+    def needs_refresh(self, now=None):
+        # Stale (or missing) and not already attempted within the last refresh interval
+        now = now or time.time()
+        if self._building or now - self._attempted_at < self.refresh_seconds: return False
+        try:
+            return now - os.path.getmtime(self.path) > self.refresh_seconds
+        except OSError:
+            return True
+
+    def refresh(self, connect):
+        # Rewrites the snapshot from the DB unless another process is already doing so. connect is a
+        # callable returning a new DB connection, only called once the lock is held. Returns the number
+        # of animals written, or None if skipped.
+        lock_file = None
+        try:
+            if fcntl:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                lock_file = open(self.path + '.lock', 'w')
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return None
+            connection = connect()
+            try:
+                cur = rows.tuple_cursor(connection)
+                cur.execute(SNAPSHOT_SQL)
+                return write_snapshot(self.path, cur.fetchall())
+            finally:
+                connection.close()
+        finally:
+            if lock_file: lock_file.close() # Releases the flock
+
+    def refresh_in_background(self, connect):
+        # Request threads' connections can't be shared, so the thread opens its own through connect
+        with self._lock:
+            if self._building: return
+            self._building = True; self._attempted_at = time.time()
+        def run():
+            try:
+                self.refresh(connect)
+            except Exception as e:
+                print(f"WARNING: Catalogue snapshot refresh failed: {e}")
+            finally:
+                self._building = False
+        threading.Thread(target=run, name='catalogue-snapshot', daemon=True).start()
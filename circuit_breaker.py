@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# A per-worker circuit breaker for database reads that have an offline fallback.
+#
+# After `failure_threshold` consecutive failures (errors, or queries slower than `slow_seconds`)
+# the breaker opens: allow() returns False and callers serve their fallback straight away instead
+# of every request waiting out a connect timeout. While open, a background thread calls `probe`
+# every `probe_seconds`; the first probe that succeeds closes the breaker again. Request threads
+# never probe, so recovery checks cost users nothing.
+import os
+import threading
+import time
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=3, probe_seconds=5, slow_seconds=2.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.probe_seconds = probe_seconds
+        self.slow_seconds = slow_seconds
+        self.probe = None # Callable that raises unless the backend is usable again, set by the app
+        self._failures = 0
+        self._opened_at = None
+        self._prober_pid = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        if self._opened_at is None: return True
+        if self._prober_pid != os.getpid(): # Opened before a fork: this worker needs its own prober
+            with self._lock:
+                # Re-checked under the lock: concurrent requests must start one prober, not one each,
+                # and there is none to start if a probe closed the breaker meanwhile
+                if self._opened_at is not None and self._prober_pid != os.getpid(): self._start_prober()
+        return False
+
+    def record_success(self, seconds=0.0):
+        if self.slow_seconds and seconds >= self.slow_seconds:
+            self.record_failure(); return
+        self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._opened_at is None and self._failures >= self.failure_threshold:
+                self._opened_at = time.time()
+                print(f"WARNING: {self.name} circuit open after {self._failures} failures; serving fallback until the database recovers.")
+                self._start_prober()
+
+    def _start_prober(self):
+        # Called with the lock held
+        self._prober_pid = os.getpid()
+        threading.Thread(target=self._probe_loop, name=f'{self.name}-probe', daemon=True).start()
+
+    def _probe_loop(self):
+        while self._opened_at is not None:
+            time.sleep(self.probe_seconds)
+            started = time.perf_counter()
+            try:
+                if self.probe: self.probe()
+            except Exception:
+                continue
+            if self.slow_seconds and time.perf_counter() - started >= self.slow_seconds: continue # Up, but still too slow
+            with self._lock:
+                print(f"{self.name} circuit closed: database reachable again after {time.time() - self._opened_at:.0f}s.")
+                self._opened_at = None; self._failures = 0
+            return
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def status(self):
+        return {'name': self.name, 'open': self.is_open, 'opened_at': self._opened_at, 'consecutive_failures': self._failures}
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# Paginated queries behind the dashboard sections (animals posted, adoption requests, donations).
+#
+# Every section is read newest first with keyset pagination on (date, id): a page is one index
+# range scan from the previous page's last row, so page 50 of a long donation history costs the
+# same as page 1. The composite indexes in DASHBOARD_INDEX_DDL (flask init-dashboard-indexes)
+# make those scans cover the user filter and the ordering.
+import rows
+from helpers import decode_cursor, encode_cursor
+
+
+DEFAULT_PAGE_SIZE = 20
+
+DASHBOARD_INDEX_DDL = (
+    "ALTER TABLE animals ADD INDEX idx_animals_user_posted (user_id, date_posted, animal_id)",
+    "ALTER TABLE adoptions ADD INDEX idx_adoptions_user_date (user_id, adoption_date, adoption_id)",
+    "ALTER TABLE donations ADD INDEX idx_donations_user_date (user_id, donation_date, donation_id)",
+)
+
+# section -> (row class, select list, table, date column, id column)
+SECTIONS = {
+    'animals': (rows.AnimalRow, "animal_id, name, type, status, date_posted, image_filename", 'animals', 'date_posted', 'animal_id'),
+    'adoptions': (rows.AdoptionRow, "adoption_id, animal_name, status, adoption_date", 'adoptions', 'adoption_date', 'adoption_id'),
+    'donations': (rows.DonationRow, "donation_id, donation_type, amount, product_details, donation_date, status", 'donations', 'donation_date', 'donation_id'),
+}
+
+
+def fetch_section(connection, section, user_id, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    # Returns (rows, next_cursor) for one page of a section; next_cursor is None on the last page.
+    # Raises KeyError for an unknown section and lets DB errors propagate.
+    row_class, columns, table, date_column, id_column = SECTIONS[section]
+    after = decode_cursor(cursor)
+    sql = f"SELECT {columns} FROM {table} WHERE user_id = %s"
+    params = [user_id]
+    if after and len(after) == 2:
+        sql += f" AND ({date_column} < %s OR ({date_column} = %s AND {id_column} < %s))"
+        params += [after[0], after[0], after[1]]
+    sql += f" ORDER BY {date_column} DESC, {id_column} DESC LIMIT %s"
+    params.append(limit + 1) # One extra row tells us whether another page exists
+    cur = rows.tuple_cursor(connection)
+    try:
+        cur.execute(sql, tuple(params))
+        page = row_class.fetch_all(cur)
+    finally:
+        cur.close()
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_cursor(page[-1][date_column], page[-1][id_column])
+    if section == 'animals':
+        attach_pending_requests(connection, page)
+    return page, next_cursor
+
+
+def attach_pending_requests(connection, animals):
+    # Pending adoption requests for a page of Available animals, in one query for the whole page
+    by_id = {}
+    for animal in animals:
+        animal.pending_requests = []
+        if animal.status == 'Available': by_id[animal.animal_id] = animal
+    if not by_id: return
+    placeholders = ', '.join(['%s'] * len(by_id))
+    cur = rows.tuple_cursor(connection)
+    try:
+        cur.execute("SELECT adoption_id, animal_id, adopter_name, adopter_email, adoption_date, status FROM adoptions "
+                    f"WHERE animal_id IN ({placeholders}) AND status = %s ORDER BY adoption_date ASC, adoption_id ASC",
+                    (*by_id, 'Pending'))
+        for request_row in rows.AdoptionRow.fetch_all(cur):
+            by_id[request_row.animal_id].pending_requests.append(request_row)
+    finally:
+        cur.close()
+
+
+def ensure_dashboard_indexes(connection):
+    cur = connection.cursor()
+    try:
+        for statement in DASHBOARD_INDEX_DDL:
+            try:
+                cur.execute(statement)
+            except Exception as e:
+                if getattr(e, 'args', (None,))[0] != 1061: raise # 1061 duplicate key name: already added
+        connection.commit()
+    finally:
+        cur.close()
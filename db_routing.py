@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+# Read/write splitting: reads from the read-heavy routes go to MySQL replicas, writes stay on the
+# primary (the existing flask_mysqldb `mysql` extension).
+#
+# * Read-your-writes: after a user's own write (post_animal, submit_adoption, ...) the route calls
+#   mark_write(), which pins that user's reads to the primary for READ_STICKY_SECONDS.
+# * Lag aware: each worker checks a replica's Seconds_Behind_Source at most every
+#   REPLICA_LAG_CHECK_SECONDS and skips replicas lagging more than REPLICA_MAX_LAG_SECONDS.
+# * Failover: a replica that refuses connections is skipped for REPLICA_RETRY_SECONDS; when no
+#   replica is usable, reads fall back to the primary.
+#
+# MYSQL_REPLICAS is a comma separated list of host[:port], e.g. "127.0.0.1:3307,127.0.0.1:3308".
+# Replicas use the same MYSQL_USER / MYSQL_PASSWORD / MYSQL_DB as the primary.
+import itertools
+import time
+
+import MySQLdb
+from MySQLdb import cursors
+from flask import g, session
+
+
+# Errors meaning the server is unreachable/restarting rather than a bad query
+UNAVAILABLE_ERRORS = (MySQLdb.OperationalError, MySQLdb.InterfaceError)
+
+def parse_replicas(value):
+    replicas = []
+    for item in (value or '').split(','):
+        item = item.strip()
+        if not item: continue
+        host, _, port = item.partition(':')
+        replicas.append((host, int(port) if port else 3306))
+    return replicas
+
+
+class ReplicaRouter:
+    def __init__(self, primary, app=None):
+        self.primary = primary
+        self.replicas = []
+        self._health = {} # (host, port) -> {'down_until', 'lag', 'checked_at'}
+        self._rr = itertools.count()
+        self.on_connect = None # Optional callable applied to every connection this router opens (query profiler)
+        self.app = None
+        if app is not None: self.init_app(app)
+
+    def init_app(self, app):
+        # Re-reads the config when called again; the teardown hook is only registered once
+        if self.app is not app: app.teardown_appcontext(self._teardown)
+        self.app = app
+        self.replicas = parse_replicas(app.config.get('MYSQL_REPLICAS'))
+        app.config.setdefault('READ_STICKY_SECONDS', 10)
+        app.config.setdefault('REPLICA_MAX_LAG_SECONDS', 5)
+        app.config.setdefault('REPLICA_LAG_CHECK_SECONDS', 5)
+        app.config.setdefault('REPLICA_RETRY_SECONDS', 30)
+        app.config.setdefault('MYSQL_CONNECT_TIMEOUT', 5) # Same limit flask_mysqldb applies to the request connection
+
+    # --- Routing ---
+    def mark_write(self):
+        # Pin this user's reads to the primary long enough for replicas to catch up with their write
+        session['db_primary_until'] = time.time() + self.app.config['READ_STICKY_SECONDS']
+
+    def _sticky(self):
+        until = session.get('db_primary_until')
+        return bool(until) and until > time.time()
+
+    def read_connection(self):
+        # Connection for a read-only query: a healthy replica if possible, else the primary
+        if not self.replicas or self._sticky():
+            return self.primary.connection
+        start = next(self._rr)
+        for i in range(len(self.replicas)):
+            replica = self.replicas[(start + i) % len(self.replicas)]
+            conn = self._replica_connection(replica)
+            if conn is not None:
+                return conn
+        return self.primary.connection
+
+    def write_connection(self):
+        return self.primary.connection
+
+    def open_primary_connection(self):
+        # A standalone primary connection for background threads, which have no app context for
+        # flask_mysqldb. The caller closes it.
+        conn = MySQLdb.connect(host=self.app.config['MYSQL_HOST'], port=int(self.app.config.get('MYSQL_PORT', 3306)),
+                               user=self.app.config['MYSQL_USER'], passwd=self.app.config['MYSQL_PASSWORD'],
+                               db=self.app.config['MYSQL_DB'], cursorclass=cursors.DictCursor,
+                               connect_timeout=self.app.config['MYSQL_CONNECT_TIMEOUT'], charset='utf8mb4')
+        return self.on_connect(conn) if self.on_connect else conn
+
+    # --- Replica connections (one per replica per app context, like flask_mysqldb) ---
+    def _replica_connection(self, replica):
+        now = time.time()
+        health = self._health.setdefault(replica, {'down_until': 0.0, 'lag': 0, 'checked_at': 0.0})
+        if health['down_until'] > now: return None
+        conns = g.setdefault('_replica_connections', {})
+        conn = conns.get(replica)
+        if conn is None:
+            try:
+                conn = MySQLdb.connect(host=replica[0], port=replica[1],
+                                       user=self.app.config['MYSQL_USER'], passwd=self.app.config['MYSQL_PASSWORD'],
+                                       db=self.app.config['MYSQL_DB'], cursorclass=cursors.DictCursor,
+                                       connect_timeout=self.app.config['MYSQL_CONNECT_TIMEOUT'], charset='utf8mb4')
+            except Exception as e:
+                print(f"WARNING: Replica {replica[0]}:{replica[1]} unavailable ({e}); reading from primary for {self.app.config['REPLICA_RETRY_SECONDS']}s.")
+                health['down_until'] = now + self.app.config['REPLICA_RETRY_SECONDS']
+                return None
+            if self.on_connect: conn = self.on_connect(conn)
+            conns[replica] = conn
+        if now - health['checked_at'] > self.app.config['REPLICA_LAG_CHECK_SECONDS']:
+            health['lag'] = self._replication_lag(conn, replica)
+            health['checked_at'] = now
+        if health['lag'] is None or health['lag'] > self.app.config['REPLICA_MAX_LAG_SECONDS']:
+            return None
+        return conn
+
+    def _replication_lag(self, conn, replica):
+        # Seconds behind the primary, or None if replication is stopped/broken or the check fails
+        cur = conn.cursor()
+        try:
+            try:
+                cur.execute("SHOW REPLICA STATUS") # MySQL 8.0.22+
+            except MySQLdb.Error:
+                cur.execute("SHOW SLAVE STATUS")
+            status = cur.fetchone()
+        except Exception as e:
+            print(f"WARNING: Could not read replication status from {replica[0]}:{replica[1]}: {e}")
+            return None
+        finally:
+            cur.close()
+        if not status: return 0 # Not configured as a replica (e.g. a plain second instance in dev): treat as current
+        lag = status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+        if lag is None: print(f"WARNING: Replication on {replica[0]}:{replica[1]} is not running.")
+        return lag
+
+    def replica_status(self):
+        return {f"{host}:{port}": dict(self._health.get((host, port), {})) for host, port in self.replicas}
+
+    def _teardown(self, exception):
+        for conn in g.pop('_replica_connections', {}).values():
+            try: conn.close()
+            except Exception: pass
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# Shared helpers used by app.py and the background/CLI modules (bulk import etc.)
+# Kept free of any Flask app import so they can be used outside a request.
+import base64
+import json
+import os
+
+
+RESCUE_ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf'}
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+
+
+def ensure_dir(directory):
+    if not os.path.exists(directory):
+        try: os.makedirs(directory, exist_ok=True); print(f"Created: {directory}")
+        except OSError as e: print(f"ERROR creating {directory}: {e}"); return False
+    return True
+
+def allowed_file(filename, allowed_set=ALLOWED_EXTENSIONS):
+    if not isinstance(filename, str) or not filename: return False
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_set
+
+
+def validate_animal_fields(name, animal_type, age_str, description):
+    # Same rules post_animal() has always applied. Returns (errors, age_as_float_or_None).
+    # Note: Checks for None or empty string handle required fields from HTML forms well.
+    errors = []
+    age = None
+    if not name: errors.append('Name is required.')
+    if not animal_type: errors.append('Type is required.')
+    if not age_str: # Check for empty string/None first
+        errors.append('Age is required.')
+    else: # Only try conversion if age_str is provided
+        try:
+             age = float(age_str)
+             if age < 0: # Ensure age is non-negative
+                 errors.append('Age cannot be negative.')
+        except (TypeError, ValueError):
+             errors.append('Invalid age format. Must be a number (e.g., 2, 1.5).')
+
+    if not description: errors.append('Description is required.')
+    return errors, age
+
+
+def encode_cursor(*values):
+    # Opaque keyset-pagination cursor (e.g. the date_posted and id of the last row on a page)
+    parts = [v.isoformat() if hasattr(v, 'isoformat') else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(parts, separators=(',', ':')).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    # Returns the list of values from encode_cursor(), or None for a missing/garbled cursor.
+    # Dates come back as ISO strings, which MySQL compares correctly against DATETIME columns.
+    if not cursor: return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return values if isinstance(values, list) else None
+    except (ValueError, TypeError):
+        return None
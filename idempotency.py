@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# Idempotency keys for POST routes, so a double-clicked submit doesn't store the same adoption
+# request, donation or animal twice.
+#
+# The browser sends a key per form (Idempotency-Key header, or an `idempotency_key` form field that
+# base.html adds to every POST form). The first request with a key reserves it as 'pending' and runs
+# normally; its response is then stored. A repeat of the same key gets the stored response back
+# without running the view, so nothing touches MySQL or the upload folders. A repeat that arrives
+# while the first is still running is answered at once with 409 and Retry-After; it never holds a
+# worker waiting for the first to finish. A 'pending' reservation is a lease of
+# IDEMPOTENCY_PENDING_LEASE_SECONDS: if its worker was killed mid-request (no teardown, so the key
+# was never released), the next request with the key takes it over once the lease has run out.
+#
+# Keys live in a small SQLite file (WAL mode) in the instance folder, which every worker on the host
+# shares. Entries expire after IDEMPOTENCY_TTL_SECONDS and the table is capped at
+# IDEMPOTENCY_MAX_ENTRIES rows.
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+
+
+DEFAULT_TTL_SECONDS = 24 * 3600
+DEFAULT_MAX_ENTRIES = 50000
+DEFAULT_PENDING_LEASE_SECONDS = 120 # A few times gunicorn's default 30 s worker timeout
+MAX_BODY_BYTES = 256 * 1024 # Larger responses are not replayed (the key is released instead)
+REPLAYED_HEADERS = ('Content-Type', 'Location')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    status INTEGER,
+    headers TEXT,
+    body BLOB,
+    created REAL NOT NULL
+)
+"""
+
+
+class IdempotencyStore:
+    def __init__(self, path, ttl_seconds=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES,
+                 pending_lease_seconds=DEFAULT_PENDING_LEASE_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.pending_lease_seconds = pending_lease_seconds
+        self._local = threading.local() # sqlite3 connections must not cross threads
+
+    def _db(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid() or self._local.path != self.path:
+            directory = os.path.dirname(self.path)
+            if directory: os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None) # autocommit; statements are atomic
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(SCHEMA)
+            self._local.conn = conn; self._local.pid = os.getpid(); self._local.path = self.path
+        return conn
+
+    def begin(self, key, now=None):
+        # Reserve key. Returns None if this request owns it (run the view), else the stored
+        # (status, headers, body) of the original, or 'pending' if it is still running.
+        now = now or time.time()
+        db = self._db()
+        db.execute("DELETE FROM idempotency_keys WHERE key = ? AND created < ?", (key, now - self.ttl_seconds))
+        inserted = db.execute("INSERT OR IGNORE INTO idempotency_keys (key, state, created) VALUES (?, 'pending', ?)", (key, now)).rowcount
+        if inserted:
+            if random.random() < 0.01: self.purge(now) # Amortised cleanup, keeps the table bounded
+            return None
+        row = db.execute("SELECT state, status, headers, body FROM idempotency_keys WHERE key = ?", (key,)).fetchone()
+        if row is None: return self.begin(key, now) # Expired/released between our two statements
+        if row[0] == 'pending':
+            # Compare-and-set on the old lease, so of several retries only one takes over a dead request's key
+            taken = db.execute("UPDATE idempotency_keys SET created = ? WHERE key = ? AND state = 'pending' AND created < ?",
+                               (now, key, now - self.pending_lease_seconds)).rowcount
+            return None if taken else 'pending'
+        return row[1], json.loads(row[2] or '{}'), row[3]
+
+    def complete(self, key, status, headers, body):
+        self._db().execute("UPDATE idempotency_keys SET state = 'done', status = ?, headers = ?, body = ? WHERE key = ?",
+                           (status, json.dumps(headers), sqlite3.Binary(body), key))
+
+    def release(self, key):
+        # Forget a key whose request failed, so the client can retry with it
+        self._db().execute("DELETE FROM idempotency_keys WHERE key = ?", (key,))
+
+    def purge(self, now=None):
+        now = now or time.time()
+        db = self._db()
+        db.execute("DELETE FROM idempotency_keys WHERE created < ?", (now - self.ttl_seconds,))
+        db.execute("DELETE FROM idempotency_keys WHERE key IN (SELECT key FROM idempotency_keys ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                   (self.max_entries,))
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+# Validation and sanitisation of user uploads (animal photos, adopter photos and ID proofs, rescue
+# images) before they are stored.
+#
+# * The file type comes from the first bytes of the upload, not its name: a .jpg has to be a JPEG,
+#   a .pdf a PDF, and so on. Anything else is rejected before any decoding happens.
+# * Images are decoded and re-encoded in a pool of worker processes: the EXIF orientation is applied,
+#   then all metadata (EXIF incl. GPS, XMP, comments, text chunks) is dropped, the longest side is
+#   capped at IMAGE_MAX_SIDE and the image is saved again in its own format. Only the ICC colour
+#   profile is kept. Decoding is CPU heavy and the place where malformed files blow up, so it runs
+#   outside the web worker; a crashed decoder loses one upload, not the worker.
+# * At most IMAGE_QUEUE_SIZE uploads per web worker are queued or in progress. A request that finds
+#   the queue full waits up to IMAGE_QUEUE_WAIT_SECONDS for a slot and then gets SanitiserBusy
+#   (a 503 with Retry-After), so a burst of large uploads can't pile up unbounded work or memory.
+# * PDFs (ID proofs) are checked by signature only and stored as received.
+# * A pool process writes its output under a temporary name; the web worker renames it to the real
+#   name only once the result is in. A task that timed out can't be stopped, but whatever it writes
+#   later is deleted, never put in place of (or after the removal of) the upload.
+import multiprocessing
+import os
+import shutil
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image, ImageOps, ImageSequence
+
+
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+DEFAULT_QUEUE_SIZE = 16
+DEFAULT_QUEUE_WAIT_SECONDS = 2.0
+DEFAULT_TIMEOUT_SECONDS = 30
+DEFAULT_MAX_SIDE = 2048
+DEFAULT_MAX_PIXELS = 40_000_000 # Decoded size limit (width x height); larger files are rejected unread
+DEFAULT_JPEG_QUALITY = 85
+MAX_GIF_FRAMES = 300
+
+# Extension -> (type sniffed from the content, Pillow format to re-encode with or None to store as is)
+FORMATS = {
+    'jpg': ('jpeg', 'JPEG'), 'jpeg': ('jpeg', 'JPEG'),
+    'png': ('png', 'PNG'), 'gif': ('gif', 'GIF'),
+    'pdf': ('pdf', None),
+}
+SNIFF_BYTES = 16
+
+
+class RejectedUpload(ValueError):
+    # The upload is not an acceptable file; str(e) is safe to show to the user
+    pass
+
+
+class SanitiserBusy(RuntimeError):
+    def __init__(self, retry_after):
+        super().__init__(f"Image processing queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+def sniff(head):
+    # File type from the first bytes of a file, or None
+    if head.startswith(b'\xff\xd8\xff'): return 'jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'): return 'png'
+    if head[:6] in (b'GIF87a', b'GIF89a'): return 'gif'
+    if head.startswith(b'%PDF-'): return 'pdf'
+    return None
+
+
+def expected_format(filename, head):
+    # (pillow format or None, extension) for an upload whose content matches its name; raises RejectedUpload
+    ext = filename.rsplit('.', 1)[-1].lower() if '.' in (filename or '') else ''
+    if ext not in FORMATS: raise RejectedUpload("Unsupported file type.")
+    kind, pillow_format = FORMATS[ext]
+    if sniff(head) != kind: raise RejectedUpload(f"The file's contents are not a valid {ext.upper()} file.")
+    return pillow_format, ext
+
+
+# --- Worker process side ---
+def _strip(image):
+    # Keeps only pixel data (and the ICC profile) of an already transposed image
+    icc_profile = image.info.get('icc_profile')
+    image.info = {'icc_profile': icc_profile} if icc_profile else {}
+    return image
+
+
+def sanitise_file(src_path, dest_path, pillow_format, max_side=DEFAULT_MAX_SIDE, max_pixels=DEFAULT_MAX_PIXELS,
+                  jpeg_quality=DEFAULT_JPEG_QUALITY):
+    # Decodes src_path and writes a clean copy to dest_path. Returns (width, height). Runs in a pool process.
+    Image.MAX_IMAGE_PIXELS = max_pixels // 2 # Pillow raises DecompressionBombError at twice this
+    try:
+        with Image.open(src_path, formats=[pillow_format]) as source:
+            if source.width * source.height > max_pixels: raise RejectedUpload("The image is too large.")
+            if pillow_format == 'GIF' and getattr(source, 'n_frames', 1) > 1:
+                frames = []
+                for frame in ImageSequence.Iterator(source):
+                    if len(frames) == MAX_GIF_FRAMES: break
+                    frame = _strip(frame.convert('RGBA')); frame.thumbnail((max_side, max_side))
+                    frames.append(frame)
+                frames[0].save(dest_path, 'GIF', save_all=True, append_images=frames[1:], optimize=False,
+                               duration=source.info.get('duration', 100), loop=source.info.get('loop', 0), disposal=2)
+                return frames[0].size
+            # Downscale first: for JPEGs this lets libjpeg decode at 1/2..1/8 scale (the box is square, so
+            # doing it before the rotation doesn't change the result). Then bake the orientation into the pixels.
+            source.thumbnail((max_side, max_side), Image.LANCZOS)
+            image = _strip(ImageOps.exif_transpose(source))
+            if pillow_format == 'JPEG':
+                if image.mode not in ('RGB', 'L', 'CMYK'): image = image.convert('RGB')
+                image.save(dest_path, 'JPEG', quality=jpeg_quality, optimize=True, progressive=True,
+                           icc_profile=image.info.get('icc_profile'))
+            elif pillow_format == 'PNG':
+                image.save(dest_path, 'PNG', optimize=False, icc_profile=image.info.get('icc_profile'))
+            else:
+                image.save(dest_path, pillow_format)
+            return image.size
+    except RejectedUpload:
+        raise
+    except (Image.DecompressionBombError, Image.DecompressionBombWarning):
+        raise RejectedUpload("The image is too large.")
+    except Exception as e: # Truncated/corrupt data, unsupported variants, ...
+        raise RejectedUpload(f"The image could not be read ({type(e).__name__}).")
+
+
+# --- Web worker side ---
+def _remove(path):
+    try: os.remove(path)
+    except FileNotFoundError: pass
+    except OSError as e: print(f"WARNING: Could not remove sanitiser output {path}: {e}")
+
+
+class ImageSanitiser:
+    def __init__(self, workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE, queue_wait_seconds=DEFAULT_QUEUE_WAIT_SECONDS,
+                 timeout_seconds=DEFAULT_TIMEOUT_SECONDS, max_side=DEFAULT_MAX_SIDE, max_pixels=DEFAULT_MAX_PIXELS,
+                 jpeg_quality=DEFAULT_JPEG_QUALITY):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue_wait_seconds = queue_wait_seconds
+        self.timeout_seconds = timeout_seconds
+        self.max_side = max_side
+        self.max_pixels = max_pixels
+        self.jpeg_quality = jpeg_quality
+        self._pool = None
+        self._pool_pid = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        # The pool is created lazily in each web worker process (pools don't survive a fork). Workers
+        # come from a fork server so they don't inherit the web worker's threads or connections.
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                if 'forkserver' in multiprocessing.get_all_start_methods():
+                    context = multiprocessing.get_context('forkserver')
+                    context.set_forkserver_preload([__name__]) # Pillow is imported once, not per worker
+                else:
+                    context = multiprocessing.get_context('spawn')
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+                self._pool_pid = os.getpid()
+                self._slots = threading.BoundedSemaphore(self.queue_size)
+            return self._pool, self._slots
+
+    def _reset_pool(self, pool):
+        with self._lock:
+            if self._pool is pool: self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, src_path, dest_path, pillow_format):
+        # Queues one image. Raises SanitiserBusy if no slot frees up within queue_wait_seconds.
+        pool, slots = self._executor()
+        if not slots.acquire(timeout=self.queue_wait_seconds):
+            raise SanitiserBusy(max(1, int(self.queue_wait_seconds + 0.999)))
+        try:
+            future = pool.submit(sanitise_file, src_path, dest_path, pillow_format,
+                                 self.max_side, self.max_pixels, self.jpeg_quality)
+        except Exception:
+            slots.release(); raise
+        future.add_done_callback(lambda _: slots.release())
+        return future
+
+    def sanitise(self, src_path, dest_path, pillow_format):
+        # Blocking: returns (width, height) once the clean copy is at dest_path. Raises RejectedUpload / SanitiserBusy.
+        pool, _ = self._executor()
+        part_path = f"{dest_path}.{uuid.uuid4().hex[:12]}.part"
+        future = self.submit(src_path, part_path, pillow_format)
+        try:
+            size = future.result(timeout=self.timeout_seconds)
+        except FutureTimeout:
+            # cancel() only stops a task that hasn't started; a running one finishes in the background
+            # and its output is deleted when it does
+            future.cancel()
+            future.add_done_callback(lambda _: _remove(part_path))
+            raise RejectedUpload("The image took too long to process.")
+        except BrokenProcessPool: # A decoder process died (crash, OOM kill): replace the pool
+            self._reset_pool(pool); _remove(part_path)
+            raise RejectedUpload("The image could not be processed.")
+        except BaseException:
+            _remove(part_path); raise
+        os.replace(part_path, dest_path)
+        return size
+
+    def save_upload(self, file_storage, dest_path):
+        # Validates a werkzeug FileStorage against its filename and writes the sanitised file to dest_path.
+        # The raw upload only ever exists as a temporary file next to dest_path.
+        head = file_storage.stream.read(SNIFF_BYTES); file_storage.stream.seek(0)
+        pillow_format, _ = expected_format(file_storage.filename, head)
+        if pillow_format is None: # Signature-checked only (PDF)
+            file_storage.save(dest_path); return dest_path
+        raw_path = f"{dest_path}.upload"
+        try:
+            with open(raw_path, 'wb') as f:
+                shutil.copyfileobj(file_storage.stream, f, 1024 * 1024)
+            self.sanitise(raw_path, dest_path, pillow_format)
+        except Exception:
+            if os.path.exists(dest_path): os.remove(dest_path)
+            raise
+        finally:
+            if os.path.exists(raw_path): os.remove(raw_path)
+        return dest_path
+
+    def save_file(self, src_path, dest_path):
+        # save_upload() for a file already on disk (bulk imports): the extension of dest_path decides
+        # the expected type. src_path is left in place.
+        with open(src_path, 'rb') as f: head = f.read(SNIFF_BYTES)
+        pillow_format, _ = expected_format(os.path.basename(dest_path), head)
+        if pillow_format is None:
+            shutil.copyfile(src_path, dest_path); return dest_path
+        try:
+            self.sanitise(src_path, dest_path, pillow_format)
+        except Exception:
+            if os.path.exists(dest_path): os.remove(dest_path)
+            raise
+        return dest_path
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None and self._pool_pid == os.getpid(): pool.shutdown(wait=True)
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+# Staff inbox for contact_messages: status workflow, full-text search and duplicate/spam clusters.
+#
+# Everything lives in MySQL so all workers share it and nothing is rebuilt on restart:
+#   * contact_terms is an inverted index, one (term hash, message_id) row per distinct word of
+#     subject + message, written when the message is stored. contact_term_stats keeps each term's
+#     document count, so a search starts from its rarest word and walks that posting list
+#     newest-first, checking the other words by primary key. Cost follows the rarest word, not the
+#     size of the table.
+#   * Near-duplicates are found with MinHash over word shingles. Each message gets a 32-value
+#     signature, split into 8 bands of 4; messages sharing a band (contact_bands) are candidates,
+#     confirmed by comparing signatures. A message joins the cluster of its closest earlier match
+#     (contact_clusters keeps each cluster's size), and joins as 'spam' once the cluster is marked
+#     spam or reaches the spam size threshold. A cluster staff marked as not spam never reaches it.
+#     contact_clusters.spam: 1 marked spam, 0 unreviewed, -1 marked not spam.
+#   * Listing is a keyset scan on (status, message_id) or (cluster_id, message_id). Bulk status
+#     changes are single UPDATE statements over an id list or a whole cluster.
+import hashlib
+import re
+
+import numpy as np
+
+from helpers import decode_cursor, encode_cursor
+
+
+INBOX_DDL = (
+    "ALTER TABLE contact_messages ADD COLUMN status VARCHAR(16) NOT NULL DEFAULT 'new'",
+    "ALTER TABLE contact_messages ADD COLUMN cluster_id BIGINT NULL",
+    "ALTER TABLE contact_messages ADD COLUMN signature VARBINARY(128) NULL",
+    "ALTER TABLE contact_messages ADD INDEX idx_contact_status (status, message_id)", # message_id: see ID_COLUMN
+    "ALTER TABLE contact_messages ADD INDEX idx_contact_cluster (cluster_id, message_id)",
+    """CREATE TABLE IF NOT EXISTS contact_terms (
+        term BIGINT UNSIGNED NOT NULL,
+        message_id BIGINT NOT NULL,
+        PRIMARY KEY (term, message_id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS contact_term_stats (
+        term BIGINT UNSIGNED NOT NULL PRIMARY KEY,
+        df INT NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS contact_bands (
+        band_key BIGINT UNSIGNED NOT NULL,
+        message_id BIGINT NOT NULL,
+        PRIMARY KEY (band_key, message_id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS contact_clusters (
+        cluster_id BIGINT NOT NULL PRIMARY KEY,
+        size INT NOT NULL,
+        last_message_id BIGINT NOT NULL,
+        spam TINYINT NOT NULL DEFAULT 0,
+        KEY idx_contact_clusters_size (size)
+    )""",
+)
+ID_COLUMN = 'message_id' # Primary key, following the <table>_id naming of the other tables
+RECEIVED_AT_COLUMN = 'submitted_at' # Timestamp column set by the contact_messages table default
+
+STATUSES = ('new', 'read', 'replied', 'archived', 'spam')
+DEFAULT_PAGE_SIZE = 50
+MAX_BULK_IDS = 1000
+DEFAULT_SPAM_CLUSTER_SIZE = 5
+SNIPPET_CHARS = 200
+
+# --- Terms ---
+_TOKEN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset((
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'for', 'from', 'has', 'have', 'hi', 'hello', 'i', 'if',
+    'in', 'is', 'it', 'me', 'my', 'of', 'on', 'or', 'our', 'so', 'that', 'the', 'this', 'to', 'was', 'we', 'with',
+    'you', 'your',
+))
+MAX_TERMS = 300 # Distinct terms indexed per message
+MAX_QUERY_TERMS = 8
+
+
+def words(text):
+    return [w for w in _TOKEN.findall((text or '').lower()) if 1 < len(w) <= 32]
+
+
+def term_hash(word):
+    return int.from_bytes(hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def message_terms(subject, message):
+    terms = []
+    seen = set()
+    for w in words(subject) + words(message):
+        if w in STOPWORDS or w in seen: continue
+        seen.add(w); terms.append(term_hash(w))
+        if len(terms) >= MAX_TERMS: break
+    return terms
+
+
+# --- MinHash signatures ---
+NUM_HASHES = 32
+BANDS = 8
+ROWS_PER_BAND = NUM_HASHES // BANDS
+SHINGLE_WORDS = 3
+DUPLICATE_SIMILARITY = 0.6 # Estimated Jaccard similarity of shingle sets to count as the same message
+_PRIME = (1 << 31) - 1
+_rng = np.random.RandomState(0x1b873593) # Fixed: signatures stored in the DB must stay comparable
+_A = _rng.randint(1, _PRIME, size=(NUM_HASHES, 1)).astype(np.uint64)
+_B = _rng.randint(0, _PRIME, size=(NUM_HASHES, 1)).astype(np.uint64)
+
+
+def signature(subject, message):
+    # 32 x uint32 MinHash signature (128 bytes) of the message's word shingles, or None if empty
+    tokens = words(subject) + words(message)
+    if not tokens: return None
+    n = SHINGLE_WORDS if len(tokens) >= SHINGLE_WORDS else len(tokens)
+    shingles = {' '.join(tokens[i:i + n]) for i in range(len(tokens) - n + 1)}
+    x = np.fromiter((term_hash(s) % _PRIME for s in shingles), dtype=np.uint64, count=len(shingles))
+    return ((_A * x + _B) % _PRIME).min(axis=1).astype('<u4').tobytes()
+
+
+def band_keys(sig):
+    keys = []
+    for band in range(BANDS):
+        chunk = sig[band * ROWS_PER_BAND * 4:(band + 1) * ROWS_PER_BAND * 4]
+        keys.append(int.from_bytes(hashlib.blake2b(bytes([band]) + chunk, digest_size=8).digest(), 'big'))
+    return keys
+
+
+def similarity(sig_a, sig_b):
+    a = np.frombuffer(sig_a, dtype='<u4'); b = np.frombuffer(sig_b, dtype='<u4')
+    return float((a == b).mean())
+
+
+# --- Indexing (write path) ---
+def index_message(cur, message_id, subject, message, spam_cluster_size=DEFAULT_SPAM_CLUSTER_SIZE):
+    # Adds one stored message to the search index and assigns its cluster (and spam status).
+    # Runs in the caller's transaction; returns (cluster_id, status or None if unchanged).
+    terms = sorted(message_terms(subject, message)) # Sorted: concurrent inserts lock shared df rows in one order
+    if terms:
+        cur.executemany("INSERT IGNORE INTO contact_terms (term, message_id) VALUES (%s, %s)", [(t, message_id) for t in terms])
+        cur.executemany("INSERT INTO contact_term_stats (term, df) VALUES (%s, 1) ON DUPLICATE KEY UPDATE df = df + 1", [(t,) for t in terms])
+    sig = signature(subject, message)
+    cluster_id = message_id
+    if sig is not None:
+        keys = band_keys(sig)
+        match = _closest_match(cur, keys, sig, message_id)
+        if match: cluster_id = match
+        cur.executemany("INSERT IGNORE INTO contact_bands (band_key, message_id) VALUES (%s, %s)", [(k, message_id) for k in keys])
+    cur.execute("INSERT INTO contact_clusters (cluster_id, size, last_message_id) VALUES (%s, 1, %s) "
+                "ON DUPLICATE KEY UPDATE size = size + 1, last_message_id = GREATEST(last_message_id, VALUES(last_message_id))",
+                (cluster_id, message_id))
+    cur.execute("SELECT size, spam FROM contact_clusters WHERE cluster_id = %s", (cluster_id,))
+    cluster = cur.fetchone()
+    status = None
+    if cluster and (cluster['spam'] > 0 or (cluster['spam'] == 0 and spam_cluster_size and cluster['size'] >= spam_cluster_size)):
+        status = 'spam'
+    cur.execute(f"UPDATE contact_messages SET cluster_id = %s, signature = %s{', status = %s' if status else ''} WHERE {ID_COLUMN} = %s",
+                (cluster_id, sig) + ((status,) if status else ()) + (message_id,))
+    return cluster_id, status
+
+
+def _closest_match(cur, keys, sig, message_id, per_band=3):
+    # Newest few messages sharing each band, then the one whose signature is closest. Each band
+    # lookup reads only the tail of its posting list, however big a spam run gets.
+    cur.execute(" UNION ALL ".join(["(SELECT message_id FROM contact_bands WHERE band_key = %s AND message_id < %s ORDER BY message_id DESC LIMIT %s)"] * len(keys)),
+                tuple(v for k in keys for v in (k, message_id, per_band)))
+    candidate_ids = sorted({row['message_id'] for row in cur.fetchall()})
+    if not candidate_ids: return None
+    cur.execute(f"SELECT {ID_COLUMN} AS message_id, cluster_id, signature FROM contact_messages WHERE {ID_COLUMN} IN ({', '.join(['%s'] * len(candidate_ids))})",
+                tuple(candidate_ids))
+    best, best_score = None, DUPLICATE_SIMILARITY
+    for row in cur.fetchall():
+        if row['signature'] is None or row['cluster_id'] is None: continue
+        score = similarity(sig, row['signature'])
+        if score >= best_score: best, best_score = row['cluster_id'], score
+    return best
+
+
+def index_pending(connection, batch_size=500, spam_cluster_size=DEFAULT_SPAM_CLUSTER_SIZE):
+    # Indexes messages stored before the inbox existed (or whose indexing failed), oldest first,
+    # one committed batch at a time. Returns the number indexed in this batch (0 when done).
+    cur = connection.cursor()
+    try:
+        cur.execute(f"SELECT {ID_COLUMN} AS message_id, subject, message FROM contact_messages WHERE cluster_id IS NULL "
+                    f"ORDER BY {ID_COLUMN} LIMIT %s", (batch_size,))
+        pending = cur.fetchall()
+        for row in pending:
+            index_message(cur, row['message_id'], row['subject'], row['message'], spam_cluster_size)
+        connection.commit()
+        return len(pending)
+    except Exception:
+        connection.rollback(); raise
+    finally:
+        cur.close()
+
+
+# --- Reading ---
+LIST_COLUMNS = (f"m.{ID_COLUMN} AS message_id, m.name, m.email, m.subject, LEFT(m.message, {SNIPPET_CHARS}) AS snippet, "
+                f"m.status, m.cluster_id, m.{RECEIVED_AT_COLUMN} AS received_at")
+
+
+def _after_id(cursor):
+    values = decode_cursor(cursor) if cursor else None
+    return int(values[0]) if values else None
+
+
+def _page(cur, sql, params, limit):
+    cur.execute(sql, params + (limit + 1,))
+    messages = list(cur.fetchall())
+    next_cursor = None
+    if len(messages) > limit:
+        messages = messages[:limit]
+        next_cursor = encode_cursor(messages[-1]['message_id'])
+    return messages, next_cursor
+
+
+def list_messages(cur, status=None, cluster_id=None, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    # Newest first, optionally one status and/or one cluster. Returns (messages, next_cursor).
+    where, params = [], []
+    if cluster_id is not None: where.append("m.cluster_id = %s"); params.append(cluster_id)
+    if status: where.append("m.status = %s"); params.append(status)
+    after = _after_id(cursor)
+    if after is not None: where.append(f"m.{ID_COLUMN} < %s"); params.append(after)
+    sql = (f"SELECT {LIST_COLUMNS} FROM contact_messages m" + (" WHERE " + " AND ".join(where) if where else "")
+           + f" ORDER BY m.{ID_COLUMN} DESC LIMIT %s")
+    return _page(cur, sql, tuple(params), limit)
+
+
+def search_messages(cur, query, status=None, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    # Messages containing every word of query, newest first. Returns (messages, next_cursor).
+    terms = []
+    for w in words(query):
+        if w not in STOPWORDS and term_hash(w) not in terms: terms.append(term_hash(w))
+    terms = terms[:MAX_QUERY_TERMS]
+    if not terms: return [], None
+    cur.execute(f"SELECT term, df FROM contact_term_stats WHERE term IN ({', '.join(['%s'] * len(terms))})", tuple(terms))
+    df = {row['term']: row['df'] for row in cur.fetchall()}
+    if len(df) < len(terms): return [], None # A word no message contains
+    terms.sort(key=df.get) # Rarest first: it drives the scan, the others are primary-key probes
+    joins = "".join(f" JOIN contact_terms t{i} ON t{i}.term = %s AND t{i}.message_id = t0.message_id" for i in range(1, len(terms)))
+    where, params = ["t0.term = %s"], list(terms[1:]) + [terms[0]]
+    if status: where.append("m.status = %s"); params.append(status)
+    after = _after_id(cursor)
+    if after is not None: where.append("t0.message_id < %s"); params.append(after)
+    sql = (f"SELECT STRAIGHT_JOIN {LIST_COLUMNS} FROM contact_terms t0{joins} JOIN contact_messages m ON m.{ID_COLUMN} = t0.message_id "
+           f"WHERE {' AND '.join(where)} ORDER BY t0.message_id DESC LIMIT %s")
+    return _page(cur, sql, tuple(params), limit)
+
+
+def get_message(cur, message_id):
+    cur.execute(f"SELECT {ID_COLUMN} AS message_id, name, email, subject, message, status, cluster_id, {RECEIVED_AT_COLUMN} AS received_at "
+                f"FROM contact_messages WHERE {ID_COLUMN} = %s", (message_id,))
+    return cur.fetchone()
+
+
+def list_clusters(cur, min_size=2, limit=DEFAULT_PAGE_SIZE):
+    # Largest duplicate clusters first, with the subject of their first message
+    cur.execute(f"SELECT c.cluster_id, c.size, c.spam, c.last_message_id, m.subject, m.email FROM contact_clusters c "
+                f"JOIN contact_messages m ON m.{ID_COLUMN} = c.cluster_id WHERE c.size >= %s ORDER BY c.size DESC LIMIT %s",
+                (min_size, limit))
+    return cur.fetchall()
+
+
+# --- Bulk status changes (one statement each) ---
+def set_status(cur, status, message_ids):
+    # Returns the number of messages changed
+    if not message_ids: return 0
+    cur.execute(f"UPDATE contact_messages SET status = %s WHERE {ID_COLUMN} IN ({', '.join(['%s'] * len(message_ids))}) AND status <> %s",
+                (status, *message_ids, status))
+    return cur.rowcount
+
+
+def set_cluster_status(cur, status, cluster_id, spam=None):
+    # Every message of a cluster. The cluster's spam flag (which decides where its future members are
+    # filed) only changes on an explicit verdict: status 'spam' or spam=True/False. Archiving or
+    # reading a spam cluster leaves it spam.
+    if status == 'spam': spam = True
+    if spam is not None:
+        cur.execute("UPDATE contact_clusters SET spam = %s WHERE cluster_id = %s", (1 if spam else -1, cluster_id))
+    cur.execute("UPDATE contact_messages SET status = %s WHERE cluster_id = %s AND status <> %s", (status, cluster_id, status))
+    return cur.rowcount
+
+
+def mark_read(cur, message_id):
+    # Compare-and-set, so opening a message never overwrites a status someone else just set
+    cur.execute(f"UPDATE contact_messages SET status = 'read' WHERE {ID_COLUMN} = %s AND status = 'new'", (message_id,))
+    return cur.rowcount == 1
+
+
+def ensure_inbox_tables(connection):
+    cur = connection.cursor()
+    try:
+        for statement in INBOX_DDL:
+            try:
+                cur.execute(statement)
+            except Exception as e:
+                # 1060 duplicate column / 1061 duplicate key: already migrated
+                if getattr(e, 'args', (None,))[0] not in (1060, 1061): raise
+        connection.commit()
+    finally:
+        cur.close()
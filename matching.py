@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+# Volunteer and foster matching for coordinators.
+#
+# Each worker keeps one MatchIndex per application kind, built from the volunteers / fosters
+# tables and refreshed from them every MATCH_REFRESH_SECONDS; applications submitted through
+# this worker are added immediately. An index gives every application a position and keeps one
+# bitset (a Python int, bit n = application at position n) per attribute value: home type, yard,
+# fenced, transport, preferred animals, interests, status, address words, and one per
+# availability slot (7 days x morning/afternoon/evening, parsed from the free-text availability
+# answer). A query such as "fenced yard, can transport, available weekends" is then a handful of
+# big-int AND/ORs, however many applications there are.
+#
+# Ranking ("best fosters for this rescue") adds weighted attribute bitsets into a bit-sliced
+# score (one bitset per binary digit of the score) and reads the top k straight off the slices,
+# so no per-application Python loop runs either.
+import functools
+import re
+import threading
+import time
+
+
+MATCH_DDL = (
+    "ALTER TABLE fosters ADD COLUMN availability VARCHAR(255) NULL",
+)
+TABLES = {'volunteer': 'volunteers', 'foster': 'fosters'}
+COLUMNS = {
+    'volunteer': ('name', 'email', 'phone', 'address', 'availability', 'areas_of_interest', 'experience', 'status'),
+    'foster': ('name', 'email', 'phone', 'address', 'home_type', 'has_yard', 'yard_fenced', 'can_transport',
+               'preferred_animal', 'foster_experience', 'availability', 'status'),
+}
+INACTIVE_STATUSES = ('rejected', 'inactive', 'withdrawn')
+# Columns added by MATCH_DDL. Until `flask init-matching` has run they are left out of inserts and
+# read as NULL; each worker looks again every SCHEMA_RECHECK_SECONDS, so no restart is needed.
+OPTIONAL_COLUMNS = {'foster': ('availability',)}
+SCHEMA_RECHECK_SECONDS = 60
+
+# --- Availability slots ---
+DAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+PARTS = ('morning', 'afternoon', 'evening')
+ALL_DAYS = frozenset(range(7))
+ALL_PARTS = frozenset(range(3))
+SLOT_COUNT = len(DAYS) * len(PARTS)
+
+_AVAILABILITY_TOKEN = re.compile(
+    r"(?P<day>\b(?:mon(?:day)?|tue(?:s|sday)?|wed(?:nesday)?|thu(?:rs?|rsday)?|fri(?:day)?|sat(?:urday)?|sun(?:day)?)s?\b)"
+    r"|(?P<weekday>\bweek ?days?\b)|(?P<weekend>\bweek ?ends?\b)"
+    r"|(?P<any>\b(?:daily|every ?day|any ?time|flexible|all week|whenever)\b)"
+    r"|(?P<morning>\bmornings?\b)|(?P<afternoon>\b(?:afternoons?|noon|midday|lunch ?time)\b)"
+    r"|(?P<evening>\b(?:evenings?|nights?|after work)\b)|(?P<allday>\b(?:all|full|whole) day\b)"
+    r"|(?P<hour>\b(?P<h>\d{1,2})(?::\d\d)? ?(?P<ampm>am|pm)\b)"
+)
+
+
+def _hour_part(hour, ampm):
+    hour = hour % 12 + (12 if ampm == 'pm' else 0)
+    return 0 if hour < 12 else 1 if hour < 17 else 2
+
+
+@functools.lru_cache(maxsize=4096) # Answers repeat a lot ("Weekends", "Weekday evenings")
+def parse_availability(text):
+    # "Weekday evenings, Saturday mornings" -> bitmask over the 21 (day, part) slots.
+    # Days and times of day are paired in the order they are written ("Saturday and Sunday
+    # mornings", "mornings on weekends"); a day with no time means the whole day, a time with no
+    # day means every day. Text with neither parses to 0 (unknown).
+    runs = [] # alternating ['day'|'part', set]
+    for m in _AVAILABILITY_TOKEN.finditer((text or '').lower()):
+        kind = m.lastgroup
+        if kind == 'day': kind, values = 'day', {DAYS.index(m.group('day')[:3])}
+        elif kind == 'weekday': kind, values = 'day', set(range(5))
+        elif kind == 'weekend': kind, values = 'day', {5, 6}
+        elif kind == 'any': kind, values = 'day', set(ALL_DAYS)
+        elif kind == 'allday': kind, values = 'part', set(ALL_PARTS)
+        elif kind == 'hour': kind, values = 'part', {_hour_part(int(m.group('h')), m.group('ampm'))}
+        else: kind, values = 'part', {PARTS.index(kind)}
+        if runs and runs[-1][0] == kind: runs[-1][1].update(values)
+        else: runs.append([kind, values])
+    mask = 0; i = 0
+    while i < len(runs):
+        kind, values = runs[i]
+        if i + 1 < len(runs):
+            days, parts = (values, runs[i + 1][1]) if kind == 'day' else (runs[i + 1][1], values)
+            i += 2
+        else:
+            days, parts = (values, ALL_PARTS) if kind == 'day' else (ALL_DAYS, values)
+            i += 1
+        for d in days:
+            for p in parts: mask |= 1 << (d * 3 + p)
+    return mask
+
+
+def describe_slots(mask):
+    # Bitmask -> ['sat:morning', ...]
+    return [f"{DAYS[s // 3]}:{PARTS[s % 3]}" for s in range(SLOT_COUNT) if mask >> s & 1]
+
+
+# --- Attributes ---
+_WORD = re.compile(r"[a-z]{4,}")
+AREA_STOPWORDS = frozenset((
+    'road', 'street', 'lane', 'near', 'opposite', 'behind', 'floor', 'flat', 'apartment', 'building', 'house',
+    'nagar', 'colony', 'sector', 'block', 'main', 'cross', 'east', 'west', 'north', 'south', 'city', 'district',
+))
+MAX_AREA_WORDS = 12
+
+
+def area_words(text):
+    # Place-name words from an address or rescue location, for "nearby" matching without geocoding
+    words = []
+    for word in _WORD.findall((text or '').lower()):
+        if word not in AREA_STOPWORDS and word not in words: words.append(word)
+    return words[:MAX_AREA_WORDS]
+
+
+def _choices(value):
+    # "Puppies, Adult Dogs" -> ['puppies', 'adult dogs']
+    return [v.strip().lower() for v in (value or '').split(',') if v.strip()]
+
+
+def attributes(kind, row):
+    # (field, value) pairs an application is indexed under
+    attrs = [('status', (row.get('status') or 'pending').lower())]
+    attrs += [('area', w) for w in area_words(row.get('address'))]
+    if kind == 'volunteer':
+        attrs += [('interest', v) for v in _choices(row.get('areas_of_interest'))]
+        if (row.get('experience') or '').strip(): attrs.append(('experienced', 'yes'))
+    else:
+        for field, column in (('home', 'home_type'), ('yard', 'has_yard'), ('fenced', 'yard_fenced'), ('transport', 'can_transport')):
+            if row.get(column): attrs.append((field, row[column].lower()))
+        attrs += [('prefers', v) for v in _choices(row.get('preferred_animal'))]
+        if (row.get('foster_experience') or '').strip(): attrs.append(('experienced', 'yes'))
+    return attrs
+
+
+# --- Bitset helpers ---
+def iter_bits(bits, limit=None):
+    # Positions of set bits, highest (newest application) first
+    while bits and limit != 0:
+        pos = bits.bit_length() - 1
+        yield pos
+        bits ^= 1 << pos
+        if limit is not None: limit -= 1
+
+
+def _bitset(positions, size):
+    buf = bytearray((size + 7) // 8)
+    for pos in positions: buf[pos >> 3] |= 1 << (pos & 7)
+    return int.from_bytes(buf, 'little')
+
+
+def _add_weighted(slices, bits, weight):
+    # Adds weight to the score of every position in bits. slices[i] holds bit i of each score.
+    shift = 0
+    while weight:
+        if weight & 1:
+            carry, i = bits, shift
+            while carry:
+                while i >= len(slices): slices.append(0)
+                slices[i], carry = slices[i] ^ carry, slices[i] & carry
+                i += 1
+        weight >>= 1; shift += 1
+
+
+def _top_k(slices, candidates, k):
+    # Bit-sliced top-k: walks the score slices from the highest digit down, keeping the positions
+    # that are certainly in the top k (sure) and those still tied (tied). Returns a bitset.
+    sure, tied = 0, candidates
+    for plane in reversed(slices):
+        x = sure | (tied & plane)
+        n = x.bit_count()
+        if n > k: tied &= plane
+        elif n < k: sure = x; tied &= ~plane
+        else: return x
+    for pos in iter_bits(tied, k - sure.bit_count()): sure |= 1 << pos
+    return sure
+
+
+def _score_at(slices, pos):
+    return sum(1 << i for i, plane in enumerate(slices) if plane >> pos & 1)
+
+
+class MatchIndex:
+    def __init__(self, kind, refresh_seconds=60):
+        self.kind = kind
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._reset()
+        self._loaded_at = 0.0
+
+    def _reset(self):
+        self._entries = [] # position -> summary dict (None once removed)
+        self._keys = [] # position -> (attribute keys, slot mask), kept for compaction
+        self._positions = {} # application id -> position
+        self._facets = {} # (field, value) -> bitset
+        self._slots = [0] * SLOT_COUNT
+        self._live = 0
+
+    def needs_refresh(self, now=None):
+        return (now or time.time()) - self._loaded_at > self.refresh_seconds
+
+    def __len__(self):
+        return len(self._positions)
+
+    # --- Maintenance ---
+    def _describe(self, row):
+        slots = parse_availability(row.get('availability'))
+        entry = {
+            'id': row['application_id'], 'name': row.get('name'), 'email': row.get('email'), 'phone': row.get('phone'),
+            'status': row.get('status'), 'availability': row.get('availability'), 'slots': slots,
+        }
+        return entry, (tuple(attributes(self.kind, row)), slots)
+
+    def _load(self, entries, keys):
+        # Bulk build: collect each bitset's positions first and convert once, instead of growing
+        # big ints one bit at a time (which is quadratic). Called with the lock held or on a fresh index.
+        size = len(entries)
+        positions = {}
+        slot_positions = [[] for _ in range(SLOT_COUNT)]
+        for pos, (attrs, slots) in enumerate(keys):
+            for key in attrs: positions.setdefault(key, []).append(pos)
+            for s in range(SLOT_COUNT):
+                if slots >> s & 1: slot_positions[s].append(pos)
+        self._entries, self._keys = entries, keys
+        self._positions = {entry['id']: pos for pos, entry in enumerate(entries)}
+        self._facets = {key: _bitset(p, size) for key, p in positions.items()}
+        self._slots = [_bitset(p, size) for p in slot_positions]
+        self._live = (1 << size) - 1
+
+    def rebuild(self, rows, now=None):
+        # Builds a fresh index off to the side and swaps it in, so queries never see a partial one
+        fresh = MatchIndex(self.kind)
+        described = [fresh._describe(row) for row in rows]
+        fresh._load([d[0] for d in described], [d[1] for d in described])
+        with self._lock:
+            self._entries, self._keys, self._positions = fresh._entries, fresh._keys, fresh._positions
+            self._facets, self._slots, self._live = fresh._facets, fresh._slots, fresh._live
+            self._loaded_at = now or time.time()
+
+    def add(self, row):
+        # New or changed application (re-adding an id replaces its previous entry)
+        entry, keys = self._describe(row)
+        with self._lock:
+            self._remove(entry['id'])
+            pos = len(self._entries); bit = 1 << pos
+            self._entries.append(entry); self._keys.append(keys)
+            self._positions[entry['id']] = pos
+            for key in keys[0]: self._facets[key] = self._facets.get(key, 0) | bit
+            for s in range(SLOT_COUNT):
+                if keys[1] >> s & 1: self._slots[s] |= bit
+            self._live |= bit
+
+    def remove(self, application_id):
+        with self._lock: self._remove(application_id)
+
+    def _remove(self, application_id):
+        pos = self._positions.pop(application_id, None)
+        if pos is None: return
+        self._entries[pos] = None; self._keys[pos] = None
+        self._live &= ~(1 << pos) # Facet bits of dead positions are masked out by _live at query time
+        if len(self._entries) > 2 * len(self._positions) + 64: # Mostly dead positions: renumber
+            live = [pos for pos, entry in enumerate(self._entries) if entry is not None]
+            self._load([self._entries[pos] for pos in live], [self._keys[pos] for pos in live])
+
+    # --- Queries ---
+    def facet_values(self, field):
+        with self._lock:
+            return sorted(value for (f, value), bits in self._facets.items() if f == field and bits & self._live)
+
+    def _select(self, filters, available, include_inactive):
+        # filters: {field: [values]} -> OR within a field, AND across fields. available: slot mask,
+        # matched by anyone free in at least one of those slots.
+        bits = self._live
+        for field, values in (filters or {}).items():
+            any_of = 0
+            for value in values: any_of |= self._facets.get((field, value.lower()), 0)
+            bits &= any_of
+        if available:
+            any_slot = 0
+            for s in range(SLOT_COUNT):
+                if available >> s & 1: any_slot |= self._slots[s]
+            bits &= any_slot
+        if not include_inactive:
+            for status in INACTIVE_STATUSES: bits &= ~self._facets.get(('status', status), 0)
+        return bits
+
+    def find(self, filters=None, available=0, limit=50, include_inactive=False):
+        # Matching applications, newest first. Returns (entries, total matched).
+        with self._lock:
+            bits = self._select(filters, available, include_inactive)
+            return [self._entries[pos] for pos in iter_bits(bits, limit)], bits.bit_count()
+
+    def rank(self, weights, filters=None, available=0, limit=10, include_inactive=False):
+        # weights: [(key, weight)] with positive integer weights, where key is a (field, value)
+        # pair or a list of them (scored once if any applies). Returns [(entry, score)] for the
+        # best `limit` matching applications, best first.
+        with self._lock:
+            candidates = self._select(filters, available, include_inactive)
+            if not candidates: return []
+            slices = []
+            for key, weight in weights:
+                bits = 0
+                for k in (key if isinstance(key, list) else [key]): bits |= self._facets.get(k, 0)
+                bits &= candidates
+                if bits and weight > 0: _add_weighted(slices, bits, weight)
+            top = _top_k(slices, candidates, limit) if slices else candidates
+            ranked = [(self._entries[pos], _score_at(slices, pos)) for pos in iter_bits(top, limit)]
+        ranked.sort(key=lambda item: item[1], reverse=True) # Stable: newest first within a score
+        return ranked
+
+
+# --- Rescue -> foster ranking ---
+def rescue_weights(rescue, urgency=0):
+    # Scoring for "best fosters for this rescue": preferred animal first, then what the rescue
+    # needs (transport, a secure yard for dogs, medical experience when it is urgent), then area.
+    animal = (rescue.get('animal_type') or '').lower()
+    text = f"{animal} {(rescue.get('condition_details') or '').lower()}"
+    preferred = ['any']
+    if 'dog' in animal or 'puppy' in text or 'puppies' in text:
+        preferred.append('puppies' if re.search(r'\bpupp', text) else 'adult dogs')
+    if 'cat' in animal or 'kitten' in text:
+        preferred.append('kittens' if 'kitten' in text else 'adult cats')
+    if urgency >= 2: preferred.append('medical needs')
+    weights = [([('prefers', p) for p in preferred], 4)]
+    weights.append((('transport', 'yes'), 3 if urgency >= 2 else 2))
+    if 'dog' in animal or 'pupp' in text:
+        weights += [(('fenced', 'yes'), 2), (('fenced', 'partial'), 1), (('home', 'house'), 1)]
+    weights.append((('experienced', 'yes'), 2 if urgency >= 2 else 1))
+    weights.append((('status', 'approved'), 2))
+    area = [('area', word) for word in area_words(rescue.get('location'))]
+    if area: weights.append((area, 2))
+    return weights
+
+
+def ensure_matching_columns(connection):
+    cur = connection.cursor()
+    try:
+        for statement in MATCH_DDL:
+            try:
+                cur.execute(statement)
+            except Exception as e:
+                # 1060 duplicate column: already migrated
+                if getattr(e, 'args', (None,))[0] != 1060: raise
+        connection.commit()
+    finally:
+        cur.close()
+    _schema_checks.clear()
+
+
+_schema_checks = {} # kind -> (checked_at, optional columns present)
+
+def present_columns(cur, kind, now=None):
+    # The OPTIONAL_COLUMNS of this kind that exist in the database (cached per worker)
+    wanted = OPTIONAL_COLUMNS.get(kind, ())
+    if not wanted: return frozenset()
+    now = now or time.time()
+    cached = _schema_checks.get(kind)
+    if cached and (len(cached[1]) == len(wanted) or now - cached[0] < SCHEMA_RECHECK_SECONDS): return cached[1]
+    cur.execute("SELECT column_name AS name FROM information_schema.columns "
+                f"WHERE table_schema = DATABASE() AND table_name = %s AND column_name IN ({', '.join(['%s'] * len(wanted))})",
+                (TABLES[kind],) + tuple(wanted))
+    present = frozenset(row['name'].lower() for row in cur.fetchall())
+    _schema_checks[kind] = (now, present)
+    return present
+
+
+_primary_keys = {} # kind -> primary key column; these don't change while a worker runs
+
+def id_column(cur, kind):
+    # The primary key of this kind's table, read from the schema rather than guessed from its name.
+    # Raises RuntimeError unless it is a single column (each application needs one id).
+    if kind in _primary_keys: return _primary_keys[kind]
+    cur.execute("SELECT column_name AS name FROM information_schema.columns "
+                "WHERE table_schema = DATABASE() AND table_name = %s AND column_key = 'PRI'", (TABLES[kind],))
+    names = [row['name'] for row in cur.fetchall()]
+    if len(names) != 1:
+        raise RuntimeError(f"The {TABLES[kind]} table needs a single-column primary key for matching "
+                           f"(found {', '.join(names) or 'none'}).")
+    _primary_keys[kind] = names[0]
+    return names[0]
+
+
+def load_applications(cur, kind):
+    # Rows carry their id as application_id, whatever the table calls its key
+    missing = set(OPTIONAL_COLUMNS.get(kind, ())) - present_columns(cur, kind)
+    columns = ', '.join(f"NULL AS {c}" if c in missing else c for c in COLUMNS[kind])
+    cur.execute(f"SELECT {id_column(cur, kind)} AS application_id, {columns} FROM {TABLES[kind]}")
+    return cur.fetchall()
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+# Per-request database query profiling.
+#
+# Every cursor handed out by the app (flask_mysqldb's primary connection, replica connections and
+# the tuple cursors in rows.py) records each execute(): a fingerprint of the SQL (literals and
+# placeholders replaced by ?, IN lists collapsed), the number of parameters, the duration and the
+# rows returned or affected. Parameter values are never stored.
+#
+# When a request ends, its queries are checked for
+#   * N+1 patterns: the same fingerprint run QUERY_N_PLUS_ONE times or more with different
+#     parameters (typically a query inside a loop over rows), and
+#   * duplicates: the identical statement with identical parameters run more than once.
+# Requests with findings are logged and kept in a ring buffer. Individual queries slower than
+# QUERY_SLOW_MS go to a second ring buffer, whichever route (or background thread) issued them.
+# Both buffers, plus per-fingerprint totals, are per worker process and can be read at
+# /admin/queries. Each response also carries a Server-Timing "db" entry, which shows up in
+# the browser's network panel.
+import functools
+import os
+import re
+import threading
+import time
+from collections import deque
+
+from flask import g, has_request_context, request
+from flask_mysqldb import MySQL
+
+
+DEFAULT_SLOW_MS = 100
+DEFAULT_N_PLUS_ONE = 5
+DEFAULT_RING_SIZE = 200
+MAX_FINGERPRINTS = 1000 # Per-fingerprint totals kept per worker; new fingerprints beyond this are not tracked
+MAX_SQL_CHARS = 500
+
+_STRING = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s")
+_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_VALUES_LIST = re.compile(r"\bVALUES\s*\(\s*\?(?:\s*,\s*\?)*\s*\)(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))*", re.IGNORECASE)
+_SPACE = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=2048)
+def fingerprint(sql):
+    # "SELECT * FROM t WHERE id IN (%s, %s) AND x = 'a'" -> "SELECT * FROM t WHERE id IN (...) AND x = ?"
+    if isinstance(sql, bytes): sql = sql.decode('utf-8', 'replace')
+    sql = _STRING.sub('?', sql)
+    sql = _PLACEHOLDER.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _IN_LIST.sub('IN (...)', sql)
+    sql = _VALUES_LIST.sub('VALUES (...)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+def _param_count(args):
+    if args is None: return 0
+    if isinstance(args, (list, tuple, dict)): return len(args)
+    return 1
+
+
+class ProfiledCursorMixin:
+    # Times execute()/executemany() and reports them to the profiler attached to the connection.
+    # Cursors of connections that were never instrumented behave exactly like the base class.
+    def execute(self, query, args=None):
+        profiler = getattr(self.connection, '_query_profiler', None)
+        if profiler is None: return super().execute(query, args)
+        started = time.perf_counter()
+        try:
+            result = super().execute(query, args)
+        except Exception:
+            profiler.record(query, args, time.perf_counter() - started, None, failed=True); raise
+        profiler.record(query, args, time.perf_counter() - started, self.rowcount)
+        return result
+
+    def executemany(self, query, args):
+        profiler = getattr(self.connection, '_query_profiler', None)
+        if profiler is None: return super().executemany(query, args)
+        started = time.perf_counter()
+        try:
+            result = super().executemany(query, args)
+        except Exception:
+            profiler.record(query, None, time.perf_counter() - started, None, failed=True, many=True); raise
+        profiler.record(query, None, time.perf_counter() - started, self.rowcount, many=True)
+        return result
+
+
+@functools.lru_cache(maxsize=None)
+def profiled(cursor_class):
+    # Profiled subclass of a MySQLdb cursor class (DictCursor, Cursor, ...), created once per class
+    if issubclass(cursor_class, ProfiledCursorMixin): return cursor_class
+    return type('Profiled' + cursor_class.__name__, (ProfiledCursorMixin, cursor_class), {})
+
+
+class QueryProfiler:
+    def __init__(self, app=None):
+        self.enabled = True
+        self.slow_seconds = DEFAULT_SLOW_MS / 1000
+        self.n_plus_one = DEFAULT_N_PLUS_ONE
+        self.slow_queries = deque(maxlen=DEFAULT_RING_SIZE)
+        self.flagged_requests = deque(maxlen=DEFAULT_RING_SIZE)
+        self.totals = {} # fingerprint -> [count, total seconds, max seconds, rows]
+        self._lock = threading.Lock()
+        self.app = None
+        if app is not None: self.init_app(app)
+
+    def init_app(self, app):
+        # Re-reads the config when called again; the after_request hook is only registered once
+        if self.app is not app: app.after_request(self._after_request)
+        self.app = app
+        self.enabled = app.config.get('QUERY_PROFILING', True)
+        self.slow_seconds = app.config.get('QUERY_SLOW_MS', DEFAULT_SLOW_MS) / 1000
+        self.n_plus_one = app.config.get('QUERY_N_PLUS_ONE', DEFAULT_N_PLUS_ONE)
+        ring_size = app.config.get('QUERY_RING_SIZE', DEFAULT_RING_SIZE)
+        if self.slow_queries.maxlen != ring_size:
+            self.slow_queries = deque(maxlen=ring_size); self.flagged_requests = deque(maxlen=ring_size)
+
+    def instrument(self, connection):
+        # Routes this connection's cursors through the profiler. Cheap to call on every access.
+        if not self.enabled or getattr(connection, '_query_profiler', None) is self: return connection
+        connection._query_profiler = self
+        connection.cursorclass = profiled(connection.cursorclass)
+        return connection
+
+    # --- Recording (called by ProfiledCursorMixin) ---
+    def record(self, query, args, seconds, rows, failed=False, many=False):
+        if isinstance(query, bytes): query = query.decode('utf-8', 'replace')
+        fp = fingerprint(query)
+        in_request = has_request_context()
+        if in_request:
+            queries = g.get('_profiled_queries')
+            if queries is None: queries = g._profiled_queries = []
+            # The raw statement and parameters are only kept (as a hash) to spot exact repeats
+            queries.append((fp, hash((query, repr(args))) if not many else None, seconds, rows, failed))
+        with self._lock:
+            stats = self.totals.get(fp)
+            if stats is None and len(self.totals) < MAX_FINGERPRINTS: stats = self.totals[fp] = [0, 0.0, 0.0, 0]
+            if stats is not None:
+                stats[0] += 1; stats[1] += seconds; stats[3] += rows or 0
+                if seconds > stats[2]: stats[2] = seconds
+        if seconds >= self.slow_seconds:
+            self.slow_queries.append({
+                'at': time.time(), 'ms': round(seconds * 1000, 2), 'fingerprint': fp[:MAX_SQL_CHARS],
+                'params': _param_count(args), 'rows': rows, 'failed': failed,
+                'endpoint': request.endpoint if in_request else None,
+                'path': request.path if in_request else None, 'pid': os.getpid(),
+            })
+
+    # --- Per-request analysis ---
+    def analyse(self, queries):
+        # Returns (n_plus_one, duplicates) for one request's recorded queries
+        by_fp = {}
+        for fp, statement, seconds, rows, failed in queries:
+            entry = by_fp.setdefault(fp, {'count': 0, 'ms': 0.0, 'statements': {}})
+            entry['count'] += 1; entry['ms'] += seconds * 1000
+            if statement is not None: entry['statements'][statement] = entry['statements'].get(statement, 0) + 1
+        n_plus_one, duplicates = [], []
+        for fp, entry in by_fp.items():
+            repeats = sum(n - 1 for n in entry['statements'].values() if n > 1)
+            if repeats:
+                duplicates.append({'fingerprint': fp[:MAX_SQL_CHARS], 'count': entry['count'], 'repeats': repeats})
+            if entry['count'] - repeats >= self.n_plus_one:
+                n_plus_one.append({'fingerprint': fp[:MAX_SQL_CHARS], 'count': entry['count'], 'ms': round(entry['ms'], 2)})
+        return n_plus_one, duplicates
+
+    def _after_request(self, response):
+        queries = g.pop('_profiled_queries', None)
+        if not queries: return response
+        total_ms = sum(q[2] for q in queries) * 1000
+        response.headers.add('Server-Timing', f'db;dur={total_ms:.1f};desc="{len(queries)} queries"')
+        n_plus_one, duplicates = self.analyse(queries)
+        if n_plus_one or duplicates:
+            self.flagged_requests.append({
+                'at': time.time(), 'endpoint': request.endpoint, 'method': request.method, 'path': request.path,
+                'queries': len(queries), 'db_ms': round(total_ms, 2), 'n_plus_one': n_plus_one, 'duplicates': duplicates,
+                'pid': os.getpid(),
+            })
+            for item in n_plus_one:
+                self.app.logger.warning(f"Possible N+1 in {request.endpoint}: {item['count']} x {item['fingerprint']}")
+            for item in duplicates:
+                self.app.logger.warning(f"Duplicate query in {request.endpoint}: {item['repeats']} repeat(s) of {item['fingerprint']}")
+        return response
+
+    # --- Reporting ---
+    def report(self, top=20):
+        with self._lock:
+            totals = [(fp, list(stats)) for fp, stats in self.totals.items()]
+        totals.sort(key=lambda item: item[1][1], reverse=True)
+        return {
+            'pid': os.getpid(),
+            'slow_ms': self.slow_seconds * 1000,
+            'slow_queries': list(reversed(self.slow_queries)),
+            'flagged_requests': list(reversed(self.flagged_requests)),
+            'top_queries': [{'fingerprint': fp[:MAX_SQL_CHARS], 'count': count, 'total_ms': round(total * 1000, 2),
+                             'avg_ms': round(total * 1000 / count, 3), 'max_ms': round(peak * 1000, 2), 'rows': rows}
+                            for fp, (count, total, peak, rows) in totals[:top]],
+        }
+
+    def reset(self):
+        with self._lock:
+            self.totals.clear()
+        self.slow_queries.clear(); self.flagged_requests.clear()
+
+
+class ProfiledMySQL(MySQL):
+    # flask_mysqldb extension whose per-app-context connection is instrumented by `profiler`
+    def __init__(self, profiler, app=None):
+        self.profiler = profiler
+        super().__init__(app)
+
+    def init_app(self, app):
+        # Safe to call again for the same app: flask_mysqldb would register a second teardown
+        if getattr(self, '_bound_app', None) is app: return
+        super().init_app(app)
+        self._bound_app = app
+
+    @property
+    def connection(self):
+        conn = super().connection
+        if conn is not None: self.profiler.instrument(conn)
+        return conn
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+# Token-bucket rate limiting for the anonymous write routes (/rescue, /donate, /contact, ...).
+#
+# Buckets live in a small memory-mapped file so every gunicorn worker on the host sees the same
+# counts. The file is a fixed table of slots (key hash, tokens, last refill time) split into
+# stripes; each stripe is guarded by a POSIX byte-range lock (between processes) plus a
+# threading.Lock (between threads of one worker). A check is a hash, one lock and a handful of
+# struct reads, so rejected requests never touch MySQL.
+#
+# On platforms without fcntl (Windows dev machines) an in-process dict is used instead; limits are
+# then per worker rather than per host.
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+
+SLOT = struct.Struct('<Qdd') # key hash (0 = empty), tokens, last refill (epoch seconds)
+DEFAULT_SLOTS = 1 << 16
+STRIPES = 64
+MAX_PROBES = 8
+
+
+def parse_limit(value):
+    # "5/60" -> (burst=5, rate=5/60 tokens per second). Returns None for "0", "" or "off".
+    if value is None: return None
+    value = str(value).strip().lower()
+    if value in ('', '0', 'off', 'none'): return None
+    count, _, period = value.partition('/')
+    count = int(count); period = float(period or 1)
+    if count <= 0 or period <= 0: return None
+    return count, count / period
+
+
+def _key_hash(key):
+    value = int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+    return value or 1 # 0 marks an empty slot
+
+
+def _refill(tokens, last, now, burst, rate):
+    if last <= 0: return float(burst) # New bucket starts full
+    return min(float(burst), tokens + max(0.0, now - last) * rate)
+
+
+class LocalTokenBuckets:
+    # Per-process stand-in with the same interface as SharedTokenBuckets
+    def __init__(self, max_keys=DEFAULT_SLOTS):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._max_keys = max_keys
+
+    def take(self, key, burst, rate, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            tokens, last = self._buckets.get(key, (0.0, 0.0))
+            tokens = _refill(tokens, last, now, burst, rate)
+            allowed = tokens >= 1.0
+            if allowed: tokens -= 1.0
+            if len(self._buckets) >= self._max_keys and key not in self._buckets:
+                self._buckets.clear() # Crude but bounded; only reached under a flood of distinct keys
+            self._buckets[key] = (tokens, now)
+        return allowed, 0.0 if allowed else (1.0 - tokens) / rate
+
+
+class SharedTokenBuckets:
+    def __init__(self, path, slots=DEFAULT_SLOTS):
+        self.slots_per_stripe = max(MAX_PROBES, slots // STRIPES)
+        self.slots = self.slots_per_stripe * STRIPES
+        size = self.slots * SLOT.size
+        directory = os.path.dirname(path)
+        if directory: os.makedirs(directory, exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        self._thread_locks = [threading.Lock() for _ in range(STRIPES)]
+
+    def take(self, key, burst, rate, now=None):
+        # Returns (allowed, retry_after_seconds)
+        now = time.time() if now is None else now
+        h = _key_hash(key)
+        stripe = h % STRIPES
+        base = stripe * self.slots_per_stripe
+        start = (h // STRIPES) % self.slots_per_stripe
+        stripe_offset = base * SLOT.size
+        stripe_len = self.slots_per_stripe * SLOT.size
+        with self._thread_locks[stripe]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, stripe_len, stripe_offset)
+            try:
+                # Linear probe inside the stripe; evict the least recently used probed slot if all are taken
+                target = None; victim = None; victim_last = None
+                for i in range(MAX_PROBES):
+                    offset = (base + (start + i) % self.slots_per_stripe) * SLOT.size
+                    slot_hash, tokens, last = SLOT.unpack_from(self._map, offset)
+                    if slot_hash == h:
+                        target = (offset, tokens, last); break
+                    if slot_hash == 0:
+                        target = (offset, 0.0, 0.0); break
+                    if victim_last is None or last < victim_last:
+                        victim, victim_last = offset, last
+                if target is None:
+                    target = (victim, 0.0, 0.0)
+                offset, tokens, last = target
+                tokens = _refill(tokens, last, now, burst, rate)
+                allowed = tokens >= 1.0
+                if allowed: tokens -= 1.0
+                SLOT.pack_into(self._map, offset, h, tokens, now)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, stripe_len, stripe_offset)
+        return allowed, 0.0 if allowed else (1.0 - tokens) / rate
+
+
+def open_buckets(path, slots=DEFAULT_SLOTS):
+    if fcntl is None or not path:
+        print("WARNING: Shared rate-limit store unavailable, using per-process buckets.")
+        return LocalTokenBuckets(slots)
+    try:
+        return SharedTokenBuckets(path, slots)
+    except (OSError, ValueError) as e:
+        print(f"WARNING: Could not open shared rate-limit store {path} ({e}), using per-process buckets.")
+        return LocalTokenBuckets(slots)
+
+
+class RateLimiter:
+    # Holds the per-endpoint limits and lazily opens the bucket store in each worker process
+    # (after gunicorn forks, so no mapping/lock state is inherited from the master).
+    def __init__(self, limits, path, slots=DEFAULT_SLOTS):
+        self.limits = limits # endpoint -> (burst, rate) or None
+        self.path = path
+        self.slots = slots
+        self._store = None
+        self._store_pid = None
+        self._store_path = None
+        self._lock = threading.Lock()
+
+    def _buckets(self):
+        # Reopened after a fork, or when create_app() has pointed the limiter at another store
+        if self._store is None or self._store_pid != os.getpid() or self._store_path != self.path:
+            with self._lock:
+                if self._store is None or self._store_pid != os.getpid() or self._store_path != self.path:
+                    self._store = open_buckets(self.path, self.slots)
+                    self._store_pid = os.getpid(); self._store_path = self.path
+        return self._store
+
+    def check(self, endpoint, keys, now=None):
+        # Takes one token from every key's bucket for this endpoint. Returns 0 if allowed, else the
+        # number of seconds to wait. Every key is charged, so an IP and a session are limited independently.
+        limit = self.limits.get(endpoint)
+        if not limit: return 0
+        burst, rate = limit
+        store = self._buckets()
+        retry_after = 0.0
+        for key in keys:
+            if not key: continue
+            allowed, wait = store.take(f"{endpoint}|{key}", burst, rate, now)
+            if not allowed: retry_after = max(retry_after, wait)
+        return retry_after
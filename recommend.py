@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+# "Similar animals" and "recommended for you" for the adoption pages.
+#
+# Each animal is a fixed-width float32 vector: a TF-IDF weighted bag of description words (hashed
+# into TEXT_DIMS signed buckets, so no vocabulary has to be stored), a hashed one-hot of its type
+# and a soft age bucket. Rows are L2-normalised, so cosine similarity is a dot product. A build
+# precomputes every animal's NEIGHBOURS most similar animals with blocked matrix products, so a
+# lookup only reads a few short lists; scoring the whole catalogue per request would be bound by
+# memory bandwidth (~60 MB read at 100k animals).
+#
+# Adoption history adds a collaborative signal: animals requested by the same adopters score a
+# bonus ("people who asked about X also asked about Y"), and a user's own requests form the
+# profile their recommendations are matched against.
+#
+# Like the triage queue, each worker keeps its own index. It is built from the DB on first use
+# (in a background thread; until then callers fall back to the newest listings). post_animal() /
+# submit_adoption() in this worker update it immediately: a new animal costs one matrix-vector
+# product, which also slots it into the neighbour lists it now belongs to. Every
+# RECOMMEND_REFRESH_SECONDS the worker pulls rows added by other workers and the current Available
+# set. IDF weights are fixed at build time; a full rebuild happens once the catalogue has grown by
+# REBUILD_GROWTH since the last one.
+import math
+import os
+import re
+import threading
+import time
+import zlib
+from collections import Counter, defaultdict
+
+import numpy as np
+
+
+TEXT_DIMS = 128
+TYPE_DIMS = 16
+AGE_BUCKETS = (1.0, 3.0, 7.0) # Upper bounds: baby, young, adult, senior
+TEXT_WEIGHT = 1.0
+TYPE_WEIGHT = 0.8
+AGE_WEIGHT = 0.4
+CO_REQUEST_WEIGHT = 0.15 # Per shared adopter, capped below
+CO_REQUEST_CAP = 0.45
+REBUILD_GROWTH = 0.2
+NEIGHBOURS = 32 # Precomputed per animal; lookups filter these by availability
+BLOCK_CELLS = 1 << 24 # Scores per block while building the neighbour table (64 MB of float32)
+
+STOPWORDS = frozenset("""
+the and for with very who has have had are was his her its this that they them their from but not
+will can all our out you your she him one been also into only just more most some such than then
+there these those when what which while would could should about after again
+""".split())
+TOKEN_RE = re.compile(r"[a-z]{3,}")
+
+
+def tokenize(text):
+    return [t for t in TOKEN_RE.findall((text or '').lower()) if t not in STOPWORDS]
+
+def _bucket(token, dims):
+    # Stable across processes (unlike hash()); the top bit picks the sign so collisions cancel out on average
+    h = zlib.crc32(token.encode('utf-8'))
+    return h % dims, (1.0 if h & 0x80000000 else -1.0)
+
+def _age_weights(age):
+    # Soft one-hot: the animal's bucket gets 1, its neighbours 0.5, so a 3.5 year old is still close to a 2.5 year old
+    weights = [0.0] * (len(AGE_BUCKETS) + 1)
+    if age is None: return weights
+    try: age = float(age)
+    except (TypeError, ValueError): return weights
+    index = sum(1 for bound in AGE_BUCKETS if age > bound)
+    weights[index] = 1.0
+    if index > 0: weights[index - 1] = 0.5
+    if index < len(AGE_BUCKETS): weights[index + 1] = 0.5
+    return weights
+
+
+class Recommender:
+    def __init__(self, refresh_seconds=300, neighbours=NEIGHBOURS):
+        self.refresh_seconds = refresh_seconds
+        self.k = neighbours
+        self.dims = TEXT_DIMS + TYPE_DIMS + len(AGE_BUCKETS) + 1
+        self._size = 0 # Rows in use; the arrays below grow geometrically like a list
+        self._matrix = np.zeros((0, self.dims), dtype=np.float32)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._available = np.zeros(0, dtype=bool)
+        self._nbr = np.zeros((0, self.k), dtype=np.int32) # Row's nearest rows, best first (-1 = empty)
+        self._nbr_scores = np.zeros((0, self.k), dtype=np.float32)
+        self._row_of = {} # animal_id -> row
+        self._idf = {}
+        self._default_idf = 1.0
+        self._built_size = 0
+        self._requests_by_user = defaultdict(set) # user_id -> {animal_id}
+        self._requesters = defaultdict(set) # animal_id -> {user_id}
+        self._loaded_at = 0.0
+        self.max_animal_id = 0
+        self.max_adoption_id = 0
+        self.building = False
+        self.built_at = 0.0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def needs_refresh(self, now=None):
+        return (now or time.time()) - self._loaded_at > self.refresh_seconds
+
+    def needs_rebuild(self):
+        # Never built, or grown enough since the last build that its IDF weights are stale
+        return not self._built_size or self._size >= self._built_size * (1 + REBUILD_GROWTH)
+
+    # --- Building ---
+    def _vectorize(self, animals, idf, default_idf):
+        # One float32 row per animal. Words are gathered into (row, column, value) triples in Python
+        # and scattered into the matrix with a single np.add.at, then every row is normalised at once.
+        matrix = np.zeros((len(animals), self.dims), dtype=np.float32)
+        rows_idx, cols_idx, values = [], [], []
+        for i, animal in enumerate(animals):
+            counts = Counter(tokenize(animal.get('description')))
+            total = sum(counts.values())
+            for token, count in counts.items():
+                column, sign = _bucket(token, TEXT_DIMS)
+                rows_idx.append(i); cols_idx.append(column)
+                values.append(sign * (count / total) * idf.get(token, default_idf))
+            column, _ = _bucket((animal.get('type') or '').strip().lower(), TYPE_DIMS)
+            matrix[i, TEXT_DIMS + column] = TYPE_WEIGHT
+            matrix[i, TEXT_DIMS + TYPE_DIMS:] = np.asarray(_age_weights(animal.get('age')), dtype=np.float32) * AGE_WEIGHT
+        if values:
+            text = np.zeros((len(animals), TEXT_DIMS), dtype=np.float32)
+            np.add.at(text, (np.asarray(rows_idx), np.asarray(cols_idx)), np.asarray(values, dtype=np.float32))
+            norms = np.linalg.norm(text, axis=1, keepdims=True)
+            matrix[:, :TEXT_DIMS] = TEXT_WEIGHT * text / np.maximum(norms, 1e-9)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-9)
+
+    def _neighbour_table(self, matrix, capacity):
+        # All-pairs top-k in row blocks: each block is one BLAS matrix product against the whole
+        # catalogue, cut down to its best k per row with argpartition. Block height keeps the
+        # temporary score block around 64 MB whatever the catalogue size.
+        n = len(matrix)
+        nbr = np.full((capacity, self.k), -1, dtype=np.int32)
+        scores = np.full((capacity, self.k), -np.inf, dtype=np.float32)
+        k = min(self.k, n - 1)
+        if k <= 0: return nbr, scores
+        block_rows = max(1, BLOCK_CELLS // n)
+        for start in range(0, n, block_rows):
+            stop = min(n, start + block_rows)
+            block = matrix[start:stop] @ matrix.T
+            block[np.arange(stop - start), np.arange(start, stop)] = -np.inf # Not your own neighbour
+            best = np.argpartition(-block, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(block, best, axis=1)
+            order = np.argsort(-best_scores, axis=1)
+            nbr[start:stop, :k] = np.take_along_axis(best, order, axis=1)
+            scores[start:stop, :k] = np.take_along_axis(best_scores, order, axis=1)
+        return nbr, scores
+
+    def _swap(self, matrix, ids, available, nbr, nbr_scores, size, idf, default_idf, requests, built_at, now=None):
+        with self._lock:
+            self._matrix, self._ids, self._available = matrix, ids, available
+            self._nbr, self._nbr_scores = nbr, nbr_scores
+            self._size = size
+            self._row_of = {int(animal_id): row for row, animal_id in enumerate(ids[:size])}
+            self._idf, self._default_idf = idf, default_idf
+            self._requests_by_user, self._requesters = defaultdict(set), defaultdict(set)
+            self.max_adoption_id = 0
+            self._add_requests(requests)
+            self._built_size = size
+            self.built_at = built_at
+            self.max_animal_id = int(ids[:size].max()) if size else 0
+            self._loaded_at = now or time.time()
+
+    def rebuild(self, animals, requests=(), now=None):
+        # Full build. animals: rows with animal_id, type, age, description, status (load_animals);
+        # requests: rows with adoption_id, user_id, animal_id (load_requests). The expensive part runs
+        # without the lock, so lookups keep using the previous index until the new one is swapped in.
+        animals = list(animals)
+        df = Counter()
+        for animal in animals:
+            df.update(set(tokenize(animal.get('description'))))
+        n = len(animals)
+        idf = {token: math.log((1 + n) / (1 + count)) + 1.0 for token, count in df.items()}
+        default_idf = math.log(1 + n) + 1.0 # Words first seen after the build count as rare
+        capacity = max(64, int(n * (1 + REBUILD_GROWTH)) + 1) # Room to grow until the next rebuild
+        matrix = np.zeros((capacity, self.dims), dtype=np.float32)
+        matrix[:n] = self._vectorize(animals, idf, default_idf)
+        nbr, nbr_scores = self._neighbour_table(matrix[:n], capacity)
+        ids = np.zeros(capacity, dtype=np.int64)
+        ids[:n] = np.fromiter((a['animal_id'] for a in animals), dtype=np.int64, count=n)
+        available = np.zeros(capacity, dtype=bool)
+        available[:n] = np.fromiter((a.get('status') == 'Available' for a in animals), dtype=bool, count=n)
+        self._swap(matrix, ids, available, nbr, nbr_scores, n, idf, default_idf, requests, time.time(), now)
+
+    # --- Snapshot shared by the workers on a host ---
+    def save(self, path):
+        # Writes the built index (not the adoption requests, which load_requests reads quickly)
+        with self._lock:
+            n = self._size
+            arrays = {
+                'matrix': self._matrix[:n], 'ids': self._ids[:n], 'available': self._available[:n],
+                'nbr': self._nbr[:n], 'nbr_scores': self._nbr_scores[:n],
+                'idf_tokens': np.array(list(self._idf), dtype=str), 'idf_values': np.array(list(self._idf.values()), dtype=np.float64),
+                'meta': np.array([self._default_idf, self.built_at], dtype=np.float64),
+            }
+        directory = os.path.dirname(path)
+        if directory: os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path) # Readers see the old or the new snapshot, never half of one
+
+    def load(self, path, requests=()):
+        # Swaps in a snapshot written by save(); rows added since are picked up by the next refresh
+        with np.load(path, allow_pickle=False) as data:
+            n = len(data['ids'])
+            capacity = max(64, int(n * (1 + REBUILD_GROWTH)) + 1)
+            def padded(array, fill):
+                out = np.full((capacity,) + array.shape[1:], fill, dtype=array.dtype)
+                out[:n] = array
+                return out
+            idf = dict(zip(data['idf_tokens'].tolist(), data['idf_values'].tolist()))
+            default_idf, built_at = data['meta'].tolist()
+            self._swap(padded(data['matrix'], 0), padded(data['ids'], 0), padded(data['available'], False),
+                       padded(data['nbr'], -1), padded(data['nbr_scores'], -np.inf), n, idf, default_idf, requests, built_at)
+
+    def rebuild_in_background(self, animals, requests=(), save_path=None):
+        # Runs rebuild() on a daemon thread (NumPy releases the GIL for the heavy parts). Returns False
+        # if a build is already running in this worker.
+        with self._lock:
+            if self.building: return False
+            self.building = True
+        def run():
+            started = time.time()
+            try:
+                self.rebuild(animals, requests)
+                print(f"Recommendation index built: {self._size} animals in {time.time() - started:.1f}s")
+                if save_path: self.save(save_path) # Lets the other workers load it instead of building their own
+            except Exception as e:
+                print(f"ERROR building recommendation index: {e}")
+                self._loaded_at = time.time() # Retry after the next refresh interval, not on every request
+            finally:
+                self.building = False
+        threading.Thread(target=run, name='recommend-rebuild', daemon=True).start()
+        return True
+
+    def add_animals(self, animals):
+        # Incremental insert for new listings: one matrix-vector product per animal gives its own
+        # neighbours and tells which existing animals now have it among theirs.
+        with self._lock:
+            new = [a for a in animals if a.get('animal_id') is not None and int(a['animal_id']) not in self._row_of]
+            if not new: return
+            vectors = self._vectorize(new, self._idf, self._default_idf)
+            for animal, vector in zip(new, vectors):
+                row = self._size
+                self._ensure_capacity(row + 1)
+                sims = self._matrix[:row] @ vector
+                k = min(self.k, row)
+                if k:
+                    best = np.argpartition(-sims, k - 1)[:k]
+                    best = best[np.argsort(-sims[best])]
+                    self._nbr[row, :k] = best; self._nbr_scores[row, :k] = sims[best]
+                for other in np.nonzero(sims > self._nbr_scores[:row, -1])[0]:
+                    self._insert_neighbour(other, row, sims[other])
+                animal_id = int(animal['animal_id'])
+                self._matrix[row] = vector
+                self._ids[row] = animal_id
+                self._available[row] = animal.get('status', 'Available') == 'Available'
+                self._row_of[animal_id] = row
+                self._size += 1
+                self.max_animal_id = max(self.max_animal_id, animal_id)
+
+    def _insert_neighbour(self, row, neighbour, score):
+        # Sorted insert into a full or partly filled neighbour list, dropping the worst entry
+        position = int(np.searchsorted(-self._nbr_scores[row], -score, side='right'))
+        if position >= self.k: return
+        self._nbr[row, position + 1:] = self._nbr[row, position:-1].copy()
+        self._nbr_scores[row, position + 1:] = self._nbr_scores[row, position:-1].copy()
+        self._nbr[row, position] = neighbour; self._nbr_scores[row, position] = score
+
+    def _ensure_capacity(self, needed):
+        if needed <= len(self._ids): return
+        capacity = max(needed, 2 * len(self._ids), 64)
+        def grow(array, fill):
+            bigger = np.full((capacity,) + array.shape[1:], fill, dtype=array.dtype)
+            bigger[:self._size] = array[:self._size]
+            return bigger
+        self._matrix, self._ids, self._available = grow(self._matrix, 0), grow(self._ids, 0), grow(self._available, False)
+        self._nbr, self._nbr_scores = grow(self._nbr, -1), grow(self._nbr_scores, -np.inf)
+
+    def set_available(self, available_ids, now=None):
+        # Replaces the Available flags from the DB (adoptions accepted through any worker)
+        available_ids = np.fromiter(available_ids, dtype=np.int64)
+        with self._lock:
+            self._available[:self._size] = np.isin(self._ids[:self._size], available_ids)
+            self._loaded_at = now or time.time()
+
+    def mark_unavailable(self, animal_id):
+        with self._lock:
+            row = self._row_of.get(int(animal_id))
+            if row is not None: self._available[row] = False
+
+    def add_requests(self, requests):
+        with self._lock:
+            self._add_requests(requests)
+
+    def _add_requests(self, requests):
+        for row in requests:
+            self._requests_by_user[row['user_id']].add(row['animal_id']); self._requesters[row['animal_id']].add(row['user_id'])
+            self.max_adoption_id = max(self.max_adoption_id, row['adoption_id'] or 0)
+
+    # --- Lookups (only read the precomputed neighbour lists: O(k) per seed animal) ---
+    def _co_requested(self, animal_ids):
+        # animal_id -> number of adopters who asked about it and about any of animal_ids
+        shared = Counter()
+        for animal_id in animal_ids:
+            for user_id in self._requesters.get(animal_id, ()):
+                shared.update(self._requests_by_user.get(user_id, ()))
+        return shared
+
+    def _rank(self, seed_rows, seed_ids, limit):
+        # Candidates are the seeds' neighbours (similarity averaged over the seeds) plus animals
+        # co-requested with them, which get a bonus and, if not already neighbours, a direct score.
+        candidates = self._nbr[seed_rows].ravel()
+        scores = self._nbr_scores[seed_rows].ravel()
+        valid = candidates >= 0
+        totals = defaultdict(float)
+        for row, score in zip(candidates[valid].tolist(), scores[valid].tolist()):
+            totals[row] += score / len(seed_rows)
+        for animal_id, count in self._co_requested(seed_ids).items():
+            row = self._row_of.get(animal_id)
+            if row is None: continue
+            if row not in totals:
+                totals[row] = float((self._matrix[seed_rows] @ self._matrix[row]).mean())
+            totals[row] += min(CO_REQUEST_CAP, CO_REQUEST_WEIGHT * count)
+        for row in seed_rows: totals.pop(row, None)
+        ranked = sorted(((score, row) for row, score in totals.items() if self._available[row]), reverse=True)[:limit]
+        return [(int(self._ids[row]), score) for score, row in ranked]
+
+    def similar(self, animal_id, limit=8):
+        # [(animal_id, score)] of Available animals most like this one
+        with self._lock:
+            row = self._row_of.get(animal_id)
+            if row is None: return []
+            return self._rank([row], (animal_id,), limit)
+
+    def for_user(self, user_id, limit=8):
+        # Animals like the ones this user has asked to adopt; None if they have no history yet
+        # (the caller then falls back to the newest listings).
+        with self._lock:
+            requested = [a for a in self._requests_by_user.get(user_id, ()) if a in self._row_of]
+            if not requested: return None
+            return self._rank([self._row_of[a] for a in requested], requested, limit)
+
+
+# --- DB helpers (DictCursor) ---
+def load_animals(cur, after_id=0):
+    cur.execute("SELECT animal_id, type, age, description, status FROM animals WHERE animal_id > %s ORDER BY animal_id", (after_id,))
+    return cur.fetchall()
+
+def load_requests(cur, after_id=0):
+    cur.execute("SELECT adoption_id, user_id, animal_id FROM adoptions WHERE adoption_id > %s AND user_id IS NOT NULL ORDER BY adoption_id", (after_id,))
+    return cur.fetchall()
+
+def load_available_ids(cur):
+    cur.execute("SELECT animal_id FROM animals WHERE status = %s", ('Available',))
+    return [row['animal_id'] for row in cur.fetchall()]
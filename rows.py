@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# Lightweight row objects for the big listings (adoption grid, dashboard).
+#
+# The app's default cursor is DictCursor, which builds a full dict per row; the listings then
+# added keys to those dicts (image_url, pending_requests). For large pages that is most of the
+# request's memory. Here the listing queries use a plain tuple cursor and each row becomes a
+# __slots__ object: no per-row dict, and derived values such as image_url are only computed
+# (and cached) when a template actually reads them.
+#
+# Rows support both attribute access (templates) and row['column'] (existing code written for
+# DictCursor). Columns a query did not select read as None.
+from decimal import Decimal
+
+from MySQLdb import cursors
+from flask import url_for
+
+import query_profiler
+import storage
+
+
+class Row:
+    __slots__ = ()
+
+    def __getattr__(self, name):
+        # Only reached for slots that were never assigned (column not selected). Private slots
+        # still raise, so lazy properties can tell "not computed yet" apart from None.
+        if not name.startswith('_') and name in type(self).__slots__: return None
+        raise AttributeError(f"{type(self).__name__} has no column {name!r}")
+
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name) from None
+
+    def get(self, name, default=None):
+        value = getattr(self, name, None)
+        return default if value is None else value
+
+    def as_dict(self):
+        # Only the columns that were actually selected/assigned
+        out = {}
+        for name in type(self).__slots__:
+            if name.startswith('_'): continue
+            try:
+                out[name] = object.__getattribute__(self, name)
+            except AttributeError:
+                pass
+        return out
+
+    def as_json(self):
+        # as_dict() with dates as ISO strings, DECIMAL amounts as floats and nested rows converted
+        out = {}
+        for name, value in self.as_dict().items():
+            if hasattr(value, 'isoformat'): value = value.isoformat()
+            elif isinstance(value, Decimal): value = float(value)
+            elif isinstance(value, list): value = [v.as_json() if isinstance(v, Row) else v for v in value]
+            out[name] = value
+        return out
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.as_dict()!r})"
+
+    @classmethod
+    def from_values(cls, columns, values):
+        row = cls.__new__(cls)
+        for name, value in zip(columns, values):
+            setattr(row, name, value)
+        return row
+
+    @classmethod
+    def fetch_all(cls, cur):
+        # Maps every remaining row of a tuple cursor (see tuple_cursor) to cls
+        columns = [d[0] for d in cur.description]
+        from_values = cls.from_values
+        return [from_values(columns, values) for values in cur.fetchall()]
+
+
+class AnimalRow(Row):
+    __slots__ = ('animal_id', 'name', 'type', 'age', 'description', 'image_filename', 'status',
+                 'date_posted', 'user_id', 'pending_requests', '_image_url')
+
+    @property
+    def image_url(self):
+        try:
+            return self._image_url
+        except AttributeError:
+            pass
+        url = None
+        if self.image_filename:
+            url = url_for('static', filename=storage.static_path(self.image_filename, 'animals'))
+        self._image_url = url
+        return url
+
+
+class AdoptionRow(Row):
+    __slots__ = ('adoption_id', 'animal_id', 'animal_name', 'user_id', 'adopter_name', 'adopter_email',
+                 'adoption_date', 'status')
+
+
+class DonationRow(Row):
+    __slots__ = ('donation_id', 'user_id', 'donation_type', 'amount', 'product_details', 'donation_date', 'status')
+
+
+def tuple_cursor(connection):
+    # A cursor returning plain tuples, overriding the app-wide DictCursor (still profiled, see query_profiler)
+    return connection.cursor(query_profiler.profiled(cursors.Cursor))
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+# Upload storage lifecycle: an index of every file under static/uploads (size + owning row),
+# per-user quotas, and an incremental orphan sweeper.
+#
+# Every upload path records its file in `upload_index` in the SAME transaction as the row that
+# references it. A file that exists on disk but is not in the index therefore belongs to a request
+# that crashed/rolled back before commit, and an index row whose owner row is gone belongs to a
+# deleted animal/adoption/rescue. Both are orphans; the sweeper removes them a bounded batch at a time.
+#
+# Files are stored in a two-level hashed layout, static/uploads/<kind>/ab/cd/<name>, so no single
+# directory grows past a few hundred entries. migrate_to_shards() moves files saved with the old flat
+# layout and rewrites the path columns in place.
+import hashlib
+import itertools
+import json
+import os
+import re
+import shutil
+import time
+import traceback
+
+from helpers import ensure_dir
+
+
+UPLOAD_INDEX_DDL = """
+CREATE TABLE IF NOT EXISTS upload_index (
+    path VARCHAR(255) NOT NULL PRIMARY KEY,
+    kind VARCHAR(16) NOT NULL,
+    size_bytes BIGINT NOT NULL DEFAULT 0,
+    user_id INT NULL,
+    owner_table VARCHAR(32) NOT NULL,
+    owner_id INT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    KEY idx_upload_index_user (user_id),
+    KEY idx_upload_index_owner (owner_table, owner_id)
+)
+"""
+
+# kind (sub-folder of static/uploads) -> (owner table, primary key, path columns, user column)
+UPLOAD_KINDS = {
+    'animals': ('animals', 'animal_id', ('image_filename',), 'user_id'),
+    'adoptions': ('adoptions', 'adoption_id', ('photo_path', 'aadhaar_path'), 'user_id'),
+    'rescues': ('rescues', 'rescue_id', ('image_filename',), 'reporter_user_id'),
+}
+
+DEFAULT_QUOTA_BYTES = 200 * 1024 * 1024 # Per user, across all upload kinds
+DEFAULT_SWEEP_BATCH = 500
+DEFAULT_SWEEP_GRACE_SECONDS = 6 * 3600 # Never touch files younger than this: their request may still be running
+
+
+SHARDED_PATH_RE = re.compile(r'^uploads/[a-z]+/[0-9a-f]{2}/[0-9a-f]{2}/[^/]+$')
+
+
+def shard_of(filename):
+    # Stable two-level shard ('ab', 'cd') for a stored file name; 65,536 leaf directories per kind
+    digest = hashlib.md5(filename.encode('utf-8')).hexdigest()
+    return digest[0:2], digest[2:4]
+
+def sharded_upload_paths(upload_folder, kind, filename):
+    # Returns (directory, full_path, path relative to static/) for a new upload. The caller creates
+    # the directory with ensure_dir() so each route keeps its own error message.
+    level1, level2 = shard_of(filename)
+    directory = os.path.join(upload_folder, level1, level2)
+    return directory, os.path.join(directory, filename), f"uploads/{kind}/{level1}/{level2}/{filename}"
+
+def static_path(stored_path, kind):
+    # Path relative to static/ for a stored image_filename/photo_path value. Values are normally already
+    # 'uploads/<kind>/...'; very old rows may hold only the bare file name.
+    if not stored_path: return None
+    stored_path = stored_path.replace("\\", "/")
+    if stored_path.startswith('uploads/'): return stored_path
+    return f"uploads/{kind}/{os.path.basename(stored_path)}"
+
+
+def stored_size(full_path):
+    # Size of a saved upload: the basis for both the quota check and the index
+    try: return os.path.getsize(full_path)
+    except OSError: return 0
+
+
+def record_upload(cur, rel_path, full_path, kind, user_id, owner_id):
+    # Call with the cursor of the transaction that inserts the owning row, before commit()
+    size = stored_size(full_path)
+    owner_table = UPLOAD_KINDS[kind][0]
+    cur.execute(
+        "INSERT INTO upload_index (path, kind, size_bytes, user_id, owner_table, owner_id) VALUES (%s, %s, %s, %s, %s, %s) "
+        "ON DUPLICATE KEY UPDATE size_bytes = VALUES(size_bytes), user_id = VALUES(user_id), owner_id = VALUES(owner_id)",
+        (rel_path, kind, size, user_id, owner_table, owner_id))
+    return size
+
+
+def user_usage(cur, user_id):
+    cur.execute("SELECT COALESCE(SUM(size_bytes), 0) AS used, COUNT(*) AS files FROM upload_index WHERE user_id = %s", (user_id,))
+    row = cur.fetchone()
+    return int(row['used']), int(row['files'])
+
+def check_quota(cur, user_id, incoming_bytes, quota_bytes):
+    # Returns (allowed, used_bytes). Anonymous uploads (rescue reports) have no per-user quota.
+    if user_id is None or not quota_bytes: return True, 0
+    used, _ = user_usage(cur, user_id)
+    return used + incoming_bytes <= quota_bytes, used
+
+def usage_by_kind(cur):
+    cur.execute("SELECT kind, COUNT(*) AS files, COALESCE(SUM(size_bytes), 0) AS bytes FROM upload_index GROUP BY kind")
+    return {row['kind']: {'files': int(row['files']), 'bytes': int(row['bytes'])} for row in cur.fetchall()}
+
+
+def ensure_index_table(connection):
+    cur = connection.cursor()
+    try:
+        cur.execute(UPLOAD_INDEX_DDL)
+        connection.commit()
+    finally:
+        cur.close()
+
+
+def rebuild_index(connection, static_folder, batch_size=1000):
+    # Backfills upload_index from the path columns of the owning tables (files uploaded before the
+    # index existed). Safe to re-run. Returns the number of indexed files.
+    ensure_index_table(connection)
+    indexed = 0
+    for kind, (table, pk, columns, user_col) in UPLOAD_KINDS.items():
+        for column in columns:
+            last_id = 0
+            while True:
+                cur = connection.cursor()
+                try:
+                    # Keyset pagination on the primary key keeps each query bounded on big tables
+                    cur.execute(f"SELECT {pk} AS owner_id, {user_col} AS user_id, {column} AS path FROM {table} "
+                                f"WHERE {pk} > %s AND {column} IS NOT NULL ORDER BY {pk} LIMIT %s", (last_id, batch_size))
+                    rows = cur.fetchall()
+                    if not rows: break
+                    for row in rows:
+                        # Indexed under the normalised 'uploads/<kind>/...' key the sweeper looks up, also
+                        # for old rows that hold only the bare file name
+                        rel_path = static_path(row['path'], kind)
+                        full_path = os.path.join(static_folder, rel_path)
+                        if os.path.exists(full_path):
+                            record_upload(cur, rel_path, full_path, kind, row['user_id'], row['owner_id'])
+                            indexed += 1
+                    connection.commit()
+                    last_id = rows[-1]['owner_id']
+                except Exception:
+                    connection.rollback(); raise
+                finally:
+                    cur.close()
+    return indexed
+
+
+def _load_state(state_path):
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f: return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_state(state_path, state):
+    tmp_path = state_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(state, f)
+    os.replace(tmp_path, state_path)
+
+
+def _iter_files(folder, after='', prefix=''):
+    # Yields (relative name, DirEntry) for every file below folder whose name sorts after the `after`
+    # cursor, in name order, using os.scandir (no stat() per entry unless the sweeper needs it).
+    # Directories that sort entirely before the cursor are skipped without being opened, so resuming
+    # from a cursor costs one listing per level, not a walk of everything before it.
+    try:
+        with os.scandir(folder) as it:
+            entries = [(e.name + '/' if e.is_dir(follow_symlinks=False) else e.name, e) for e in it]
+    except FileNotFoundError:
+        return
+    entries.sort(key=lambda x: x[0]) # 'ab/' sorts as its children's paths do, e.g. after 'ab.jpg'
+    for name, entry in entries:
+        if name.endswith('/'):
+            sub_prefix = prefix + name
+            if sub_prefix < after and not after.startswith(sub_prefix): continue
+            yield from _iter_files(entry.path, after, sub_prefix)
+        elif prefix + name > after and entry.is_file(follow_symlinks=False):
+            yield prefix + name, entry
+
+
+def _next_batch(folder, after, batch_size):
+    # The next batch_size files (by name) after the saved cursor. The walk is in name order and stops
+    # as soon as the batch is full, so a batch reads only the directories it returns files from.
+    return list(itertools.islice(_iter_files(folder, after), batch_size))
+
+
+def _find_orphans(cur, kind, rel_paths):
+    # Returns the subset of rel_paths that is orphaned (not indexed, or indexed but owner row deleted)
+    table, pk, _, _ = UPLOAD_KINDS[kind]
+    placeholders = ", ".join(["%s"] * len(rel_paths))
+    cur.execute(f"SELECT path, owner_id FROM upload_index WHERE path IN ({placeholders})", tuple(rel_paths))
+    indexed = {row['path']: row['owner_id'] for row in cur.fetchall()}
+    owner_ids = {oid for oid in indexed.values() if oid is not None}
+    live_ids = set()
+    if owner_ids:
+        id_placeholders = ", ".join(["%s"] * len(owner_ids))
+        cur.execute(f"SELECT {pk} AS owner_id FROM {table} WHERE {pk} IN ({id_placeholders})", tuple(owner_ids))
+        live_ids = {row['owner_id'] for row in cur.fetchall()}
+    return [p for p in rel_paths if p not in indexed or (indexed[p] is not None and indexed[p] not in live_ids)]
+
+
+def sweep_orphans(connection, uploads_root, state_path, batch_size=DEFAULT_SWEEP_BATCH,
+                  grace_seconds=DEFAULT_SWEEP_GRACE_SECONDS, dry_run=False):
+    # Processes ONE bounded batch per upload kind, continuing from where the last call stopped
+    # (wrapping round once a folder is exhausted). Returns {'scanned', 'removed', 'bytes_freed', 'orphans'}.
+    state = _load_state(state_path)
+    if not state.get('index_built'):
+        raise RuntimeError("upload_index has not been built yet; run `flask rebuild-upload-index` first.")
+    cutoff = time.time() - grace_seconds
+    result = {'scanned': 0, 'removed': 0, 'bytes_freed': 0, 'orphans': []}
+    cursors = state.setdefault('cursors', {})
+
+    for kind in UPLOAD_KINDS:
+        folder = os.path.join(uploads_root, kind)
+        batch = _next_batch(folder, cursors.get(kind, ''), batch_size)
+        if not batch:
+            cursors[kind] = '' # Folder exhausted: start the next pass from the beginning
+            continue
+        result['scanned'] += len(batch)
+        candidates = {}
+        for name, entry in batch:
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            if st.st_mtime < cutoff:
+                candidates[f"uploads/{kind}/{name}"] = (entry.path, st.st_size)
+
+        cur = None
+        try:
+            if candidates:
+                cur = connection.cursor()
+                orphans = _find_orphans(cur, kind, list(candidates))
+                for rel_path in orphans:
+                    full_path, size = candidates[rel_path]
+                    result['orphans'].append(rel_path)
+                    if dry_run: continue
+                    try:
+                        os.remove(full_path)
+                    except FileNotFoundError:
+                        pass
+                    except OSError as e:
+                        print(f"Error removing orphan upload {full_path}: {e}"); continue
+                    cur.execute("DELETE FROM upload_index WHERE path = %s", (rel_path,))
+                    result['removed'] += 1; result['bytes_freed'] += size
+                connection.commit()
+        except Exception as e:
+            connection.rollback()
+            print(f"!!! DB Error (Upload Sweep, {kind}): {e}"); traceback.print_exc()
+            raise
+        finally:
+            if cur: cur.close()
+        cursors[kind] = batch[-1][0]
+
+    if not dry_run: _save_state(state_path, state)
+    return result
+
+
+def mark_index_built(state_path):
+    state = _load_state(state_path)
+    state['index_built'] = True
+    _save_state(state_path, state)
+
+
+def _link_or_copy(src, dst):
+    # Hard link so the file is reachable under both paths until the row update commits; copy when
+    # the shard directory is on another filesystem.
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        pass
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def migrate_to_shards(connection, static_folder, batch_size=500, dry_run=False):
+    # Moves files saved with the flat layout into their shard directory without downtime:
+    #   1. link the file into its new location (old URL keeps working),
+    #   2. rewrite the path column (compare-and-set on the old value, row by row) and, for the rows
+    #      that matched, re-key their upload_index entry, all in one transaction,
+    #   3. only after commit, unlink the old paths of the rows that matched.
+    # A row that changed since the SELECT keeps its file where it is; its new link is removed again.
+    # A crash between 2 and 3 leaves an unreferenced old file that sweep_orphans() will collect.
+    # Returns {'moved', 'missing', 'already_sharded', 'changed'}.
+    if not dry_run: ensure_index_table(connection)
+    result = {'moved': 0, 'missing': 0, 'already_sharded': 0, 'changed': 0}
+    for kind, (table, pk, columns, user_col) in UPLOAD_KINDS.items():
+        for column in columns:
+            last_id = 0
+            while True:
+                cur = connection.cursor()
+                created = set(); kept = set(); old_files = []
+                try:
+                    cur.execute(f"SELECT {pk} AS owner_id, {user_col} AS user_id, {column} AS path FROM {table} "
+                                f"WHERE {pk} > %s AND {column} IS NOT NULL ORDER BY {pk} LIMIT %s", (last_id, batch_size))
+                    rows = cur.fetchall()
+                    if not rows: break
+                    last_id = rows[-1]['owner_id']
+                    moves = []
+                    for row in rows:
+                        old_rel = row['path']
+                        if SHARDED_PATH_RE.match(old_rel.replace("\\", "/")):
+                            result['already_sharded'] += 1; continue
+                        filename = os.path.basename(old_rel.replace("\\", "/"))
+                        old_full = os.path.join(static_folder, static_path(old_rel, kind))
+                        directory, new_full, new_rel = sharded_upload_paths(os.path.join(static_folder, 'uploads', kind), kind, filename)
+                        if not os.path.exists(old_full) and not os.path.exists(new_full):
+                            result['missing'] += 1; continue
+                        if not dry_run and os.path.exists(old_full):
+                            if not ensure_dir(directory): raise OSError(f"Could not create shard directory {directory}")
+                            if not os.path.exists(new_full): created.add(new_full)
+                            _link_or_copy(old_full, new_full)
+                        moves.append((row, old_rel, old_full, new_rel, new_full))
+                    if dry_run or not moves:
+                        result['moved'] += len(moves); continue
+                    moved = 0
+                    for row, old_rel, old_full, new_rel, new_full in moves:
+                        cur.execute(f"UPDATE {table} SET {column} = %s WHERE {pk} = %s AND {column} = %s", (new_rel, row['owner_id'], old_rel))
+                        if cur.rowcount != 1: # Changed or deleted since the SELECT: leave its file alone
+                            result['changed'] += 1; continue
+                        # The index is keyed on the normalised path (as rebuild_index() writes it), not the raw
+                        # column value. Re-keyed as delete + upsert so an unindexed file gets indexed too:
+                        # the link keeps the old mtime, so the sweeper would otherwise take it at once.
+                        cur.execute("DELETE FROM upload_index WHERE path = %s", (static_path(old_rel, kind),))
+                        record_upload(cur, new_rel, new_full, kind, row['user_id'], row['owner_id'])
+                        kept.add(new_full)
+                        if os.path.exists(old_full) and os.path.abspath(old_full) != os.path.abspath(new_full): old_files.append(old_full)
+                        moved += 1
+                    connection.commit()
+                    result['moved'] += moved
+                except Exception as e:
+                    connection.rollback()
+                    print(f"!!! Error migrating {table}.{column} to sharded layout: {e}"); traceback.print_exc()
+                    kept = set() # Nothing committed: every new link goes, the old files stay referenced
+                    raise
+                finally:
+                    cur.close()
+                    for path in created - kept: # Links for rows that didn't move (all of them after an error)
+                        try: os.remove(path)
+                        except OSError: pass
+                for path in old_files:
+                    try: os.remove(path)
+                    except OSError as e: print(f"Error removing migrated upload {path}: {e}")
+    return result
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# Shared fixtures. Tests run without a MySQL server: routes that need the database get a
+# FakeConnection whose statements are answered by a per-test handler.
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import MySQLdb # noqa: E402
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.rowcount = 0
+        self.lastrowid = None
+        self.description = None
+        self._rows = []
+
+    def execute(self, sql, args=None):
+        self.connection.statements.append((' '.join(sql.split()), args))
+        self._rows = list(self.connection.handler(' '.join(sql.split()), args) or [])
+        self.rowcount = len(self._rows)
+        if sql.lstrip().upper().startswith('INSERT'):
+            self.connection.last_insert_id += 1; self.lastrowid = self.connection.last_insert_id; self.rowcount = 1
+
+    def executemany(self, sql, seq_of_args):
+        for args in seq_of_args: self.execute(sql, args)
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    # Stands in for the request's MySQL connection. handler(sql, args) returns the result rows
+    # (dicts) of each statement, or raises to simulate a MySQL error.
+    Error = MySQLdb.Error
+    IntegrityError = MySQLdb.IntegrityError
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.statements = []
+        self.last_insert_id = 0
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self, cursorclass=None):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        pass
+
+
+@pytest.fixture(scope='session')
+def flask_app(tmp_path_factory):
+    import app as app_module
+    state = tmp_path_factory.mktemp('instance')
+    return app_module.create_app({
+        'TESTING': True, 'WARM_TEMPLATES': False, 'RATE_LIMITS': {},
+        'RATE_LIMIT_STORE': str(state / 'ratelimit.bin'),
+        'IDEMPOTENCY_STORE': str(state / 'idempotency.sqlite3'),
+        'JINJA_BYTECODE_CACHE': str(state / 'jinja_cache'),
+        'AUDIT_SEGMENT_DIR': str(state / 'audit'),
+        'CATALOGUE_SNAPSHOT': str(state / 'catalogue.snap'),
+        'RECOMMEND_SNAPSHOT': str(state / 'recommend.npz'),
+    })
+
+
+@pytest.fixture
+def client(flask_app):
+    return flask_app.test_client()
+
+
+@pytest.fixture
+def use_db(monkeypatch):
+    # use_db(handler) routes mysql.connection to a FakeConnection for this test and returns it
+    import query_profiler
+
+    def install(handler):
+        connection = FakeConnection(handler)
+        monkeypatch.setattr(query_profiler.ProfiledMySQL, 'connection', property(lambda self: connection))
+        return connection
+    return install
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# Both entry points must serve: the factory (gunicorn 'app:create_app()') and the bare module-level
+# app (gunicorn app:app, flask --app app), which initialises itself on first use.
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BARE_APP = """
+import app as app_module
+assert not app_module.app.extensions.get('animalcarehub')
+response = app_module.app.test_client().get('/')
+assert response.status_code == 200, response.status_code
+assert app_module.app.extensions.get('animalcarehub')
+response = app_module.app.test_client().get('/')
+assert response.status_code == 200, response.status_code
+print('ok')
+"""
+
+
+def run(code, tmp_path):
+    env = dict(os.environ, JINJA_BYTECODE_CACHE=str(tmp_path / 'jinja_cache'), RATE_LIMIT_STORE=str(tmp_path / 'ratelimit.bin'),
+               IDEMPOTENCY_STORE=str(tmp_path / 'idempotency.sqlite3'))
+    return subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, capture_output=True, text=True, timeout=60)
+
+
+def test_bare_module_app_initialises_on_first_request(tmp_path):
+    result = run(BARE_APP, tmp_path)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().endswith('ok')
+
+
+def test_flask_cli_without_factory(tmp_path):
+    code = "from flask.cli import main; import sys; sys.argv = ['flask', '--app', 'app', 'routes']; main()"
+    result = run(code, tmp_path)
+    assert result.returncode == 0, result.stderr
+    assert 'api_animals' in result.stdout
+
+
+def test_factory_returns_initialised_app(flask_app):
+    assert flask_app.extensions.get('animalcarehub')
+    assert flask_app.test_client().get('/').status_code == 200
+
+
+def test_factory_overrides_apply_after_first_app_context(flask_app, tmp_path):
+    import app as app_module
+    original = {key: flask_app.config[key] for key in ('IDEMPOTENCY_STORE', 'RATE_LIMIT_STORE')}
+    with flask_app.app_context(): pass
+    try:
+        app_module.create_app({'IDEMPOTENCY_STORE': str(tmp_path / 'keys.sqlite3'), 'RATE_LIMIT_STORE': str(tmp_path / 'limits.bin')})
+        assert app_module.idempotency_store.path == str(tmp_path / 'keys.sqlite3')
+        assert app_module.limiter.path == str(tmp_path / 'limits.bin')
+        app_module.idempotency_store.begin('override-check')
+        assert os.path.exists(tmp_path / 'keys.sqlite3')
+    finally:
+        app_module.create_app(original)
+    assert app_module.idempotency_store.path == original['IDEMPOTENCY_STORE']
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import time
+import zipfile
+
+import pytest
+from PIL import Image
+
+import app as app_module
+import bulk_import
+from conftest import FakeConnection
+
+
+def jpeg_with_gps():
+    exif = Image.Exif()
+    exif.get_ifd(0x8825)[2] = (12.0, 58.0, 17.5) # GPSLatitude
+    buf = io.BytesIO()
+    Image.new('RGB', (64, 48), 'orange').save(buf, 'JPEG', exif=exif.tobytes())
+    return buf.getvalue()
+
+
+def upload_index_db(used=0):
+    def handler(sql, args):
+        if 'FROM upload_index WHERE user_id' in sql: return [{'used': used, 'files': 0}]
+        return []
+    return FakeConnection(handler)
+
+
+@pytest.fixture
+def folders(flask_app, tmp_path, monkeypatch):
+    monkeypatch.setitem(flask_app.config, 'IMPORT_FOLDER', str(tmp_path / 'imports'))
+    monkeypatch.setitem(flask_app.config, 'UPLOAD_FOLDER_ANIMALS', str(tmp_path / 'animals'))
+    return tmp_path
+
+
+def wait_for(client, status_url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = client.get(status_url).get_json()
+        if status['state'] != 'running': return status
+        time.sleep(0.05)
+    raise AssertionError("import did not finish")
+
+
+def test_http_import_runs_in_the_background_through_the_sanitiser(client, folders, monkeypatch):
+    connection = upload_index_db()
+    monkeypatch.setattr(app_module.db_router, 'open_primary_connection', lambda: connection)
+    with client.session_transaction() as session: session['user_id'] = 12
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as zf:
+        zf.writestr('bruno.jpg', jpeg_with_gps()); zf.writestr('broken.jpg', b'\xff\xd8\xff' + b'\0' * 64)
+    manifest = b"name,type,age,description,image\nBruno,Dog,2,Friendly,bruno.jpg\nBroken,Cat,1,Shy,broken.jpg\n"
+    response = client.post('/import_animals', data={'manifest': (io.BytesIO(manifest), 'animals.csv'),
+                                                     'images': (io.BytesIO(archive.getvalue()), 'photos.zip')})
+    assert response.status_code == 202
+    status = wait_for(client, response.get_json()['status_url'])
+    assert (status['state'], status['imported'], status['failed']) == ('completed', 1, 1)
+    assert status['errors'][0]['row'] == 2 and 'rejected' in status['errors'][0]['message']
+    [(_, args)] = [(sql, args) for sql, args in connection.statements if sql.startswith('INSERT INTO animals')]
+    stored = os.path.join(str(folders), 'animals', *args[5].split('/')[2:])
+    with Image.open(stored) as image:
+        assert not image.getexif()
+    assert not [name for _, _, names in os.walk(folders / 'animals') for name in names if name.endswith('.upload')]
+
+
+def test_import_status_is_private(client, folders):
+    with client.session_transaction() as session: session['user_id'] = 12
+    assert client.get('/import_animals/13_0123456789abcdef').status_code == 404
+    assert client.get('/import_animals/12_../../etc').status_code == 404
+
+
+def test_imported_images_count_towards_the_quota(tmp_path):
+    images = tmp_path / 'images'; images.mkdir()
+    for name in ('a.jpg', 'b.jpg'): (images / name).write_bytes(b'\0' * 60)
+    manifest = tmp_path / 'animals.csv'
+    manifest.write_text("name,type,age,description,image\nA,Dog,2,Friendly,a.jpg\nB,Dog,2,Friendly,b.jpg\nC,Dog,2,Friendly,\n")
+    connection = upload_index_db(used=30)
+    summary = bulk_import.run_import(connection, str(manifest), 12, str(tmp_path / 'animals'), images_path=str(images), quota_bytes=100)
+    assert (summary['imported'], summary['failed']) == (2, 1) # b.jpg would take the user to 150 bytes
+    assert summary['errors'] == [{'row': 2, 'message': 'Upload storage limit reached; image not stored.'}]
+    assert len([name for _, _, names in os.walk(tmp_path / 'animals') for name in names]) == 1
+
+
+def test_busy_sanitiser_fails_the_row_after_the_wait_cap(flask_app, tmp_path, monkeypatch):
+    def busy(src_path, dest_path): raise app_module.image_sanitiser.SanitiserBusy(1)
+    monkeypatch.setattr(app_module.sanitiser, 'save_file', busy)
+    monkeypatch.setitem(flask_app.config, 'IMPORT_SANITISER_WAIT_SECONDS', 0.05)
+    started = time.monotonic()
+    with pytest.raises(RuntimeError, match='image queue stayed busy'):
+        app_module.sanitise_import_image(str(tmp_path / 'in.jpg'), str(tmp_path / 'out.jpg'))
+    assert time.monotonic() - started < 1
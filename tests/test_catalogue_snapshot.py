@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import os
+from datetime import datetime, timedelta
+
+import catalogue_snapshot
+
+START = datetime(2024, 3, 1, 9, 30, 0, 123456)
+
+
+def animals(count):
+    # Listing order (date_posted DESC, animal_id DESC), with pairs posted in the same microsecond
+    rows = [(i, f"Animal {i} ✓", 'Dog' if i % 2 else 'Cat', None if i % 5 == 0 else i / 2, f"Notes {i}",
+             f"uploads/animals/a{i}.jpg" if i % 3 else None, START + timedelta(seconds=i // 2)) for i in range(1, count + 1)]
+    return sorted(rows, key=lambda r: (r[6], r[0]), reverse=True)
+
+
+def as_tuple(row):
+    return (row.animal_id, row.name, row.type, row.age, row.description, row.image_filename, row.date_posted)
+
+
+def test_round_trip_pages_through_every_animal_in_order(tmp_path):
+    path = str(tmp_path / 'catalogue.snap')
+    expected = animals(53)
+    assert catalogue_snapshot.write_snapshot(path, expected, now=1000.0) == 53
+    snapshot = catalogue_snapshot.CatalogueSnapshot(path)
+    mapping = snapshot.current()
+    assert mapping.created_at == 1000.0
+    seen, cursor = [], None
+    while True:
+        page, cursor = snapshot.page(mapping, cursor, limit=10)
+        assert all(row.status == 'Available' for row in page)
+        seen.extend(as_tuple(row) for row in page)
+        if cursor is None: break
+    assert seen == expected
+    assert [row.animal_id for row in snapshot.get_many(mapping, [7, 999, 2])] == [7, 2]
+
+
+def test_rewritten_snapshot_is_picked_up(tmp_path):
+    path = str(tmp_path / 'catalogue.snap')
+    catalogue_snapshot.write_snapshot(path, animals(3))
+    snapshot = catalogue_snapshot.CatalogueSnapshot(path)
+    old = snapshot.current()
+    catalogue_snapshot.write_snapshot(path, animals(5))
+    new = snapshot.current()
+    assert new is not old and len(new.index) == 5
+    assert [row.animal_id for row in snapshot.page(old, limit=10)[0]] == [3, 2, 1] # Pages in progress still read
+
+
+def test_missing_or_corrupt_snapshot_reads_as_none(tmp_path):
+    path = str(tmp_path / 'catalogue.snap')
+    snapshot = catalogue_snapshot.CatalogueSnapshot(path)
+    assert snapshot.current() is None
+    with open(path, 'wb') as f: f.write(b'not a snapshot' * 10)
+    assert snapshot.current() is None
+    assert snapshot.needs_refresh(now=os.path.getmtime(path) + snapshot.refresh_seconds + 1)
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import circuit_breaker
+
+
+def test_one_prober_per_worker_after_fork(monkeypatch):
+    breaker = circuit_breaker.CircuitBreaker('test', failure_threshold=1)
+    started = []
+    def start_prober():
+        started.append(1); time.sleep(0.05) # Other requests arrive while the thread is being started
+        breaker._prober_pid = 'this worker'
+    monkeypatch.setattr(breaker, '_start_prober', start_prober)
+    breaker._opened_at = 1.0; breaker._prober_pid = 'parent' # As inherited from the process that opened it
+    monkeypatch.setattr(circuit_breaker.os, 'getpid', lambda: 'this worker')
+    barrier = threading.Barrier(16)
+    threads = [threading.Thread(target=lambda: (barrier.wait(), breaker.allow())) for _ in range(16)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    assert started == [1]
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition(): return True
+        time.sleep(0.01)
+    return False
+
+
+def test_opens_after_consecutive_failures_and_closes_once_a_probe_succeeds():
+    breaker = circuit_breaker.CircuitBreaker('test', failure_threshold=3, probe_seconds=0.01, slow_seconds=1.0)
+    probes = []
+    def probe():
+        probes.append(1)
+        if len(probes) < 3: raise OSError("still down")
+    breaker.probe = probe
+    breaker.record_failure(); breaker.record_failure()
+    breaker.record_success(0.01) # A success in between resets the count
+    breaker.record_failure(); breaker.record_failure()
+    assert breaker.allow() and not breaker.is_open
+    breaker.record_success(1.5) # Too slow: counts as the third failure
+    assert breaker.is_open and not breaker.allow()
+    assert wait_until(lambda: not breaker.is_open)
+    assert len(probes) == 3 # Failed probes kept it open
+    assert breaker.allow() and breaker.status()['consecutive_failures'] == 0
+
+
+def test_slow_probe_keeps_the_breaker_open():
+    breaker = circuit_breaker.CircuitBreaker('test', failure_threshold=1, probe_seconds=0.01, slow_seconds=0.05)
+    probes = []
+    breaker.probe = lambda: (probes.append(1), time.sleep(0.06 if len(probes) < 2 else 0))
+    breaker.record_failure()
+    assert wait_until(lambda: not breaker.is_open)
+    assert len(probes) == 2
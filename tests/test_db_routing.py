@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+import app as app_module
+import db_routing
+
+
+def test_connect_timeout_comes_from_config(flask_app, monkeypatch):
+    timeouts = []
+    def connect(**kwargs):
+        timeouts.append(kwargs['connect_timeout']); raise db_routing.MySQLdb.OperationalError(2003, "Can't connect")
+    monkeypatch.setattr(db_routing.MySQLdb, 'connect', connect)
+    monkeypatch.setitem(flask_app.config, 'MYSQL_CONNECT_TIMEOUT', 1)
+    router = app_module.db_router
+    try: router.open_primary_connection()
+    except db_routing.MySQLdb.OperationalError: pass
+    with flask_app.app_context():
+        assert router._replica_connection(('replica.invalid', 3306)) is None
+    router._health.clear()
+    assert timeouts == [1, 1]
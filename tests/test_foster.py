@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import MySQLdb
+import pytest
+
+import matching
+
+FORM = {
+    'foster_name': 'Asha Rao', 'foster_email': 'asha@example.com', 'foster_phone': '98450 00000',
+    'foster_address': '12 MG Road, Bengaluru', 'foster_home_type': 'House', 'foster_has_yard': 'Yes',
+    'foster_yard_fenced': 'Yes', 'foster_can_transport': 'Yes', 'foster_preferred_animal': ['Dogs'],
+    'foster_availability': 'Weekends', 'foster_why': 'We have room and time.',
+}
+
+
+@pytest.fixture(autouse=True)
+def fresh_schema_cache(monkeypatch):
+    monkeypatch.setattr(matching, '_schema_checks', {})
+
+
+def fosters_table(has_availability):
+    def handler(sql, args):
+        if 'information_schema.columns' in sql:
+            return [{'name': 'availability'}] if has_availability else []
+        if sql.startswith('INSERT INTO fosters') and 'availability' in sql and not has_availability:
+            raise MySQLdb.OperationalError(1054, "Unknown column 'availability' in 'field list'")
+        return []
+    return handler
+
+
+def inserts(connection):
+    return [(sql, args) for sql, args in connection.statements if sql.startswith('INSERT INTO fosters')]
+
+
+def test_foster_application_before_init_matching(client, use_db):
+    connection = use_db(fosters_table(has_availability=False))
+    response = client.post('/foster', data=FORM)
+    assert response.status_code == 302 # Redirect after success, not the error page
+    [(sql, args)] = inserts(connection)
+    assert 'availability' not in sql and 'Weekends' not in args
+    assert connection.commits == 1
+
+
+def test_foster_application_stores_availability_once_migrated(client, use_db):
+    connection = use_db(fosters_table(has_availability=True))
+    response = client.post('/foster', data=FORM)
+    assert response.status_code == 302
+    [(sql, args)] = inserts(connection)
+    assert 'availability' in sql and 'Weekends' in args
+
+
+def test_schema_is_rechecked_after_migration(use_db):
+    present = {'value': False}
+    connection = use_db(lambda sql, args: [{'name': 'availability'}] if present['value'] else [])
+    cur = connection.cursor()
+    assert matching.present_columns(cur, 'foster', now=1000) == frozenset()
+    present['value'] = True
+    assert matching.present_columns(cur, 'foster', now=1001) == frozenset() # Cached
+    assert matching.present_columns(cur, 'foster', now=1000 + matching.SCHEMA_RECHECK_SECONDS) == {'availability'}
+
+
+@pytest.fixture
+def fresh_primary_keys(monkeypatch):
+    monkeypatch.setattr(matching, '_primary_keys', {})
+
+
+def test_applications_are_loaded_by_the_tables_primary_key(use_db, fresh_primary_keys):
+    def handler(sql, args):
+        if "column_key = 'PRI'" in sql: return [{'name': 'id'}]
+        if 'information_schema.columns' in sql: return [{'name': 'availability'}]
+        if sql.startswith('SELECT id AS application_id'): return [{'application_id': 7, 'name': 'Asha Rao', 'status': 'Pending'}]
+        return []
+    cur = use_db(handler).cursor()
+    rows = matching.load_applications(cur, 'foster')
+    index = matching.MatchIndex('foster')
+    index.rebuild(rows)
+    entries, total = index.find()
+    assert [entry['id'] for entry in entries] == [7]
+
+
+def test_init_matching_fails_clearly_without_a_single_primary_key(flask_app, use_db, fresh_primary_keys):
+    use_db(lambda sql, args: [{'name': 'email'}, {'name': 'phone'}] if "column_key = 'PRI'" in sql else [])
+    result = flask_app.test_cli_runner().invoke(args=['init-matching'])
+    assert result.exit_code != 0
+    assert 'single-column primary key' in result.output and 'email, phone' in result.output
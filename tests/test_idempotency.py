@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+import time
+import uuid
+
+import pytest
+
+import app as app_module
+import idempotency
+
+
+@pytest.fixture
+def behind_proxy(monkeypatch):
+    monkeypatch.setattr(app_module.proxy_fix, 'x_for', 1)
+
+
+def post_contact(client, forwarded_for, key):
+    return client.post('/contact', data={}, headers={'X-Forwarded-For': forwarded_for, 'Idempotency-Key': key},
+                       environ_base={'REMOTE_ADDR': '10.0.0.2'})
+
+
+def test_anonymous_keys_are_scoped_to_the_forwarded_client(client, behind_proxy):
+    key = uuid.uuid4().hex
+    assert 'Idempotent-Replayed' not in post_contact(client, '203.0.113.7', key).headers
+    assert 'Idempotent-Replayed' not in post_contact(client, '203.0.113.8', key).headers # Another visitor
+    assert post_contact(client, '203.0.113.7', key).headers['Idempotent-Replayed'] == 'true'
+
+
+def test_repeat_of_a_running_submission_is_answered_at_once(client):
+    key = uuid.uuid4().hex
+    assert app_module.idempotency_store.begin(f"/contact|ip:127.0.0.1|{key}") is None # First click still running
+    started = time.perf_counter()
+    response = client.post('/contact', data={}, headers={'Idempotency-Key': key})
+    assert time.perf_counter() - started < 0.5
+    assert response.status_code == 409 and response.headers['Retry-After'] == '1'
+
+
+def test_pending_key_of_a_killed_request_is_taken_over_after_its_lease(tmp_path):
+    store = idempotency.IdempotencyStore(str(tmp_path / 'keys.sqlite3'), pending_lease_seconds=120)
+    assert store.begin('k', now=1000.0) is None # Its worker dies before after_request/teardown
+    assert store.begin('k', now=1060.0) == 'pending' # Could still be running
+    assert store.begin('k', now=1121.0) is None # Lease over: this retry owns the key now
+    assert store.begin('k', now=1122.0) == 'pending' # ...with a fresh lease
+    store.complete('k', 200, {}, b'saved')
+    assert store.begin('k', now=1000.0 + 23 * 3600) == (200, {}, b'saved')
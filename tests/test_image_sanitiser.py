@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import struct
+import zlib
+
+import pytest
+from PIL import Image, PngImagePlugin
+
+import image_sanitiser
+
+
+@pytest.fixture
+def sanitiser():
+    sanitiser = image_sanitiser.ImageSanitiser(workers=1)
+    yield sanitiser
+    sanitiser.shutdown()
+
+
+def noisy_jpeg(path, size):
+    Image.effect_noise(size, 80).convert('RGB').save(path, 'JPEG', quality=95)
+    return str(path)
+
+
+def test_sanitised_file_appears_only_under_its_final_name(sanitiser, tmp_path):
+    src = noisy_jpeg(tmp_path / 'src.jpg', (64, 64))
+    assert sanitiser.sanitise(src, str(tmp_path / 'out.jpg'), 'JPEG') == (64, 64)
+    assert sorted(os.listdir(tmp_path)) == ['out.jpg', 'src.jpg']
+
+
+def test_timed_out_task_never_writes_the_destination(sanitiser, tmp_path):
+    src = noisy_jpeg(tmp_path / 'src.jpg', (3000, 3000))
+    sanitiser.sanitise(src, str(tmp_path / 'warmup.jpg'), 'JPEG') # The pool is up, so the timeout hits the decode
+    os.remove(tmp_path / 'warmup.jpg')
+    sanitiser.timeout_seconds = 0.001
+    with pytest.raises(image_sanitiser.RejectedUpload, match='too long'):
+        sanitiser.sanitise(src, str(tmp_path / 'out.jpg'), 'JPEG')
+    sanitiser.shutdown() # Lets the abandoned task finish
+    assert os.listdir(tmp_path) == ['src.jpg']
+
+
+@pytest.fixture(autouse=True)
+def restore_pixel_limit(monkeypatch):
+    # sanitise_file() sets Pillow's global limit, as it does in the pool processes
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', Image.MAX_IMAGE_PIXELS)
+
+
+def phone_photo(path):
+    # 40x20 landscape pixels, tagged as needing a 90 degree turn, with camera and GPS metadata
+    exif = Image.Exif()
+    exif[0x0112] = 6; exif[0x010f] = 'PhoneCo'
+    gps = exif.get_ifd(0x8825)
+    gps[1] = 'N'; gps[2] = (12.0, 58.0, 17.5); gps[3] = 'E'; gps[4] = (77.0, 35.0, 40.2)
+    Image.new('RGB', (40, 20), 'teal').save(path, 'JPEG', exif=exif.tobytes(), comment=b'taken at home')
+    return str(path)
+
+
+def test_jpeg_metadata_is_stripped_and_orientation_applied(tmp_path):
+    out = str(tmp_path / 'out.jpg')
+    assert image_sanitiser.sanitise_file(phone_photo(tmp_path / 'src.jpg'), out, 'JPEG') == (20, 40)
+    with Image.open(out) as image:
+        assert image.size == (20, 40)
+        assert not image.getexif() and not image.getexif().get_ifd(0x8825)
+        assert 'exif' not in image.info and 'comment' not in image.info
+
+
+def test_png_text_chunks_are_stripped(tmp_path):
+    info = PngImagePlugin.PngInfo(); info.add_text('Location', '12.97N 77.59E')
+    Image.new('RGB', (8, 8), 'red').save(tmp_path / 'src.png', 'PNG', pnginfo=info)
+    image_sanitiser.sanitise_file(str(tmp_path / 'src.png'), str(tmp_path / 'out.png'), 'PNG')
+    with Image.open(tmp_path / 'out.png') as image:
+        assert 'Location' not in image.info
+
+
+def test_corrupt_image_is_rejected(tmp_path):
+    data = open(phone_photo(tmp_path / 'src.jpg'), 'rb').read()
+    (tmp_path / 'cut.jpg').write_bytes(data[:len(data) // 2])
+    with pytest.raises(image_sanitiser.RejectedUpload, match='could not be read'):
+        image_sanitiser.sanitise_file(str(tmp_path / 'cut.jpg'), str(tmp_path / 'out.jpg'), 'JPEG')
+    assert not os.path.exists(tmp_path / 'out.jpg')
+
+
+def png_claiming(width, height):
+    # A few hundred bytes that declare a width x height image: decoding it would allocate the lot
+    def chunk(kind, data): return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(b'\0' * 1024)) + chunk(b'IEND', b''))
+
+
+@pytest.mark.parametrize('width, height', [(2100, 2000), (100000, 100000)]) # Just over max_pixels; 10 gigapixels
+def test_oversized_and_decompression_bomb_images_are_rejected(tmp_path, width, height):
+    (tmp_path / 'bomb.png').write_bytes(png_claiming(width, height))
+    with pytest.raises(image_sanitiser.RejectedUpload, match='too large'):
+        image_sanitiser.sanitise_file(str(tmp_path / 'bomb.png'), str(tmp_path / 'out.png'), 'PNG', max_pixels=4_000_000)
+    assert not os.path.exists(tmp_path / 'out.png')
+
+
+def test_content_must_match_the_extension():
+    png_head = png_claiming(1, 1)[:image_sanitiser.SNIFF_BYTES]
+    assert image_sanitiser.expected_format('cat.png', png_head) == ('PNG', 'png')
+    with pytest.raises(image_sanitiser.RejectedUpload, match='not a valid JPG'):
+        image_sanitiser.expected_format('cat.jpg', png_head)
+    with pytest.raises(image_sanitiser.RejectedUpload, match='Unsupported'):
+        image_sanitiser.expected_format('cat.svg', b'<svg')
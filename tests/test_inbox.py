@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import inbox
+
+
+def cluster_flags(connection):
+    return [args[0] for sql, args in connection.statements if sql.startswith('UPDATE contact_clusters SET spam')]
+
+
+@pytest.mark.parametrize('status', ['read', 'replied', 'archived', 'new'])
+def test_status_changes_keep_the_spam_verdict(use_db, status):
+    connection = use_db(lambda sql, args: [])
+    inbox.set_cluster_status(connection.cursor(), status, 7)
+    assert cluster_flags(connection) == []
+
+
+def test_explicit_verdicts_set_the_spam_flag(use_db):
+    connection = use_db(lambda sql, args: [])
+    inbox.set_cluster_status(connection.cursor(), 'spam', 7)
+    inbox.set_cluster_status(connection.cursor(), 'read', 7, spam=False)
+    assert cluster_flags(connection) == [1, -1]
+
+
+@pytest.mark.parametrize('flag, size, expected', [(0, 2, None), (0, 5, 'spam'), (1, 2, 'spam'), (-1, 50, None)])
+def test_new_members_follow_the_cluster_verdict(use_db, flag, size, expected):
+    def handler(sql, args):
+        if sql.startswith('SELECT size, spam FROM contact_clusters'): return [{'size': size, 'spam': flag}]
+        return []
+    connection = use_db(handler)
+    _, status = inbox.index_message(connection.cursor(), 11, 'Lost beagle', 'Please help find our beagle near the park', spam_cluster_size=5)
+    assert status == expected
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+import random
+
+import pytest
+
+import matching
+
+
+def random_scores(rng, size):
+    # Builds the bit slices of a score per position the way MatchIndex.rank() does, and the plain scores
+    slices, scores = [], [0] * size
+    for _ in range(rng.randrange(1, 8)):
+        positions = [p for p in range(size) if rng.random() < 0.4]
+        weight = rng.randrange(1, 9)
+        if not positions: continue
+        matching._add_weighted(slices, matching._bitset(positions, size), weight)
+        for p in positions: scores[p] += weight
+    return slices, scores
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_top_k_matches_a_full_sort(seed):
+    rng = random.Random(seed)
+    size = rng.randrange(1, 300)
+    slices, scores = random_scores(rng, size)
+    candidate_positions = [p for p in range(size) if rng.random() < 0.7]
+    candidates = matching._bitset(candidate_positions, size)
+    for k in (1, 3, 10, size + 5):
+        top = matching._top_k(slices, candidates, k)
+        # Best score first; the newest (highest position) wins a tie, as iter_bits() orders them
+        expected = sorted(candidate_positions, key=lambda p: (scores[p], p), reverse=True)[:k]
+        assert sorted(matching.iter_bits(top)) == sorted(expected)
+        assert [matching._score_at(slices, p) for p in expected] == [scores[p] for p in expected]
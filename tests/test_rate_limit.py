@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import os
+import subprocess
+import sys
+
+import pytest
+
+import app as app_module
+import rate_limit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# One web worker: takes tokens from a shared bucket as fast as it can once the start file exists
+WORKER = """
+import os, sys, time
+import rate_limit
+store, start = sys.argv[1], sys.argv[2]
+buckets = rate_limit.SharedTokenBuckets(store, slots=1024)
+while not os.path.exists(start): time.sleep(0.001)
+print(sum(buckets.take('contact_page|ip:203.0.113.7', 50, 1e-9, now=1000.0)[0] for _ in range(200)))
+"""
+
+
+@pytest.fixture
+def contact_limit(flask_app, tmp_path, monkeypatch):
+    # One contact form per client per 5 minutes, in a fresh bucket store
+    limits = {'contact_page': rate_limit.parse_limit('1/300')}
+    monkeypatch.setitem(flask_app.config, 'RATE_LIMITS', limits)
+    monkeypatch.setattr(app_module.limiter, 'limits', limits)
+    monkeypatch.setattr(app_module.limiter, 'path', str(tmp_path / 'ratelimit.bin'))
+    monkeypatch.setattr(app_module.limiter, '_store', None)
+
+
+def post_contact(client, forwarded_for):
+    return client.post('/contact', data={}, headers={'X-Forwarded-For': forwarded_for},
+                       environ_base={'REMOTE_ADDR': '10.0.0.2'}) # Every request arrives from the proxy
+
+
+def test_clients_behind_a_trusted_proxy_get_their_own_buckets(client, contact_limit, monkeypatch):
+    monkeypatch.setattr(app_module.proxy_fix, 'x_for', 1)
+    assert post_contact(client, '203.0.113.7').status_code == 200
+    assert post_contact(client, '203.0.113.8').status_code == 200
+    assert post_contact(client, '203.0.113.7').status_code == 429
+
+
+def test_forwarded_for_is_ignored_without_trusted_proxies(client, contact_limit, monkeypatch):
+    monkeypatch.setattr(app_module.proxy_fix, 'x_for', 0)
+    assert post_contact(client, '203.0.113.7').status_code == 200
+    assert post_contact(client, '198.51.100.1').status_code == 429 # A spoofed header doesn't buy a new bucket
+
+
+@pytest.mark.skipif(rate_limit.fcntl is None, reason='shared buckets need fcntl')
+def test_shared_buckets_are_exact_across_processes(tmp_path):
+    store, start = str(tmp_path / 'ratelimit.bin'), str(tmp_path / 'start')
+    workers = [subprocess.Popen([sys.executable, '-c', WORKER, store, start], cwd=ROOT, stdout=subprocess.PIPE, text=True)
+               for _ in range(4)]
+    open(start, 'w').close()
+    allowed = [int(worker.communicate(timeout=60)[0]) for worker in workers]
+    assert sum(allowed) == 50 # 800 attempts on a 50-token bucket, no refill: no token is handed out twice
+
+
+def keys_in_one_stripe(count):
+    # Keys that all probe the same stripe (with 8 slots per stripe they also share the probe window)
+    keys = (f"ip:198.51.100.{i}" for i in range(100000))
+    return [k for k in keys if rate_limit._key_hash(k) % rate_limit.STRIPES == 0][:count]
+
+
+@pytest.mark.skipif(rate_limit.fcntl is None, reason='shared buckets need fcntl')
+def test_full_stripe_evicts_the_least_recently_used_bucket(tmp_path):
+    buckets = rate_limit.SharedTokenBuckets(str(tmp_path / 'ratelimit.bin'), slots=rate_limit.STRIPES * rate_limit.MAX_PROBES)
+    keys = keys_in_one_stripe(rate_limit.MAX_PROBES + 1)
+    for now, key in enumerate(keys[:-1], start=1):
+        assert buckets.take(key, 1, 1e-9, now=now)[0] # Uses the key's only token
+    assert buckets.take(keys[-1], 1, 1e-9, now=100)[0] # Evicts keys[0], the least recently used
+    assert buckets.take(keys[0], 1, 1e-9, now=101)[0] # Forgotten, so it starts with a full bucket again
+    assert not buckets.take(keys[2], 1, 1e-9, now=102)[0] # Still tracked (keys[1] made room for keys[0])
+    again = rate_limit.SharedTokenBuckets(str(tmp_path / 'ratelimit.bin'), slots=rate_limit.STRIPES * rate_limit.MAX_PROBES)
+    assert not again.take(keys[-1], 1, 1e-9, now=103)[0] # Another process sees the same buckets
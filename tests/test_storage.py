@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import os
+
+import app as app_module
+import storage
+
+
+def write(path, size):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f: f.write(b'\0' * size)
+    return path
+
+
+def test_rebuild_index_records_bare_file_names_under_their_static_path(tmp_path, use_db):
+    write(tmp_path / 'uploads' / 'animals' / 'old.jpg', 10)
+    def handler(sql, args):
+        if sql.startswith('SELECT animal_id') and args[0] == 0:
+            return [{'owner_id': 7, 'user_id': 3, 'path': 'old.jpg'}]
+        return []
+    connection = use_db(handler)
+    assert storage.rebuild_index(connection, str(tmp_path)) == 1
+    [(_, args)] = [(sql, args) for sql, args in connection.statements if sql.startswith('INSERT INTO upload_index')]
+    assert args[:3] == ('uploads/animals/old.jpg', 'animals', 10)
+
+
+def test_quota_is_charged_the_stored_size(flask_app, tmp_path, use_db, monkeypatch):
+    monkeypatch.setitem(flask_app.config, 'UPLOAD_QUOTA_BYTES', 100)
+    use_db(lambda sql, args: [{'used': 60, 'files': 1}] if 'FROM upload_index' in sql else [])
+    small, large = write(tmp_path / 'small.jpg', 40), write(tmp_path / 'large.jpg', 41)
+    with flask_app.app_context():
+        assert app_module.stored_quota_error(3, small) is None
+        assert os.path.exists(small)
+        assert 'limit reached' in app_module.stored_quota_error(3, large)
+    assert not os.path.exists(large) # Removed, never indexed
+
+
+class AnimalsTable:
+    # The animals table (and upload_index) as far as migrate_to_shards() touches them
+    def __init__(self, rows, changed=()):
+        self.rows = rows # animal_id -> image_filename
+        self.changed = set(changed) # Rows rewritten by someone else between the SELECT and the UPDATE
+        self.index = {}
+
+    def __call__(self, sql, args):
+        if sql.startswith('SELECT animal_id'):
+            return [{'owner_id': i, 'user_id': 3, 'path': p} for i, p in sorted(self.rows.items()) if i > args[0]][:args[1]]
+        if sql.startswith('UPDATE animals'):
+            new, animal_id, old = args
+            if animal_id in self.changed or self.rows.get(animal_id) != old: return []
+            self.rows[animal_id] = new
+            return [{}] # rowcount 1
+        if sql.startswith('DELETE FROM upload_index'):
+            self.index.pop(args[0], None)
+        if sql.startswith('INSERT INTO upload_index'):
+            self.index[args[0]] = args[2]
+        return []
+
+
+def flat_upload(static, name):
+    return write(static / 'uploads' / 'animals' / name, 10)
+
+
+def test_migrate_to_shards_rekeys_normalised_index_entries(tmp_path, use_db):
+    for name in ('bare.jpg', 'slashed.jpg', 'plain.jpg'): flat_upload(tmp_path, name)
+    table = AnimalsTable({1: 'bare.jpg', 2: 'uploads\\animals\\slashed.jpg', 3: 'uploads/animals/plain.jpg'})
+    table.index = {storage.static_path(p, 'animals'): 10 for p in table.rows.values()} # As rebuild_index() keys them
+    connection = use_db(table)
+    assert storage.migrate_to_shards(connection, str(tmp_path))['moved'] == 3
+    assert sorted(table.index) == sorted(table.rows.values()) # Every sharded file indexed, no stale keys
+    for rel in table.rows.values():
+        assert storage.SHARDED_PATH_RE.match(rel) and os.path.exists(tmp_path / rel)
+    assert all(os.path.isdir(tmp_path / 'uploads' / 'animals' / name) for name in os.listdir(tmp_path / 'uploads' / 'animals'))
+
+
+def test_migrate_to_shards_leaves_rows_changed_meanwhile_alone(tmp_path, use_db):
+    for name in ('moving.jpg', 'edited.jpg'): flat_upload(tmp_path, name)
+    table = AnimalsTable({1: 'uploads/animals/moving.jpg', 2: 'uploads/animals/edited.jpg'}, changed={2})
+    table.index = {'uploads/animals/moving.jpg': 10, 'uploads/animals/edited.jpg': 10}
+    connection = use_db(table)
+    result = storage.migrate_to_shards(connection, str(tmp_path))
+    assert (result['moved'], result['changed']) == (1, 1)
+    assert table.rows[2] == 'uploads/animals/edited.jpg' and 'uploads/animals/edited.jpg' in table.index
+    assert os.path.exists(tmp_path / 'uploads' / 'animals' / 'edited.jpg') # Still referenced: not unlinked
+    _, new_full, _ = storage.sharded_upload_paths(str(tmp_path / 'uploads' / 'animals'), 'animals', 'edited.jpg')
+    assert not os.path.exists(new_full) # Its new link was removed again
+    assert not os.path.exists(tmp_path / 'uploads' / 'animals' / 'moving.jpg')
+
+
+def test_sweep_batches_walk_in_name_order_and_stop_when_full(tmp_path, monkeypatch):
+    names = ['ab.jpg', 'old.png'] + [f"{a:02x}/{b:02x}/animal_{a}_{b}.jpg" for a in range(8) for b in range(8)]
+    for name in names: write(tmp_path / name, 1)
+    opened = []
+    real_scandir = os.scandir
+    monkeypatch.setattr(storage.os, 'scandir', lambda path: (opened.append(path), real_scandir(path))[1])
+    seen, cursor = [], ''
+    while True:
+        opened.clear()
+        batch = storage._next_batch(str(tmp_path), cursor, 5)
+        if not batch: break
+        # One leaf per file here, plus the cursor's leaf, the root and at most two first-level dirs
+        assert len(opened) <= 5 + 4
+        seen.extend(name for name, _ in batch); cursor = batch[-1][0]
+    assert seen == sorted(names)
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import triage
+
+CONDITIONS = ('bleeding badly', 'limping', 'looks thin', 'sitting by the road')
+
+
+@pytest.fixture(autouse=True)
+def fresh_schema_cache(monkeypatch):
+    monkeypatch.setattr(triage, '_reported_at_check', {})
+
+
+def report(rescue_id, rng, start=datetime(2024, 1, 1)):
+    condition = rng.choice(CONDITIONS)
+    return {'rescue_id': rescue_id, 'condition_details': condition, 'urgency': triage.urgency_of(condition),
+            'reported_at': start + timedelta(minutes=rng.randrange(500))}
+
+
+def brute_force(reports, limit):
+    order = sorted(reports.values(), key=lambda r: (-r['urgency'], r['reported_at'], r['rescue_id']))
+    return [r['rescue_id'] for r in order[:limit]]
+
+
+@pytest.mark.parametrize('condition, expected', [
+    ('friendly bloodhound wandering', 0), # 'blood' only as a whole word
+    ('I think it is fine', 0), # not 'thin'
+    ('not bleeding', 0), ('no sign of blood, looks thin', 1), ("doesn't look injured", 0),
+    ('not eating, bleeding', 3), ('not moving', 3), ('bleeding from the leg', 3),
+    ('two wounds and vomiting', 2), ('puppies by the road', 1),
+])
+def test_urgency_matches_whole_words_and_skips_negations(condition, expected):
+    assert triage.urgency_of(condition) == expected
+
+
+def test_top_matches_a_full_sort_through_adds_and_removals():
+    rng = random.Random(7)
+    queue = triage.TriageQueue()
+    live = {i: report(i, rng) for i in range(1, 300)}
+    queue.rebuild(live.values())
+    next_id = 300
+    for step in range(600):
+        if rng.random() < 0.5 and live:
+            rescue_id = rng.choice(list(live)); del live[rescue_id]; queue.remove(rescue_id)
+        elif rng.random() < 0.5 and live: # Re-added with new details, as after a release
+            rescue_id = rng.choice(list(live)); live[rescue_id] = report(rescue_id, rng); queue.add(live[rescue_id])
+        else:
+            live[next_id] = report(next_id, rng); queue.add(live[next_id]); next_id += 1
+        limit = rng.choice((1, 5, 20))
+        assert [r['rescue_id'] for r in queue.top(limit)] == brute_force(live, limit)
+    assert len(queue) == len(live)
+
+
+def columns_of(names):
+    def handler(sql, args):
+        if 'information_schema.columns' in sql: return [{'name': name} for name in names]
+        return []
+    return handler
+
+
+@pytest.mark.parametrize('names, expected', [
+    (['report_date'], 'report_date'), (['created_at', 'reported_at'], 'reported_at'),
+    (['logged_time'], 'logged_time'), ([], None),
+])
+def test_reported_at_column_is_looked_up(use_db, names, expected):
+    connection = use_db(columns_of(names))
+    assert triage.reported_at_column(connection.cursor()) == expected
+
+
+def test_reports_load_without_a_timestamp_column(use_db):
+    connection = use_db(columns_of([]))
+    triage.load_open_rescues(connection.cursor())
+    assert 'NULL AS reported_at FROM rescues' in connection.statements[-1][0]
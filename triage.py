@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+# Rescue triage: an in-memory priority queue of open rescue reports for responders.
+#
+# Each worker keeps its own queue, built from the DB on first use and refreshed from it every
+# TRIAGE_REFRESH_SECONDS (only open rows are loaded, via the status index). Inserts and status
+# changes made by this worker update the queue immediately. The queue is only a hint for
+# ordering: claiming is an atomic compare-and-set UPDATE on rescues.status, so two responders
+# working from slightly stale queues can never both claim the same report.
+import heapq
+import itertools
+import re
+import threading
+import time
+
+
+TRIAGE_DDL = (
+    "ALTER TABLE rescues ADD COLUMN claimed_by INT NULL",
+    "ALTER TABLE rescues ADD COLUMN claimed_at DATETIME NULL",
+    "ALTER TABLE rescues ADD INDEX idx_rescues_status (status)",
+)
+# The rescues table comes from the deployment's schema.sql, which isn't in this repo, so the name of its
+# "reported at" timestamp is looked up rather than assumed: the first of these names that exists, else
+# the table's first DATETIME/TIMESTAMP column. Without one, reports are ordered by rescue_id (the
+# AUTO_INCREMENT key, so oldest first all the same) and reported_at is null.
+REPORTED_AT_NAMES = ('report_date', 'reported_at', 'date_reported', 'reported_on', 'created_at', 'submitted_at', 'timestamp')
+SCHEMA_RECHECK_SECONDS = 60
+
+STATUS_OPEN = 'Reported'
+STATUS_CLAIMED = 'Claimed'
+STATUS_RESOLVED = 'Resolved'
+TRANSITIONS = { # action -> (from, to), as enforced by claim()/release()/resolve() below
+    'claim': (STATUS_OPEN, STATUS_CLAIMED),
+    'release': (STATUS_CLAIMED, STATUS_OPEN),
+    'resolve': (STATUS_CLAIMED, STATUS_RESOLVED),
+}
+
+# Higher is more urgent. Matched against the reporter's free-text condition details as whole words,
+# allowing plural/verb endings ('wounds', 'limped', 'vomiting') but not longer words ('bloodhound', 'think').
+URGENCY_KEYWORDS = (
+    (3, ('bleeding', 'blood', 'unconscious', 'not moving', 'hit by', 'accident', 'fracture', 'broken', 'trapped', 'drowning', 'seizure', 'poison')),
+    (2, ('injured', 'injury', 'wound', 'limping', 'can\'t walk', 'cannot walk', 'burn', 'burnt', 'sick', 'vomit', 'maggot')),
+    (1, ('thin', 'starving', 'weak', 'lost', 'abandoned', 'puppy', 'puppies', 'kitten', 'scared')),
+)
+_URGENCY_PATTERNS = tuple((level, re.compile(r'\b(?:' + '|'.join(map(re.escape, words)) + r')(?:s|es|ed|ing)?\b'))
+                          for level, words in URGENCY_KEYWORDS)
+# A keyword right after a negation ("not bleeding", "no sign of blood", "doesn't look injured") doesn't count
+_NEGATED = re.compile(r"\b(?:no|not|never|without|\w+n['’]t)(?:\s+(?:any|longer|more|sign|signs|of|visible|obvious|"
+                      r"seem|seems|look|looks|appear|appears|to|be))*\s+$")
+
+
+def urgency_of(condition_details):
+    text = (condition_details or '').lower()
+    for level, pattern in _URGENCY_PATTERNS:
+        if any(not _NEGATED.search(text, max(0, m.start() - 60), m.start()) for m in pattern.finditer(text)):
+            return level
+    return 0
+
+
+class TriageQueue:
+    # Min-heap on (-urgency, reported_at, rescue_id) with lazy deletion: removed/claimed reports are
+    # only flagged and skipped, and the heap is compacted once stale entries dominate.
+    def __init__(self, refresh_seconds=30):
+        self.refresh_seconds = refresh_seconds
+        self._heap = []
+        self._entries = {} # rescue_id -> heap entry (list so it can be flagged in place)
+        self._stale = 0
+        self._loaded_at = 0.0
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def needs_refresh(self, now=None):
+        return (now or time.time()) - self._loaded_at > self.refresh_seconds
+
+    def rebuild(self, rows, now=None):
+        heap = []; entries = {}
+        for row in rows:
+            entry = self._make_entry(row)
+            heap.append(entry); entries[row['rescue_id']] = entry
+        heapq.heapify(heap)
+        with self._lock:
+            self._heap, self._entries, self._stale = heap, entries, 0
+            self._loaded_at = now or time.time()
+
+    def _make_entry(self, row):
+        reported_at = row.get('reported_at')
+        ts = reported_at.timestamp() if hasattr(reported_at, 'timestamp') else 0.0 # No timestamp column: rescue_id order
+        summary = {
+            'rescue_id': row['rescue_id'], 'animal_type': row.get('animal_type'), 'location': row.get('location'),
+            'condition_details': row.get('condition_details'), 'image_filename': row.get('image_filename'),
+            'reported_at': reported_at, 'urgency': urgency_of(row.get('condition_details')),
+        }
+        return [-summary['urgency'], ts, row['rescue_id'], next(self._counter), summary, True]
+
+    def add(self, row):
+        entry = self._make_entry(row)
+        with self._lock:
+            old = self._entries.get(row['rescue_id'])
+            if old: old[-1] = False; self._stale += 1
+            self._entries[row['rescue_id']] = entry
+            heapq.heappush(self._heap, entry)
+
+    def remove(self, rescue_id):
+        with self._lock:
+            entry = self._entries.pop(rescue_id, None)
+            if not entry: return None
+            entry[-1] = False; self._stale += 1
+            if self._stale > 64 and self._stale > len(self._entries):
+                self._heap = [e for e in self._heap if e[-1]]; heapq.heapify(self._heap); self._stale = 0
+            return entry[4]
+
+    def top(self, limit=20):
+        # Most urgent open reports first; oldest first within the same urgency. Stale entries at the top
+        # are popped for good; below them the heap is walked lazily from the root, so the cost is
+        # O(limit log n) rather than a pass over every open report.
+        with self._lock:
+            heap = self._heap
+            while heap and not heap[0][-1]:
+                heapq.heappop(heap); self._stale -= 1
+            result = []
+            frontier = [(heap[0], 0)] if heap else []
+            while frontier and len(result) < limit:
+                entry, i = heapq.heappop(frontier)
+                if entry[-1]: result.append(entry[4])
+                for child in (2 * i + 1, 2 * i + 2):
+                    if child < len(heap): heapq.heappush(frontier, (heap[child], child))
+            return result
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def ensure_triage_columns(connection):
+    cur = connection.cursor()
+    try:
+        for statement in TRIAGE_DDL:
+            try:
+                cur.execute(statement)
+            except Exception as e:
+                # 1060 duplicate column / 1061 duplicate key: already migrated
+                if getattr(e, 'args', (None,))[0] not in (1060, 1061): raise
+        connection.commit()
+    finally:
+        cur.close()
+
+
+_reported_at_check = {} # 'rescues' -> (checked_at, column name or None)
+
+def reported_at_column(cur, now=None):
+    # Cached per worker; a missing column is looked for again every SCHEMA_RECHECK_SECONDS
+    now = now or time.time()
+    cached = _reported_at_check.get('rescues')
+    if cached and (cached[1] or now - cached[0] < SCHEMA_RECHECK_SECONDS): return cached[1]
+    cur.execute("SELECT column_name AS name FROM information_schema.columns WHERE table_schema = DATABASE() "
+                "AND table_name = 'rescues' AND data_type IN ('datetime', 'timestamp') AND column_name <> 'claimed_at' "
+                "ORDER BY ordinal_position")
+    names = [row['name'] for row in cur.fetchall()]
+    by_name = {name.lower(): name for name in names}
+    column = next((by_name[n] for n in REPORTED_AT_NAMES if n in by_name), names[0] if names else None)
+    _reported_at_check['rescues'] = (now, column)
+    return column
+
+def _reported_at(cur):
+    column = reported_at_column(cur)
+    return f"{column} AS reported_at" if column else "NULL AS reported_at"
+
+
+def load_open_rescues(cur):
+    cur.execute(f"SELECT rescue_id, animal_type, location, condition_details, image_filename, {_reported_at(cur)} "
+                "FROM rescues WHERE status = %s", (STATUS_OPEN,))
+    return cur.fetchall()
+
+def load_claimed_rescues(cur, user_id):
+    cur.execute(f"SELECT rescue_id, animal_type, location, condition_details, image_filename, {_reported_at(cur)} "
+                "FROM rescues WHERE status = %s AND claimed_by = %s ORDER BY claimed_at", (STATUS_CLAIMED, user_id))
+    return cur.fetchall()
+
+def fetch_rescue(cur, rescue_id):
+    cur.execute(f"SELECT rescue_id, animal_type, location, condition_details, image_filename, status, claimed_by, {_reported_at(cur)} "
+                "FROM rescues WHERE rescue_id = %s", (rescue_id,))
+    return cur.fetchone()
+
+
+# Compare-and-set transitions: each UPDATE only matches if the row is still in the expected state,
+# so rowcount tells the caller whether it won.
+def claim(cur, rescue_id, user_id):
+    cur.execute("UPDATE rescues SET status = %s, claimed_by = %s, claimed_at = NOW() WHERE rescue_id = %s AND status = %s",
+                (STATUS_CLAIMED, user_id, rescue_id, STATUS_OPEN))
+    return cur.rowcount == 1
+
+def release(cur, rescue_id, user_id):
+    cur.execute("UPDATE rescues SET status = %s, claimed_by = NULL, claimed_at = NULL WHERE rescue_id = %s AND status = %s AND claimed_by = %s",
+                (STATUS_OPEN, rescue_id, STATUS_CLAIMED, user_id))
+    return cur.rowcount == 1
+
+def resolve(cur, rescue_id, user_id):
+    cur.execute("UPDATE rescues SET status = %s WHERE rescue_id = %s AND status = %s AND claimed_by = %s",
+                (STATUS_RESOLVED, rescue_id, STATUS_CLAIMED, user_id))
+    return cur.rowcount == 1